@@ -16,8 +16,10 @@
 #include <sstream>
 
 #if defined(USE_PYTHON_LIB)
+#include <atomic>
 #include <memory>
 #include <pybind11/embed.h>
+#include <thread>
 namespace py = pybind11;
 #else
 #include <capture-progress/logging/logging.h>
@@ -48,17 +50,36 @@ class __attribute__((visibility("hidden"))) StupidFuckingIdiom {
     py::object progress;
 
     StupidFuckingIdiom(uint64_t captures, uint64_t samples_per_capture,
-                       bool hide) {
+                       bool hide)
+        : _hide(hide) {
         // TODO: Put print utils somewhere else???
         py::module_ mod_ = py::module_::import("ares_iq.print_utils");
         ctx = mod_.attr("CaptureProgress")(captures, samples_per_capture, hide);
     }
 
-    void start() { progress = ctx.attr("__enter__")(); }
-
-    void update() const { (void)progress.attr("update")(); }
+    void start() {
+        progress = ctx.attr("__enter__")();
+        if (!_hide) {
+            _refresh_thread = std::thread(&StupidFuckingIdiom::_refresh, this);
+        }
+    }
 
-    void stop(const void *exception) const {
+    // Called from the receive loop, so it only counts. The refresh thread
+    // takes the GIL to draw.
+    void update() { _pending.fetch_add(1, std::memory_order_relaxed); }
+
+    void stop(const void *exception) {
+        if (_refresh_thread.joinable()) {
+            _terminate.store(true);
+            // The refresh thread may be waiting for the GIL
+            std::unique_ptr<py::gil_scoped_release> release;
+            if (PyGILState_Check()) {
+                release.reset(new py::gil_scoped_release);
+            }
+            _refresh_thread.join();
+        }
+        py::gil_scoped_acquire gil;
+        _flush();
         if (exception) {
             auto e = static_cast<const py::error_already_set *>(exception);
             (void)ctx.attr("__exit__")(e->type(), e->value(), e->trace());
@@ -66,6 +87,27 @@ class __attribute__((visibility("hidden"))) StupidFuckingIdiom {
             ctx.attr("__exit__")(py::none(), py::none(), py::none());
         }
     }
+
+  private:
+    bool _hide;
+    std::atomic<uint64_t> _pending{0};
+    std::atomic_bool _terminate{false};
+    std::thread _refresh_thread;
+
+    void _refresh() {
+        while (!_terminate.load()) {
+            std::this_thread::sleep_for(std::chrono::milliseconds(100));
+            py::gil_scoped_acquire gil;
+            _flush();
+        }
+    }
+
+    void _flush() {
+        uint64_t steps = _pending.exchange(0);
+        if (steps) {
+            (void)progress.attr("update")(steps);
+        }
+    }
 };
 #endif // defined(USE_PYTHON_LIB)
 
@@ -0,0 +1,137 @@
+/**
+ * @file completed_queue.hpp
+ *
+ * @brief Bounded lock-free queue that hands completed captures from the
+ * receive threads to the thread that notifies Python.
+ *
+ * @date 10/19/26
+ *
+ * @author Tom Schmitz \<tschmitz@andrew.cmu.edu\>
+ */
+
+#ifndef ARES_IQ_COMPLETED_QUEUE_HPP
+#define ARES_IQ_COMPLETED_QUEUE_HPP
+
+#include <atomic>
+#include <cstddef>
+#include <cstdint>
+#include <memory>
+
+/**
+ * @struct CompletedCapture
+ *
+ * @brief A capture of one channel that the receive loop finished.
+ */
+struct CompletedCapture {
+    /// Channel of the capture.
+    size_t chan = 0;
+
+    /// Index of the capture in the capture buffer.
+    uint64_t index = 0;
+
+    /// Device time of the first sample.
+    double timestamp = 0;
+};
+
+/**
+ * @class CompletedQueue
+ *
+ * @brief Bounded multi-producer queue of completed captures. Pushing never
+ * blocks or takes a lock, so the receive threads never wait on the consumer.
+ * Each slot carries a sequence number that tells producers and the consumer
+ * whose turn it is.
+ */
+class CompletedQueue {
+  public:
+    /**
+     * Empty the queue and size it for at least `capacity` entries. Must not
+     * be called while other threads use the queue.
+     * @param[in] capacity The number of entries that can be queued at once.
+     */
+    void reset(size_t capacity) {
+        size_t size = 2;
+        while (size < capacity) {
+            size *= 2;
+        }
+        if (size != _size) {
+            _slots.reset(new Slot[size]);
+            _size = size;
+        }
+        for (size_t i = 0; i < size; i++) {
+            _slots[i].sequence.store(i, std::memory_order_relaxed);
+        }
+        _head.store(0, std::memory_order_relaxed);
+        _tail.store(0, std::memory_order_relaxed);
+        _dropped.store(0, std::memory_order_release);
+    }
+
+    /**
+     * Queue a completed capture. Safe to call from several threads at once.
+     * @param[in] capture The capture.
+     * @return False if the queue was full and the capture was dropped.
+     */
+    bool push(const CompletedCapture &capture) {
+        size_t mask = _size - 1;
+        size_t pos = _tail.load(std::memory_order_relaxed);
+        for (;;) {
+            Slot &slot = _slots[pos & mask];
+            size_t sequence = slot.sequence.load(std::memory_order_acquire);
+            auto diff = static_cast<std::ptrdiff_t>(sequence) -
+                        static_cast<std::ptrdiff_t>(pos);
+            if (diff == 0) {
+                if (_tail.compare_exchange_weak(pos, pos + 1,
+                                                std::memory_order_relaxed)) {
+                    slot.capture = capture;
+                    slot.sequence.store(pos + 1, std::memory_order_release);
+                    return true;
+                }
+            } else if (diff < 0) {
+                _dropped.fetch_add(1, std::memory_order_relaxed);
+                return false;
+            } else {
+                pos = _tail.load(std::memory_order_relaxed);
+            }
+        }
+    }
+
+    /**
+     * Take the oldest completed capture. Only one thread may pop.
+     * @param[out] capture The capture.
+     * @return False if the queue is empty.
+     */
+    bool pop(CompletedCapture &capture) {
+        size_t pos = _head.load(std::memory_order_relaxed);
+        Slot &slot = _slots[pos & (_size - 1)];
+        if (slot.sequence.load(std::memory_order_acquire) != pos + 1) {
+            return false;
+        }
+        capture = slot.capture;
+        slot.sequence.store(pos + _size, std::memory_order_release);
+        _head.store(pos + 1, std::memory_order_relaxed);
+        return true;
+    }
+
+    /**
+     * .
+     * @return Captures dropped because the queue was full since the last
+     * reset.
+     */
+    uint64_t dropped() const {
+        return _dropped.load(std::memory_order_acquire);
+    }
+
+  private:
+    struct Slot {
+        std::atomic<size_t> sequence{0};
+        CompletedCapture capture;
+    };
+
+    std::unique_ptr<Slot[]> _slots;
+    size_t _size = 0;
+    // Producers and the consumer update different cache lines
+    alignas(64) std::atomic<size_t> _tail{0};
+    alignas(64) std::atomic<size_t> _head{0};
+    std::atomic<uint64_t> _dropped{0};
+};
+
+#endif // ARES_IQ_COMPLETED_QUEUE_HPP
@@ -11,6 +11,9 @@
 #ifndef ARES_IQ_USRP_HPP
 #define ARES_IQ_USRP_HPP
 
+#include <ares-iq/usrp/completed_queue.hpp>
+#include <atomic>
+#include <capture-progress/progress.hpp>
 #include <complex>
 #include <pybind11/numpy.h>
 #include <string>
@@ -66,6 +69,61 @@ struct USRPconfigs {
 
     /// Receiver gain
     double gain = 0;
+
+    /// Use one streamer and receive thread per channel instead of a single
+    /// time aligned streamer for all channels.
+    bool streamer_per_channel = false;
+
+    /// Source used to set the device time. Empty leaves the device time
+    /// unsynchronized, "external" latches the host time on the external PPS
+    /// and "gpsdo" latches the GPS time on the GPSDO PPS.
+    std::string time_source;
+
+    /// Seconds between issuing the stream command and the start of the
+    /// capture. If above 0, captures start on the first whole second of
+    /// device time after the lead time so synchronized devices start on the
+    /// same sample.
+    double start_lead = 0;
+
+    /// CPUs the receive threads are pinned to. Empty leaves them on any CPU.
+    std::vector<int> acquisition_cpus;
+
+    /// SCHED_FIFO priority of the receive threads. 0 keeps the UHD default
+    /// priority.
+    int realtime_priority = 0;
+
+    /// Touch every page of new capture buffers before streaming so the
+    /// receive loop doesn't page fault.
+    bool prefault_buffers = true;
+
+    /// Lock the capture buffers in memory. Needs a large enough
+    /// RLIMIT_MEMLOCK.
+    bool lock_buffers = false;
+
+    /// Huge pages for the capture buffers. "none", "transparent" or
+    /// "explicit" (pages reserved with vm.nr_hugepages, falling back to
+    /// transparent huge pages).
+    std::string huge_pages = "none";
+};
+
+/**
+ * @struct CaptureBudget
+ *
+ * @brief How much a capture takes. The first of seconds, samples and bytes
+ * that is above 0 is used, and the capture is rounded up to whole captures.
+ */
+struct CaptureBudget {
+    /// Seconds of every channel at the actual sample rate.
+    double seconds = 0;
+
+    /// Samples of every channel.
+    uint64_t samples = 0;
+
+    /// Bytes of samples split evenly between the channels.
+    uint64_t bytes = 0;
+
+    /// Bytes of a sample in the storage format the bytes are counted in.
+    uint64_t sample_bytes = 2 * sizeof(COMPLEX_TEMPLATE_TYPE);
 };
 
 /**
@@ -89,12 +147,61 @@ class USRP {
      * Capture IQ data.
      * @param[in] center The center frequency to tune to.
      * @param[in] bw The bandwidth of the capture.
-     * @param[in] file_size_gb The amount of data to capture in GB.
-     * @return The captured complex data in a numpy array and the capture
-     * timestamps.
+     * @param[in] budget The amount of data to capture. It is converted to
+     * captures with the actual sample rate once the device is configured.
+     * @param[in] on_capture Optional callable invoked with (channel, samples,
+     * timestamp) after each capture completes. The receive threads queue the
+     * completed captures without taking the GIL and a Python thread calls it,
+     * so a slow callback delays the notifications but not the stream. The
+     * samples are a view into the capture buffer. When set, the built-in
+     * progress bar is hidden and progress reporting is left to the callback.
+     * An exception it raises stops the notifications and is raised once the
+     * capture ends.
+     * @return The captured complex data in a numpy array with the shape
+     * (channels, captures, samples per capture) and the capture timestamps
+     * with the shape (channels, captures).
+     * @note The capture buffers are page aligned and recycled. The returned
+     * arrays are views that are overwritten once every reserved buffer has been
+     * used by a later capture (see @ref reserve()).
+     */
+    py::tuple capture_iq(double center, double bw, const CaptureBudget &budget,
+                         bool verbose, bool extra,
+                         const py::object &on_capture = py::none());
+
+    /**
+     * Open and configure the device if it isn't configured yet, otherwise
+     * retune it. @ref capture_iq() does this before every capture.
+     * @param[in] center The center frequency to tune to.
+     * @param[in] bw The bandwidth of the capture.
+     * @param[in] extra Show the UHD logging messages.
+     * @throws std::invalid_argument If the device can't be opened or
+     * configured.
      */
-    py::tuple capture_iq(double center, double bw, double file_size_gb,
-                         bool verbose, bool extra);
+    void configure(double center, double bw, bool extra);
+
+    /**
+     * .
+     * @param[in] budget The amount of data to capture.
+     * @return The number of captures per channel the budget takes. Until the
+     * device is configured this uses the configured sample rate.
+     */
+    uint64_t captures_for(const CaptureBudget &budget) const;
+
+    /**
+     * Preallocate the capture buffers.
+     * @param[in] budget The largest capture the buffers must hold.
+     * @param[in] buffers The number of buffers to rotate between. The data
+     * returned by @ref capture_iq() stays valid for this many captures, which
+     * lets the caller consume one capture while the next one runs.
+     * @throws py::value_error If buffers is 0.
+     */
+    void reserve(const CaptureBudget &budget, size_t buffers);
+
+    /**
+     * Release the streamers, the device and the capture buffers. The next
+     * capture reopens and reconfigures the device.
+     */
+    void release();
 
     /**
      * Set the stream arguments.
@@ -142,21 +249,157 @@ class USRP {
      */
     double gain() const;
 
+    /**
+     * .
+     * @return The center frequency the RX channels are tuned to.
+     */
+    double center() const;
+
+    /**
+     * .
+     * @return The RX bandwidth.
+     */
+    double bandwidth() const;
+
+    /**
+     * .
+     * @return The device time in seconds at which the last tune took effect.
+     */
+    double tune_time() const;
+
+    /**
+     * .
+     * @return The device time in seconds at which the last capture started
+     * streaming.
+     */
+    double start_time() const;
+
+    /**
+     * .
+     * @return The time source used to synchronize the device time.
+     */
+    const std::string &time_source() const;
+
+    /**
+     * .
+     * @return The number of RX channels selected by the subdevice
+     * specification.
+     */
+    size_t channels() const;
+
+    /**
+     * .
+     * @return True if each channel has its own streamer and receive thread.
+     */
+    bool streamer_per_channel() const;
+
+    /**
+     * .
+     * @return The CPU each receive thread last ran on during the last
+     * capture.
+     */
+    const std::vector<int> &recv_cpus() const;
+
+    /**
+     * .
+     * @return True if the receive threads of the last capture ran with
+     * SCHED_FIFO.
+     */
+    bool recv_realtime() const;
+
+    /**
+     * .
+     * @return Seconds the last capture or reserve spent allocating,
+     * pre-faulting and locking capture buffers. This is not part of the capture
+     * time.
+     */
+    double warmup_time() const;
+
+    /**
+     * .
+     * @return Bytes of capture buffers allocated by the last capture or
+     * reserve.
+     */
+    uint64_t warmup_bytes() const;
+
+    /**
+     * .
+     * @return True if every buffer allocated by the last capture or reserve
+     * was locked in memory.
+     */
+    bool buffers_locked() const;
+
+    /**
+     * .
+     * @return The huge pages every buffer allocated by the last capture or
+     * reserve got: "none", "transparent" or "explicit".
+     */
+    std::string buffer_huge_pages() const;
+
+    /**
+     * .
+     * @return The number of overflows (samples the host didn't receive in
+     * time) during the last capture, summed over the channels.
+     */
+    uint64_t overflows() const;
+
+    /**
+     * .
+     * @return Seconds each recv call of the last capture took, one per capture
+     * and streamer.
+     */
+    const std::vector<double> &recv_latencies() const;
+
   private:
     typedef std::complex<COMPLEX_TEMPLATE_TYPE> complex_t;
 
+    // One entry per channel
     struct Capture {
-        complex_t *buf;
-        double *timestamp;
+        std::vector<void *> bufs;
+        std::vector<double *> timestamps;
+        // Position in the capture buffer
+        uint64_t index = 0;
         // Diagnostic info
         size_t samples;
     };
 
     USRPconfigs _configs;
     uhd::usrp::multi_usrp::sptr usrp;
-    std::shared_ptr<uhd::rx_streamer> rx_streamer;
+    std::vector<uhd::rx_streamer::sptr> rx_streamers;
     uhd::rx_metadata_t rx_meta;
+    struct CaptureBuffer {
+        py::array_t<complex_t> data;
+        py::array_t<double> times;
+    };
+
+    std::vector<CaptureBuffer> _buffers;
+    size_t _next_buffer = 0;
+    // Only touched with the GIL held
+    py::object _capture_base;
+    py::object _notifier;
+    py::object _notify_error;
+    // Completed captures on their way from the receive threads to _notifier
+    mutable CompletedQueue _completed;
+    std::atomic_bool _notifying{false};
+    std::atomic_bool _recv_done{false};
     int _spp = 200;
+    size_t _channels = 1;
+    double _center = 0;
+    double _bw = 0;
+    double _tune_time = 0;
+    double _start_time = 0;
+    double _first_recv_timeout = 0;
+    // Written by the receive threads, one entry each
+    std::vector<int> _recv_cpus;
+    bool _recv_realtime = false;
+    // Allocation of the buffers of the last capture or reserve
+    double _warmup_time = 0;
+    uint64_t _warmup_bytes = 0;
+    bool _buffers_locked = false;
+    int _huge_pages = 0;
+    // Receive statistics of the last capture
+    uint64_t _overflows = 0;
+    std::vector<double> _recv_latencies;
     bool configured = false;
 
     bool _extra_verbose = false;
@@ -166,8 +409,37 @@ class USRP {
 
     void _open_usrp();
     void _configure_usrp(double center, double bw);
-    void _start_stream() const;
+    uint64_t _captures_for(const CaptureBudget &budget, size_t channels) const;
+    void _fit_buffer(CaptureBuffer &buffer, size_t channels, uint64_t captures);
+    // Page aligned so captures can be written with O_DIRECT without a copy
+    py::array_t<complex_t> _page_aligned(size_t channels, uint64_t captures,
+                                         uint64_t samples_per_capture);
+    void *_map_buffer(size_t &bytes);
+    void _prefault(char *ptr, size_t bytes) const;
+    void _reset_warmup();
+    CaptureBuffer &_next_capture_buffer(uint64_t captures);
+    void _tune(double center, double bw);
+    void _wait_for_lo_lock() const;
+    void _make_streamers();
+    void _recv_aligned(std::vector<Capture> &data,
+                       CaptureProgress::Progress &progress);
+    void _recv_per_channel(std::vector<Capture> &data,
+                           CaptureProgress::Progress &progress);
+    void _recv_channel(size_t chan, std::vector<Capture> &data,
+                       CaptureProgress::Progress &progress,
+                       std::vector<double> &latencies,
+                       uint64_t &overflows) const;
+    void _reset_recv_stats(size_t recvs);
+    void _sync_time() const;
+    void _sync_time_to_gpsdo() const;
+    void _sync_time_to_pps() const;
+    void _notify(size_t chan, const Capture &capture) const;
+    void _start_notifier(const py::object &on_capture, uint64_t captures);
+    void _drain(const py::object &on_capture);
+    void _stop_notifier();
+    void _start_stream();
     void _stop_stream() const;
+    void _abort_capture();
     void _configure(double center, double bw);
 
     void _disable_console_output();
@@ -9,25 +9,51 @@
  * @author Tom Schmitz \<tschmitz@andrew.cmu.edu\>
  */
 
+#include <algorithm>
 #include <ares-iq/usrp/usrp.hpp>
 #include <boost/format.hpp>
 #include <capture-progress/progress.hpp>
+#include <chrono>
+#include <cmath>
 #include <exception>
+#include <fstream>
+#include <limits>
+#include <new>
 #include <pybind11/numpy.h>
 #include <pybind11/pybind11.h>
+#include <pybind11/stl.h>
+#include <thread>
 #include <uhd/usrp/multi_usrp.hpp>
 #include <uhd/utils/thread.hpp>
 #include <vector>
 
 extern "C" {
 #include <fcntl.h>
+#include <pthread.h>
+#include <sched.h>
+#include <sys/mman.h>
 #include <unistd.h>
 }
 
 namespace py = pybind11;
 
-constexpr int32_t timestamp_size = 8;
+// Absorbs the rounding of seconds * rate so exact durations don't take an
+// extra capture
+constexpr double sample_tolerance = 1e-6;
+constexpr double recv_timeout = 0.1;
+constexpr double stream_start_delay = 0.1;
+constexpr double tune_lead = 0.01;
+constexpr double lo_lock_timeout = 1.0;
+constexpr double gps_lock_timeout = 300.0;
+constexpr double pps_timeout = 1.5;
+constexpr double pps_latch_wait = 1.1;
 const std::string ant("RX");
+// Each pre-fault thread touches at least this much
+constexpr size_t prefault_chunk = 64 << 20;
+// Ordered from the least to the most huge page backing
+enum HugePages { no_huge_pages, transparent_huge_pages, explicit_huge_pages };
+const std::vector<std::string> huge_page_modes = {"none", "transparent",
+                                                  "explicit"};
 
 constexpr char ref_docstring[] =
     "Clock source for the USRP device. Note that every USRP device supports "
@@ -36,6 +62,108 @@ constexpr char ref_docstring[] =
     "each device in the Python abstraction layer, and to use strings "
     "internally.";
 
+constexpr char time_source_docstring[] =
+    "Source used to set the device time. Empty leaves the device time "
+    "unsynchronized, \"external\" latches the host time on the external PPS "
+    "and \"gpsdo\" latches the GPS time on the GPSDO PPS.";
+
+namespace {
+cpu_set_t to_cpu_set(const std::vector<int> &cpus) {
+    cpu_set_t set;
+    CPU_ZERO(&set);
+    for (int cpu : cpus) {
+        CPU_SET(cpu, &set);
+    }
+    return set;
+}
+
+int huge_page_mode(const std::string &mode) {
+    auto it = std::find(huge_page_modes.begin(), huge_page_modes.end(), mode);
+    return it == huge_page_modes.end()
+               ? 0
+               : static_cast<int>(it - huge_page_modes.begin());
+}
+
+size_t huge_page_size() {
+    std::ifstream meminfo("/proc/meminfo");
+    std::string key;
+    while (meminfo >> key) {
+        if (key == "Hugepagesize:") {
+            size_t kb = 0;
+            meminfo >> kb;
+            return kb * 1024;
+        }
+        meminfo.ignore(std::numeric_limits<std::streamsize>::max(), '\n');
+    }
+    return 2 << 20;
+}
+
+struct Mapping {
+    void *ptr;
+    size_t bytes;
+};
+
+/**
+ * Pins the current thread to the acquisition CPUs and sets its scheduling
+ * policy for the lifetime of the object, then restores the previous
+ * placement. Threads created while it is alive inherit the placement.
+ */
+class ThreadPlacement {
+  public:
+    explicit ThreadPlacement(const USRPconfigs &configs)
+        : _self(pthread_self()) {
+        _pin(configs.acquisition_cpus);
+        if (configs.realtime_priority > 0) {
+            _set_fifo(configs.realtime_priority);
+        } else {
+            uhd::set_thread_priority_safe();
+        }
+    }
+
+    ~ThreadPlacement() {
+        if (_pinned) {
+            pthread_setaffinity_np(_self, sizeof(_old_cpus), &_old_cpus);
+        }
+        if (_realtime) {
+            pthread_setschedparam(_self, _old_policy, &_old_param);
+        }
+    }
+
+    ThreadPlacement(const ThreadPlacement &) = delete;
+    ThreadPlacement &operator=(const ThreadPlacement &) = delete;
+
+    bool realtime() const { return _realtime; }
+
+  private:
+    pthread_t _self;
+    cpu_set_t _old_cpus{};
+    int _old_policy = SCHED_OTHER;
+    sched_param _old_param{};
+    bool _pinned = false;
+    bool _realtime = false;
+
+    void _pin(const std::vector<int> &cpus) {
+        if (cpus.empty() ||
+            pthread_getaffinity_np(_self, sizeof(_old_cpus), &_old_cpus) != 0) {
+            return;
+        }
+        cpu_set_t set = to_cpu_set(cpus);
+        _pinned = pthread_setaffinity_np(_self, sizeof(set), &set) == 0;
+    }
+
+    void _set_fifo(int priority) {
+        if (pthread_getschedparam(_self, &_old_policy, &_old_param) != 0) {
+            return;
+        }
+        sched_param param{};
+        param.sched_priority = priority;
+        // Fails without CAP_SYS_NICE or an rtprio limit, which recv_realtime
+        // reports
+        _realtime = pthread_setschedparam(_self, SCHED_FIFO, &param) == 0;
+    }
+};
+} // namespace
+
 PYBIND11_MODULE(_usrp, m, py::mod_gil_not_used()) {
     m.doc() = "USRP Platform low level interface";
 
@@ -51,13 +179,58 @@ PYBIND11_MODULE(_usrp, m, py::mod_gil_not_used()) {
                        "RX frontend specification")
         .def_readwrite("ref", &USRPconfigs::ref, ref_docstring)
         .def_readwrite("rate", &USRPconfigs::rate, "RX sample rate")
-        .def_readwrite("gain", &USRPconfigs::gain, "Overall RX gain");
+        .def_readwrite("gain", &USRPconfigs::gain, "Overall RX gain")
+        .def_readwrite("streamer_per_channel",
+                       &USRPconfigs::streamer_per_channel,
+                       "Use one streamer and receive thread per channel")
+        .def_readwrite("time_source", &USRPconfigs::time_source,
+                       time_source_docstring)
+        .def_readwrite("start_lead", &USRPconfigs::start_lead,
+                       "Seconds of lead time before a timed capture start")
+        .def_readwrite("acquisition_cpus", &USRPconfigs::acquisition_cpus,
+                       "CPUs the receive threads are pinned to")
+        .def_readwrite("realtime_priority", &USRPconfigs::realtime_priority,
+                       "SCHED_FIFO priority of the receive threads, 0 to "
+                       "keep the UHD default")
+        .def_readwrite("prefault_buffers", &USRPconfigs::prefault_buffers,
+                       "Touch every page of new capture buffers before "
+                       "streaming")
+        .def_readwrite("lock_buffers", &USRPconfigs::lock_buffers,
+                       "Lock the capture buffers in memory")
+        .def_readwrite("huge_pages", &USRPconfigs::huge_pages,
+                       "Huge pages for the capture buffers: \"none\", "
+                       "\"transparent\" or \"explicit\"");
+
+    py::class_<CaptureBudget>(m, "_CaptureBudget",
+                              "How much a capture takes. The first of "
+                              "seconds, samples and bytes above 0 is used.")
+        .def(py::init<>())
+        .def_readwrite("seconds", &CaptureBudget::seconds,
+                       "Seconds of every channel")
+        .def_readwrite("samples", &CaptureBudget::samples,
+                       "Samples of every channel")
+        .def_readwrite("bytes", &CaptureBudget::bytes,
+                       "Bytes of samples split evenly between the channels")
+        .def_readwrite("sample_bytes", &CaptureBudget::sample_bytes,
+                       "Bytes of a sample in the storage format");
 
     py::class_<USRP>(m, "_USRP",
                      "The base class for the USRP platform. This should be "
                      "wrapped with Python.")
         .def(py::init<const USRPconfigs &>())
-        .def("capture_iq", &USRP::capture_iq, "Capture IQ data")
+        .def("capture_iq", &USRP::capture_iq, "Capture IQ data",
+             py::arg("center"), py::arg("bw"), py::arg("budget"),
+             py::arg("verbose"), py::arg("extra"),
+             py::arg("on_capture") = py::none())
+        .def("configure", &USRP::configure,
+             "Open the device if it isn't open and tune it",
+             py::arg("center"), py::arg("bw"), py::arg("extra") = false)
+        .def("captures_for", &USRP::captures_for,
+             "Number of captures per channel a budget takes")
+        .def("close", &USRP::release,
+             "Release the device and the capture buffers")
+        .def("reserve", &USRP::reserve, "Preallocate the capture buffers",
+             py::arg("budget"), py::arg("buffers") = 1)
         .def("_set_stream_args", &USRP::set_stream_args)
         .def_property_readonly("dev_args", &USRP::dev_args, "Device arguments")
         .def_property_readonly("samples_per_capture",
@@ -68,63 +241,458 @@ PYBIND11_MODULE(_usrp, m, py::mod_gil_not_used()) {
         .def_property_readonly("ref", &USRP::ref,
                                "Clock source for the USRP device")
         .def_property_readonly("rate", &USRP::rate, "RX sample rate")
-        .def_property_readonly("gain", &USRP::gain, "Overall RX gain");
+        .def_property_readonly("gain", &USRP::gain, "Overall RX gain")
+        .def_property_readonly("center", &USRP::center, "RX center frequency")
+        .def_property_readonly("bandwidth", &USRP::bandwidth, "RX bandwidth")
+        .def_property_readonly("tune_time", &USRP::tune_time,
+                               "Device time of the last tune")
+        .def_property_readonly("start_time", &USRP::start_time,
+                               "Device time the last capture started")
+        .def_property_readonly("time_source", &USRP::time_source,
+                               "Source of the device time")
+        .def_property_readonly("channels", &USRP::channels,
+                               "Number of RX channels")
+        .def_property_readonly("streamer_per_channel",
+                               &USRP::streamer_per_channel,
+                               "Use one streamer and receive thread per "
+                               "channel")
+        .def_property_readonly("recv_cpus", &USRP::recv_cpus,
+                               "CPU each receive thread last ran on")
+        .def_property_readonly("recv_realtime", &USRP::recv_realtime,
+                               "Whether the receive threads ran with "
+                               "SCHED_FIFO")
+        .def_property_readonly("warmup_time", &USRP::warmup_time,
+                               "Seconds spent preparing new capture buffers")
+        .def_property_readonly("warmup_bytes", &USRP::warmup_bytes,
+                               "Bytes of new capture buffers")
+        .def_property_readonly("buffers_locked", &USRP::buffers_locked,
+                               "Whether the new capture buffers are locked")
+        .def_property_readonly("buffer_huge_pages", &USRP::buffer_huge_pages,
+                               "Huge pages of the new capture buffers")
+        .def_property_readonly("overflows", &USRP::overflows,
+                               "Overflows during the last capture")
+        .def_property_readonly("recv_latencies", &USRP::recv_latencies,
+                               "Seconds each recv call of the last capture "
+                               "took");
 }
 
 USRP::USRP(const USRPconfigs &configs) { _configs = configs; }
 
-py::tuple USRP::capture_iq(double center, double bw, double file_size_gb,
-                           bool verbose, bool extra) {
-    _extra_verbose = extra;
-    if (!configured) {
-        _configure(center, bw);
-    } else {
-        usrp->set_rx_freq(uhd::tune_request_t(center));
-        usrp->set_rx_bandwidth(bw);
-    }
+py::tuple USRP::capture_iq(double center, double bw,
+                           const CaptureBudget &budget, bool verbose,
+                           bool extra, const py::object &on_capture) {
+    configure(center, bw, extra);
 
     uint64_t samples_per_capture = _configs.samples_per_capture;
-    auto file_size = static_cast<uint64_t>(file_size_gb * 1e9);
-    uint64_t bytes_per_capture =
-        (samples_per_capture * 2 * sizeof(COMPLEX_TEMPLATE_TYPE)) +
-        timestamp_size;
-    uint64_t captures = file_size / bytes_per_capture;
+    uint64_t captures = _captures_for(budget, _channels);
 
     std::vector<Capture> data(captures);
 
-    py::array_t<complex_t> data_array({captures, samples_per_capture});
-    py::buffer_info data_buf_info = data_array.request(true);
-
-    py::array_t<double> capture_times(static_cast<ssize_t>(captures));
-    py::buffer_info time_buf_info = capture_times.request(true);
+    _reset_warmup();
+    CaptureBuffer &buffer = _next_capture_buffer(captures);
+    auto capacity = static_cast<uint64_t>(buffer.data.shape(1));
+    py::buffer_info data_buf_info = buffer.data.request(true);
+    py::buffer_info time_buf_info = buffer.times.request(true);
 
     for (size_t i = 0; i < captures; i++) {
-        data[i].buf = static_cast<complex_t *>(data_buf_info.ptr) +
-                      (i * samples_per_capture);
-        data[i].timestamp = static_cast<double *>(time_buf_info.ptr) + i;
+        data[i].bufs.resize(_channels);
+        data[i].timestamps.resize(_channels);
+        for (size_t chan = 0; chan < _channels; chan++) {
+            data[i].bufs[chan] = static_cast<complex_t *>(data_buf_info.ptr) +
+                                 ((chan * capacity + i) * samples_per_capture);
+            data[i].timestamps[chan] =
+                static_cast<double *>(time_buf_info.ptr) + (chan * capacity) +
+                i;
+        }
+        data[i].index = i;
     }
 
-    CaptureProgress::Progress progress(captures, samples_per_capture, !(verbose || extra));
+    _capture_base = buffer.data;
+    if (!on_capture.is_none()) {
+        _start_notifier(on_capture, captures * _channels);
+    }
+    CaptureProgress::Progress progress(
+        captures * _channels, samples_per_capture,
+        !(verbose || extra) || !on_capture.is_none());
 
     progress.start();
-    _start_stream();
     try {
-        for (auto &capture : data) {
-            uhd::rx_streamer::buffs_type buf = {
-                static_cast<void *>(capture.buf)};
-            capture.samples =
-                rx_streamer->recv(buf, samples_per_capture, rx_meta);
-            *capture.timestamp = rx_meta.time_spec.get_real_secs();
-            progress.update();
+        // Let Python threads (e.g. writers of the previous capture) run
+        py::gil_scoped_release release;
+        _start_stream();
+        if (rx_streamers.size() == 1) {
+            _recv_aligned(data, progress);
+        } else {
+            _recv_per_channel(data, progress);
         }
         _stop_stream();
         progress.update();
     } catch (const py::error_already_set &e) {
+        _abort_capture();
         progress.stop(&e);
         throw;
+    } catch (...) {
+        // UHD errors and start timeouts must not leave the stream running
+        _abort_capture();
+        progress.stop();
+        throw;
+    }
+    _stop_notifier();
+    _capture_base = py::none();
+    if (!_notify_error.is_none()) {
+        py::object error = _notify_error;
+        _notify_error = py::none();
+        PyErr_SetObject(reinterpret_cast<PyObject *>(Py_TYPE(error.ptr())),
+                        error.ptr());
+        throw py::error_already_set();
+    }
+
+    py::slice channels(0, static_cast<ssize_t>(_channels), 1);
+    py::slice filled(0, static_cast<ssize_t>(captures), 1);
+    py::object data_view = buffer.data[py::make_tuple(channels, filled)];
+    py::object times_view = buffer.times[py::make_tuple(channels, filled)];
+    return py::make_tuple(data_view, times_view);
+}
+
+void USRP::configure(double center, double bw, bool extra) {
+    _extra_verbose = extra;
+    if (!configured) {
+        _configure(center, bw);
+    } else {
+        _tune(center, bw);
+    }
+}
+
+uint64_t USRP::captures_for(const CaptureBudget &budget) const {
+    return _captures_for(budget, channels());
+}
+
+void USRP::reserve(const CaptureBudget &budget, size_t buffers) {
+    if (buffers == 0) {
+        throw py::value_error("buffers must be above 0");
+    }
+    _reset_warmup();
+
+    size_t chans = channels();
+    uint64_t captures = _captures_for(budget, chans);
+    _buffers.resize(buffers);
+    _next_buffer = 0;
+    for (auto &buffer : _buffers) {
+        _fit_buffer(buffer, chans, captures);
+    }
+}
+
+uint64_t USRP::_captures_for(const CaptureBudget &budget,
+                             size_t channels) const {
+    uint64_t samples_per_capture = _configs.samples_per_capture;
+    uint64_t samples = budget.samples;
+    if (budget.seconds > 0) {
+        samples = static_cast<uint64_t>(
+            std::ceil(budget.seconds * rate() - sample_tolerance));
+    } else if (budget.samples == 0) {
+        uint64_t bytes_per_sample = budget.sample_bytes * channels;
+        samples = (budget.bytes + bytes_per_sample - 1) / bytes_per_sample;
+    }
+    // Rounded up so the capture holds at least the budget
+    return (samples + samples_per_capture - 1) / samples_per_capture;
+}
+
+void USRP::_fit_buffer(CaptureBuffer &buffer, size_t channels,
+                       uint64_t captures) {
+    uint64_t samples_per_capture = _configs.samples_per_capture;
+    bool fits =
+        buffer.data.ndim() == 3 &&
+        static_cast<size_t>(buffer.data.shape(0)) == channels &&
+        static_cast<uint64_t>(buffer.data.shape(1)) >= captures &&
+        static_cast<uint64_t>(buffer.data.shape(2)) == samples_per_capture;
+    if (fits) {
+        return;
+    }
+
+    auto start = std::chrono::steady_clock::now();
+    buffer.data = _page_aligned(channels, captures, samples_per_capture);
+    buffer.times = py::array_t<double>({channels, captures});
+    _warmup_time +=
+        std::chrono::duration<double>(std::chrono::steady_clock::now() - start)
+            .count();
+}
+
+py::array_t<USRP::complex_t> USRP::_page_aligned(size_t channels,
+                                                 uint64_t captures,
+                                                 uint64_t samples_per_capture) {
+    size_t bytes = std::max<size_t>(
+        channels * captures * samples_per_capture * sizeof(complex_t), 1);
+    void *ptr = _map_buffer(bytes);
+    if (_configs.prefault_buffers) {
+        _prefault(static_cast<char *>(ptr), bytes);
+    }
+    _buffers_locked = _buffers_locked && mlock(ptr, bytes) == 0;
+    _warmup_bytes += bytes;
+
+    py::capsule owner(new Mapping{ptr, bytes}, [](void *p) {
+        auto *mapping = static_cast<Mapping *>(p);
+        munmap(mapping->ptr, mapping->bytes);
+        delete mapping;
+    });
+    return py::array_t<complex_t>({channels, static_cast<size_t>(captures),
+                                   static_cast<size_t>(samples_per_capture)},
+                                  static_cast<complex_t *>(ptr), owner);
+}
+
+void *USRP::_map_buffer(size_t &bytes) {
+    int flags = MAP_PRIVATE | MAP_ANONYMOUS;
+    int mode = huge_page_mode(_configs.huge_pages);
+    if (mode == explicit_huge_pages) {
+        size_t huge = huge_page_size();
+        size_t rounded = (bytes + huge - 1) / huge * huge;
+        void *ptr = mmap(nullptr, rounded, PROT_READ | PROT_WRITE,
+                         flags | MAP_HUGETLB, -1, 0);
+        if (ptr != MAP_FAILED) {
+            bytes = rounded;
+            return ptr;
+        }
+        // Not enough pages reserved
+        mode = transparent_huge_pages;
+    }
+
+    void *ptr = mmap(nullptr, bytes, PROT_READ | PROT_WRITE, flags, -1, 0);
+    if (ptr == MAP_FAILED) {
+        throw std::bad_alloc();
+    }
+    if (mode == transparent_huge_pages &&
+        madvise(ptr, bytes, MADV_HUGEPAGE) != 0) {
+        mode = no_huge_pages;
     }
+    _huge_pages = std::min(_huge_pages, mode);
+    return ptr;
+}
+
+void USRP::_prefault(char *ptr, size_t bytes) const {
+    auto page = static_cast<size_t>(sysconf(_SC_PAGESIZE));
+    size_t threads = std::max<size_t>(
+        1, std::min<size_t>(std::thread::hardware_concurrency(),
+                            bytes / prefault_chunk));
+    size_t share = (bytes / threads + page - 1) / page * page;
+
+    std::vector<std::thread> workers;
+    for (size_t i = 0; i < threads; i++) {
+        workers.emplace_back([this, ptr, bytes, page, share, i]() {
+            // Pinned like the receive threads so the pages land on their
+            // NUMA node
+            if (!_configs.acquisition_cpus.empty()) {
+                cpu_set_t set = to_cpu_set(_configs.acquisition_cpus);
+                pthread_setaffinity_np(pthread_self(), sizeof(set), &set);
+            }
+            volatile char *pages = ptr;
+            size_t end = std::min(bytes, (i + 1) * share);
+            for (size_t offset = i * share; offset < end; offset += page) {
+                pages[offset] = 0;
+            }
+        });
+    }
+    for (auto &worker : workers) {
+        worker.join();
+    }
+}
+
+void USRP::_reset_recv_stats(size_t recvs) {
+    _overflows = 0;
+    _recv_latencies.clear();
+    _recv_latencies.reserve(recvs);
+}
+
+void USRP::_reset_warmup() {
+    _warmup_time = 0;
+    _warmup_bytes = 0;
+    _buffers_locked = _configs.lock_buffers;
+    _huge_pages = huge_page_mode(_configs.huge_pages);
+}
+
+USRP::CaptureBuffer &USRP::_next_capture_buffer(uint64_t captures) {
+    if (_buffers.empty()) {
+        _buffers.resize(1);
+    }
+
+    CaptureBuffer &buffer = _buffers[_next_buffer];
+    _next_buffer = (_next_buffer + 1) % _buffers.size();
+    _fit_buffer(buffer, _channels, captures);
+    return buffer;
+}
+
+void USRP::_notify(size_t chan, const Capture &capture) const {
+    // Never takes the GIL, Python may hold it for a long time
+    if (_notifying.load(std::memory_order_relaxed)) {
+        CompletedCapture completed;
+        completed.chan = chan;
+        completed.index = capture.index;
+        completed.timestamp = *capture.timestamps[chan];
+        _completed.push(completed);
+    }
+}
 
-    return py::make_tuple(data_array, capture_times);
+void USRP::_start_notifier(const py::object &on_capture, uint64_t captures) {
+    // Room for every capture, so the receive threads never drop one
+    _completed.reset(captures);
+    _notify_error = py::none();
+    _recv_done.store(false, std::memory_order_release);
+    _notifying.store(true, std::memory_order_release);
+    _notifier = py::module_::import("threading")
+                    .attr("Thread")(py::arg("target") = py::cpp_function(
+                                        [this, on_capture]() {
+                                            _drain(on_capture);
+                                        }),
+                                    py::arg("name") = "usrp-notify",
+                                    py::arg("daemon") = true);
+    _notifier.attr("start")();
+}
+
+void USRP::_drain(const py::object &on_capture) {
+    constexpr size_t max_batch = 64;
+    auto base = py::reinterpret_borrow<py::array_t<complex_t>>(_capture_base);
+    auto spc = static_cast<ssize_t>(_configs.samples_per_capture);
+    std::vector<CompletedCapture> batch;
+    batch.reserve(max_batch);
+    bool finished = false;
+    while (!finished || !batch.empty()) {
+        batch.clear();
+        {
+            py::gil_scoped_release release;
+            for (;;) {
+                // Read before popping so nothing pushed before the end is
+                // left behind
+                finished = _recv_done.load(std::memory_order_acquire);
+                CompletedCapture capture;
+                while (batch.size() < max_batch && _completed.pop(capture)) {
+                    batch.push_back(capture);
+                }
+                if (!batch.empty() || finished) {
+                    break;
+                }
+                std::this_thread::sleep_for(std::chrono::microseconds(200));
+            }
+        }
+        for (const auto &capture : batch) {
+            if (!_notify_error.is_none()) {
+                break;
+            }
+            py::array_t<complex_t> samples(
+                {spc}, {static_cast<ssize_t>(sizeof(complex_t))},
+                base.mutable_data(static_cast<ssize_t>(capture.chan),
+                                  static_cast<ssize_t>(capture.index)),
+                base);
+            try {
+                on_capture(capture.chan, samples, capture.timestamp);
+            } catch (py::error_already_set &e) {
+                _notify_error = e.value();
+            }
+        }
+    }
+}
+
+void USRP::_stop_notifier() {
+    if (_notifier.is_none()) {
+        return;
+    }
+    _recv_done.store(true, std::memory_order_release);
+    // Thread.join releases the GIL while the notifier finishes the queue
+    _notifier.attr("join")();
+    _notifier = py::none();
+    _notifying.store(false, std::memory_order_release);
+}
+
+void USRP::_recv_aligned(std::vector<Capture> &data,
+                         CaptureProgress::Progress &progress) {
+    // Runs on the calling thread, which gets its placement back afterwards
+    ThreadPlacement placement(_configs);
+    _recv_cpus.assign(1, -1);
+    _recv_realtime = placement.realtime();
+    _reset_recv_stats(data.size());
+    double timeout = _first_recv_timeout;
+    for (auto &capture : data) {
+        auto start = std::chrono::steady_clock::now();
+        capture.samples = rx_streamers[0]->recv(
+            capture.bufs, _configs.samples_per_capture, rx_meta, timeout);
+        _recv_latencies.push_back(std::chrono::duration<double>(
+                                      std::chrono::steady_clock::now() - start)
+                                      .count());
+        _overflows +=
+            rx_meta.error_code == uhd::rx_metadata_t::ERROR_CODE_OVERFLOW;
+        for (auto timestamp : capture.timestamps) {
+            *timestamp = rx_meta.time_spec.get_real_secs();
+        }
+        for (size_t chan = 0; chan < _channels; chan++) {
+            progress.update();
+            _notify(chan, capture);
+        }
+        timeout = recv_timeout;
+    }
+    _recv_cpus[0] = sched_getcpu();
+}
+
+void USRP::_recv_per_channel(std::vector<Capture> &data,
+                             CaptureProgress::Progress &progress) {
+    std::vector<std::thread> threads;
+    std::vector<std::exception_ptr> errors(_channels);
+    std::vector<char> realtime(_channels, 0);
+    std::vector<std::vector<double>> latencies(_channels);
+    std::vector<uint64_t> overflows(_channels, 0);
+    _recv_cpus.assign(_channels, -1);
+    _reset_recv_stats(data.size() * _channels);
+
+    for (size_t chan = 0; chan < _channels; chan++) {
+        threads.emplace_back([this, chan, &data, &progress, &errors, &realtime,
+                              &latencies, &overflows]() {
+            ThreadPlacement placement(_configs);
+            realtime[chan] = placement.realtime();
+            try {
+                _recv_channel(chan, data, progress, latencies[chan],
+                              overflows[chan]);
+            } catch (...) {
+                errors[chan] = std::current_exception();
+            }
+            _recv_cpus[chan] = sched_getcpu();
+        });
+    }
+
+    for (auto &thread : threads) {
+        thread.join();
+    }
+    _recv_realtime = std::all_of(realtime.begin(), realtime.end(),
+                                 [](char flag) { return flag != 0; });
+    for (size_t chan = 0; chan < _channels; chan++) {
+        _recv_latencies.insert(_recv_latencies.end(), latencies[chan].begin(),
+                               latencies[chan].end());
+        _overflows += overflows[chan];
+    }
+
+    for (auto &err : errors) {
+        if (err) {
+            std::rethrow_exception(err);
+        }
+    }
+}
+
+void USRP::_recv_channel(size_t chan, std::vector<Capture> &data,
+                         CaptureProgress::Progress &progress,
+                         std::vector<double> &latencies,
+                         uint64_t &overflows) const {
+    uhd::rx_metadata_t meta;
+    double timeout = _first_recv_timeout;
+    latencies.reserve(data.size());
+    for (auto &capture : data) {
+        uhd::rx_streamer::buffs_type buf(capture.bufs[chan]);
+        auto start = std::chrono::steady_clock::now();
+        rx_streamers[chan]->recv(buf, _configs.samples_per_capture, meta,
+                                 timeout);
+        latencies.push_back(std::chrono::duration<double>(
+                                std::chrono::steady_clock::now() - start)
+                                .count());
+        overflows += meta.error_code == uhd::rx_metadata_t::ERROR_CODE_OVERFLOW;
+        *capture.timestamps[chan] = meta.time_spec.get_real_secs();
+        progress.update();
+        _notify(chan, capture);
+        timeout = recv_timeout;
+    }
 }
 
 void USRP::_open_usrp() {
@@ -136,29 +704,176 @@ void USRP::_open_usrp() {
 
 void USRP::_configure_usrp(double center, double bw) {
     usrp->set_clock_source(_configs.ref);
+    _sync_time();
     usrp->set_rx_subdev_spec(_configs.subdev);
     usrp->set_rx_rate(_configs.rate);
-    usrp->set_rx_freq(uhd::tune_request_t(center));
-    usrp->set_rx_gain(_configs.gain);
-    usrp->set_rx_bandwidth(bw);
-    usrp->set_rx_antenna(ant);
+    _channels = usrp->get_rx_num_channels();
+    for (size_t chan = 0; chan < _channels; chan++) {
+        usrp->set_rx_gain(_configs.gain, chan);
+        usrp->set_rx_antenna(ant, chan);
+    }
+    _tune(center, bw);
+    _make_streamers();
+}
+
+void USRP::_sync_time() const {
+    if (_configs.time_source.empty()) {
+        return;
+    }
+
+    usrp->set_time_source(_configs.time_source);
+    if (_configs.time_source == "gpsdo") {
+        _sync_time_to_gpsdo();
+    } else {
+        _sync_time_to_pps();
+    }
+
+    // Give the next PPS edge time to latch the new device time
+    std::this_thread::sleep_for(std::chrono::duration<double>(pps_latch_wait));
+}
+
+void USRP::_sync_time_to_gpsdo() const {
+    auto deadline = std::chrono::steady_clock::now() +
+                    std::chrono::duration<double>(gps_lock_timeout);
+    while (!usrp->get_mboard_sensor("gps_locked").to_bool()) {
+        if (std::chrono::steady_clock::now() > deadline) {
+            throw std::runtime_error("GPSDO failed to lock");
+        }
+        std::this_thread::sleep_for(std::chrono::seconds(1));
+    }
+
+    // gps_time updates on the PPS edge, so wait for the edge before reading
+    // it to avoid latching a time that is off by one second.
+    _sync_time_to_pps();
+    int64_t gps_time = usrp->get_mboard_sensor("gps_time").to_int();
+    usrp->set_time_next_pps(uhd::time_spec_t(gps_time + 1, 0.0));
+}
+
+void USRP::_sync_time_to_pps() const {
+    uhd::time_spec_t last_pps = usrp->get_time_last_pps();
+    auto deadline = std::chrono::steady_clock::now() +
+                    std::chrono::duration<double>(pps_timeout);
+    while (usrp->get_time_last_pps() == last_pps) {
+        if (std::chrono::steady_clock::now() > deadline) {
+            throw std::runtime_error("No PPS signal detected");
+        }
+        std::this_thread::sleep_for(std::chrono::milliseconds(1));
+    }
 
+    if (_configs.time_source == "gpsdo") {
+        return;
+    }
+
+    // Just after a PPS edge, so the next edge is the next whole host second.
+    // This relies on the host clock being disciplined (e.g. NTP) to well
+    // under half a second.
+    auto host_time = std::chrono::duration_cast<std::chrono::seconds>(
+                         std::chrono::system_clock::now().time_since_epoch())
+                         .count();
+    usrp->set_time_next_pps(
+        uhd::time_spec_t(static_cast<int64_t>(host_time) + 1, 0.0));
+}
+
+void USRP::_tune(double center, double bw) {
+    // Timed tune so every channel retunes on the same sample while the
+    // streamer stays configured.
+    uhd::time_spec_t tune_time =
+        usrp->get_time_now() + uhd::time_spec_t(tune_lead);
+    usrp->set_command_time(tune_time);
+    for (size_t chan = 0; chan < _channels; chan++) {
+        usrp->set_rx_freq(uhd::tune_request_t(center), chan);
+    }
+    usrp->clear_command_time();
+
+    for (size_t chan = 0; chan < _channels; chan++) {
+        usrp->set_rx_bandwidth(bw, chan);
+    }
+
+    _wait_for_lo_lock();
+    _center = center;
+    _bw = bw;
+    _tune_time = tune_time.get_real_secs();
+}
+
+void USRP::_wait_for_lo_lock() const {
+    std::this_thread::sleep_for(std::chrono::duration<double>(tune_lead));
+
+    std::vector<std::string> sensors = usrp->get_rx_sensor_names(0);
+    if (std::find(sensors.begin(), sensors.end(), "lo_locked") ==
+        sensors.end()) {
+        return;
+    }
+
+    auto deadline = std::chrono::steady_clock::now() +
+                    std::chrono::duration<double>(lo_lock_timeout);
+    for (size_t chan = 0; chan < _channels; chan++) {
+        while (!usrp->get_rx_sensor("lo_locked", chan).to_bool() &&
+               std::chrono::steady_clock::now() < deadline) {
+            std::this_thread::sleep_for(std::chrono::milliseconds(1));
+        }
+    }
+}
+
+void USRP::_make_streamers() {
     uhd::stream_args_t stream_args = uhd::stream_args_t("fc32", "sc16");
     stream_args.args = (boost::format("spp=%d") % _spp).str();
-    rx_streamer = usrp->get_rx_stream(stream_args);
+    rx_streamers.clear();
+
+    if (!_configs.streamer_per_channel) {
+        for (size_t chan = 0; chan < _channels; chan++) {
+            stream_args.channels.push_back(chan);
+        }
+        rx_streamers.push_back(usrp->get_rx_stream(stream_args));
+        return;
+    }
+
+    for (size_t chan = 0; chan < _channels; chan++) {
+        stream_args.channels = std::vector<size_t>(1, chan);
+        rx_streamers.push_back(usrp->get_rx_stream(stream_args));
+    }
 }
 
-void USRP::_start_stream() const {
+void USRP::_start_stream() {
     uhd::stream_cmd_t cmd(
         uhd::stream_cmd_t::stream_mode_t::STREAM_MODE_START_CONTINUOUS);
-    cmd.stream_now = true;
-    rx_streamer->issue_stream_cmd(cmd);
+    uhd::time_spec_t now = usrp->get_time_now();
+    // Multiple channels must start on the same sample to stay aligned
+    cmd.stream_now = _channels == 1 && _configs.start_lead <= 0;
+    cmd.time_spec = now;
+
+    if (_configs.start_lead > 0) {
+        cmd.time_spec =
+            uhd::time_spec_t(static_cast<int64_t>(std::ceil(
+                                 (now.get_real_secs() + _configs.start_lead))),
+                             0.0);
+    } else if (!cmd.stream_now) {
+        cmd.time_spec = now + uhd::time_spec_t(stream_start_delay);
+    }
+
+    _start_time = cmd.time_spec.get_real_secs();
+    _first_recv_timeout = (cmd.time_spec - now).get_real_secs() + recv_timeout;
+    for (const auto &streamer : rx_streamers) {
+        streamer->issue_stream_cmd(cmd);
+    }
+}
+
+void USRP::_abort_capture() {
+    try {
+        _stop_stream();
+    } catch (...) {
+        // The error that aborted the capture is the one reported
+    }
+    _stop_notifier();
+    _notify_error = py::none();
+    _capture_base = py::none();
 }
 
 void USRP::_stop_stream() const {
     uhd::stream_cmd_t cmd(
         uhd::stream_cmd_t::stream_mode_t::STREAM_MODE_STOP_CONTINUOUS);
-    rx_streamer->issue_stream_cmd(cmd);
+    for (const auto &streamer : rx_streamers) {
+        streamer->issue_stream_cmd(cmd);
+    }
 }
 
 void USRP::_configure(double center, double bw) {
@@ -213,6 +928,14 @@ void USRP::_enable_console_output() const {
     close(_dev_null);
 }
 
+void USRP::release() {
+    rx_streamers.clear();
+    usrp.reset();
+    configured = false;
+    _buffers.clear();
+    _next_buffer = 0;
+}
+
 void USRP::set_stream_args(int spp) {
     if (spp < 1) {
         throw py::value_error(
@@ -256,6 +979,57 @@ double USRP::gain() const {
     return _configs.gain;
 }
 
+double USRP::center() const {
+    if (configured) {
+        return usrp->get_rx_freq();
+    }
+    return _center;
+}
+
+double USRP::bandwidth() const {
+    if (configured) {
+        return usrp->get_rx_bandwidth();
+    }
+    return _bw;
+}
+
+double USRP::tune_time() const { return _tune_time; }
+
+double USRP::start_time() const { return _start_time; }
+
+const std::string &USRP::time_source() const { return _configs.time_source; }
+
+size_t USRP::channels() const {
+    if (configured) {
+        return _channels;
+    }
+    return uhd::usrp::subdev_spec_t(_configs.subdev).size();
+}
+
+bool USRP::streamer_per_channel() const {
+    return _configs.streamer_per_channel;
+}
+
+const std::vector<int> &USRP::recv_cpus() const { return _recv_cpus; }
+
+bool USRP::recv_realtime() const { return _recv_realtime; }
+
+double USRP::warmup_time() const { return _warmup_time; }
+
+uint64_t USRP::warmup_bytes() const { return _warmup_bytes; }
+
+bool USRP::buffers_locked() const { return _buffers_locked; }
+
+uint64_t USRP::overflows() const { return _overflows; }
+
+const std::vector<double> &USRP::recv_latencies() const {
+    return _recv_latencies;
+}
+
+std::string USRP::buffer_huge_pages() const {
+    return huge_page_modes[static_cast<size_t>(_huge_pages)];
+}
+
 void USRPconfigs::set_samples_per_capture(uint64_t spc) {
     if (spc == 0u) {
         throw std::range_error("samples_per_capture must be above 0");
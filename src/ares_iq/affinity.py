@@ -0,0 +1,344 @@
+"""Placement of the capture threads on CPUs and NUMA nodes."""
+
+import os
+import threading
+from configparser import SectionProxy
+from contextlib import contextmanager
+from pathlib import Path
+from typing import NamedTuple
+
+from rich.table import Table
+
+from .configurations import load_config_section
+from .print_utils import print_error, print_warning
+
+ROLES = ("acquisition", "writer", "worker")
+"""Thread roles with their own CPUs. acquisition: threads receiving from the
+device, writer: threads writing captures to disk, worker: threads and processes
+analyzing captures.
+"""
+
+NODE_DIR = Path("/sys/devices/system/node")
+_POLICIES = {
+    os.SCHED_OTHER: "other",
+    os.SCHED_FIFO: "fifo",
+    os.SCHED_RR: "rr",
+    os.SCHED_BATCH: "batch",
+    os.SCHED_IDLE: "idle",
+}
+
+
+def parse_cpus(spec: str) -> tuple[int, ...]:
+    """Parse a CPU list like `0-3,8` as used by the kernel and taskset."""
+    cpus: set[int] = set()
+    for part in spec.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        low, _, high = part.partition("-")
+        first, last = int(low), int(high or low)
+        if first < 0 or last < first:
+            raise ValueError(f"Invalid CPU range {part}")
+        cpus.update(range(first, last + 1))
+    return tuple(sorted(cpus))
+
+
+def format_cpus(cpus) -> str:
+    """The inverse of `parse_cpus`."""
+    ranges: list[list[int]] = []
+    for cpu in sorted(cpus):
+        if ranges and ranges[-1][1] == cpu - 1:
+            ranges[-1][1] = cpu
+        else:
+            ranges.append([cpu, cpu])
+    return ",".join(
+        str(first) if first == last else f"{first}-{last}"
+        for first, last in ranges
+    )
+
+
+def node_cpus(node: int) -> tuple[int, ...]:
+    """CPUs of a NUMA node. Empty if the node doesn't exist."""
+    try:
+        return parse_cpus((NODE_DIR / f"node{node}" / "cpulist").read_text())
+    except OSError:
+        return ()
+
+
+class CpuPlacement(NamedTuple):
+    """CPUs and scheduling of each thread role."""
+
+    acquisition_cpus: tuple[int, ...] = ()
+    """CPUs of the acquisition threads. Empty leaves them on any CPU"""
+    writer_cpus: tuple[int, ...] = ()
+    """CPUs of the threads writing captures to disk"""
+    worker_cpus: tuple[int, ...] = ()
+    """CPUs of the threads and processes analyzing captures"""
+    realtime_priority: int = 0
+    """SCHED_FIFO priority of the acquisition threads. 0 leaves the scheduling
+    policy alone
+    """
+    numa_node: int | None = None
+    """NUMA node the CPUs default to"""
+
+    def cpus(self, role: str) -> tuple[int, ...]:
+        return getattr(self, f"{role}_cpus")
+
+    @property
+    def configured(self) -> bool:
+        return (
+            any(self.cpus(role) for role in ROLES) or self.realtime_priority > 0
+        )
+
+
+def load_cpu_placement(section: str) -> CpuPlacement:
+    """Load the placement from the keys of a platform config section.
+
+    The keys are `acquisition-cpus`, `writer-cpus`, `worker-cpus`,
+    `realtime-priority` and `numa-node`. Roles without CPUs get the CPUs of the
+    NUMA node, so with the node of the NIC or USB controller every thread and
+    the capture buffers they touch first stay on that node.
+    """
+    configs = load_config_section(section)
+    node = int(configs["numa-node"]) if configs.get("numa-node") else None
+    default = node_cpus(node) if node is not None else ()
+    acquisition, writer, worker = (
+        parse_cpus(configs.get(f"{role}-cpus", "")) or default for role in ROLES
+    )
+    return CpuPlacement(
+        acquisition,
+        writer,
+        worker,
+        int(configs.get("realtime-priority", "0")),
+        node,
+    )
+
+
+def update_cpu_configs(
+    configs: SectionProxy,
+    acquisition_cpus: str | None,
+    writer_cpus: str | None,
+    worker_cpus: str | None,
+    realtime_priority: int | None,
+    numa_node: int | None,
+):
+    """Validate and set the placement options of a platform config command.
+
+    `none` clears an option.
+    """
+    for role, spec in zip(ROLES, (acquisition_cpus, writer_cpus, worker_cpus)):
+        if spec is None:
+            continue
+        try:
+            cpus = () if spec == "none" else parse_cpus(spec)
+        except ValueError:
+            print_error(f"{role}-cpus must be a CPU list like 0-3,8 or `none`")
+        unknown = set(cpus) - os.sched_getaffinity(0)
+        if unknown:
+            print_error(
+                f"{role}-cpus has CPUs this process can't run on: "
+                f"{format_cpus(unknown)}"
+            )
+        configs[f"{role}-cpus"] = format_cpus(cpus)
+
+    if realtime_priority is not None:
+        lowest, highest = (
+            os.sched_get_priority_min(os.SCHED_FIFO),
+            os.sched_get_priority_max(os.SCHED_FIFO),
+        )
+        if (
+            realtime_priority != 0
+            and not lowest <= realtime_priority <= highest
+        ):
+            print_error(
+                f"realtime-priority must be 0 or between {lowest} and {highest}"
+            )
+        configs["realtime-priority"] = str(realtime_priority)
+
+    if numa_node is not None:
+        if numa_node >= 0 and not node_cpus(numa_node):
+            print_error(f"NUMA node {numa_node} doesn't exist or has no CPUs")
+        configs["numa-node"] = str(numa_node) if numa_node >= 0 else ""
+
+
+class ThreadReport(NamedTuple):
+    """Where a placed thread was allowed to run and last ran."""
+
+    role: str
+    name: str
+    tid: int | None
+    """Native thread id. None for threads started outside of Python"""
+    cpus: tuple[int, ...]
+    """CPUs the thread was allowed to run on"""
+    policy: str
+    last_cpu: int
+    """CPU the thread last ran on"""
+
+
+_placement = CpuPlacement()
+_reports: dict[str, ThreadReport] = {}
+_warned: set[str] = set()
+_lock = threading.Lock()
+
+
+def set_placement(placement: CpuPlacement):
+    """Set the placement of `place_current_thread` and clear the report."""
+    global _placement
+    with _lock:
+        _placement = placement
+        _reports.clear()
+        _warned.clear()
+
+
+def get_placement() -> CpuPlacement:
+    """The placement set with `set_placement`."""
+    return _placement
+
+
+def _warn_once(key: str, message: str):
+    with _lock:
+        if key in _warned:
+            return
+        _warned.add(key)
+    print_warning(message)
+
+
+def _last_cpu(tid: int | None = None) -> int:
+    path = (
+        "/proc/thread-self/stat"
+        if tid is None
+        else f"/proc/self/task/{tid}/stat"
+    )
+    try:
+        with open(path) as f:
+            stat = f.read()
+    except OSError:
+        return -1
+    # The processor is field 39 and the command in field 2 may contain spaces
+    return int(stat[stat.rfind(")") + 2 :].split()[36])
+
+
+def pin_cpus(cpus: tuple[int, ...]):
+    """Pin the calling thread (or process, before it starts threads) to `cpus`.
+
+    Ignored if empty.
+    """
+    if not cpus:
+        return
+    try:
+        os.sched_setaffinity(0, cpus)
+    except OSError as e:
+        _warn_once(
+            format_cpus(cpus),
+            f"Unable to pin threads to CPUs {format_cpus(cpus)}: {e}",
+        )
+
+
+def record_thread(
+    role: str,
+    name: str,
+    tid: int | None,
+    cpus: tuple[int, ...],
+    policy: str,
+    last_cpu: int,
+):
+    """Add a thread to the report, e.g. one started outside of Python.
+
+    Threads are reported by name.
+    """
+    with _lock:
+        _reports[name] = ThreadReport(
+            role, name, tid, tuple(cpus), policy, last_cpu
+        )
+
+
+def _record_current_thread(role: str):
+    policy = _POLICIES.get(os.sched_getscheduler(0), "other")
+    record_thread(
+        role,
+        threading.current_thread().name,
+        threading.get_native_id(),
+        tuple(sorted(os.sched_getaffinity(0))),
+        policy,
+        _last_cpu(),
+    )
+
+
+def place_current_thread(role: str):
+    """Pin the calling thread to the CPUs of its role and record it.
+
+    Acquisition threads are also switched to SCHED_FIFO if a realtime priority
+    is set, which needs CAP_SYS_NICE or an rtprio limit.
+    """
+    placement = _placement
+    pin_cpus(placement.cpus(role))
+    if role == "acquisition" and placement.realtime_priority > 0:
+        try:
+            os.sched_setscheduler(
+                0, os.SCHED_FIFO, os.sched_param(placement.realtime_priority)
+            )
+        except PermissionError:
+            _warn_once(
+                "fifo",
+                "Not allowed to use SCHED_FIFO, the acquisition threads run "
+                "with the default policy. Grant CAP_SYS_NICE or raise the "
+                "rtprio limit",
+            )
+    _record_current_thread(role)
+
+
+@contextmanager
+def placed_thread(role: str):
+    """Run the body of a thread placed for `role`.
+
+    The report gets the CPU the thread last ran on when it ends.
+    """
+    place_current_thread(role)
+    try:
+        yield
+    finally:
+        _record_current_thread(role)
+
+
+def placement_report() -> list[ThreadReport]:
+    """The placed threads.
+
+    Threads still running report the CPU they are on now.
+    """
+    with _lock:
+        reports = list(_reports.values())
+    return [
+        report._replace(last_cpu=last_cpu)
+        if report.tid is not None and (last_cpu := _last_cpu(report.tid)) >= 0
+        else report
+        for report in reports
+    ]
+
+
+def placement_table() -> Table:
+    """The placement report as a table."""
+    table = Table(title="Thread placement")
+    for column in (
+        "role",
+        "thread",
+        "tid",
+        "allowed CPUs",
+        "policy",
+        "last CPU",
+    ):
+        table.add_column(
+            column, justify="right" if column in ("tid", "last CPU") else "left"
+        )
+    for report in sorted(
+        placement_report(),
+        key=lambda report: (ROLES.index(report.role), report.name),
+    ):
+        table.add_row(
+            report.role,
+            report.name,
+            "-" if report.tid is None else str(report.tid),
+            format_cpus(report.cpus),
+            report.policy,
+            str(report.last_cpu),
+        )
+    return table
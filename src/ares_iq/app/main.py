@@ -1,12 +1,67 @@
 import importlib
+import ipaddress
+import itertools
+import json
+import datetime as dt
+import time
 import typer
+import numpy as np
 from ares_iq.configurations import load_config_section, save_config_section, CONFIG_DIR
 from pathlib import Path
+from typing import Any
 from typing_extensions import Annotated
 import os
+from contextlib import ExitStack, nullcontext
 import pkgutil
 from ares_iq.typing import SoftwareDefinedRadio
-from ares_iq.save_iq_data import save_iq_data
+from ares_iq.save_iq_data import save_streams, PipelinedWriter, SAVE_DIR
+from ares_iq.catalog import Catalog, files_table, rebuild
+from ares_iq.time_range import (
+    read_time_range,
+    save_time_slice,
+    time_range_metadata,
+)
+from ares_iq.capture_plan import load_capture_plan
+from ares_iq.capture_server import CaptureServer, submit_job, SOCKET_FILE
+from ares_iq.spectrum import SpectrumMonitor
+from ares_iq.trigger import TriggeredRecorder
+from ares_iq.channelizer import Channelizer
+from ares_iq.segments import SegmentedWriter
+from ares_iq.direct_io import DirectWriter
+from ares_iq.shm_ring import SharedRingWriter
+from ares_iq.capture_stats import CaptureStats
+from ares_iq.net_stream import (
+    NetworkReceiver,
+    NetworkSink,
+    DEFAULT_BATCH,
+    DEFAULT_PAYLOAD,
+    save_received,
+)
+from ares_iq.net_benchmark import run_net_benchmark
+from ares_iq.resample import ResampleSettings, resample_files
+from ares_iq.spectrogram import (
+    SpectrogramSettings,
+    compute_spectrograms,
+    FORMATS,
+)
+from ares_iq.print_utils import print_warning, print_error
+from ares_iq.codec import IQCodec, CODERS
+from ares_iq.codec_benchmark import run_codec_benchmark
+from ares_iq.affinity import (
+    CpuPlacement,
+    get_placement,
+    load_cpu_placement,
+    placement_table,
+    set_placement,
+)
+from ares_iq.doctor import checks_table, fixes, run_checks
+from ares_iq.autotune import best_trial, parse_values, run_trials, trials_table
+from ares_iq.capture_budget import (
+    CaptureBudget,
+    COMPLEX64_BYTES,
+    INT16_IQ_BYTES,
+)
+from rich.console import Console
 
 
 PLATFORMS: dict[str, SoftwareDefinedRadio] = {}
@@ -30,25 +85,1485 @@ def import_platforms():
 import_platforms()
 
 app = typer.Typer()
+# Local times, with fractional seconds for picking events
+TIME_FORMATS = [
+    "%Y-%m-%d",
+    "%Y-%m-%dT%H:%M:%S",
+    "%Y-%m-%d %H:%M:%S",
+    "%Y-%m-%dT%H:%M:%S.%f",
+    "%Y-%m-%d %H:%M:%S.%f",
+]
+
+
+def _datetime_ns(time_: dt.datetime) -> int:
+    # Float seconds since the epoch can't hold ns, so the microseconds are added
+    # after
+    return (
+        int(time_.replace(microsecond=0).timestamp()) * 1_000_000_000
+        + time_.microsecond * 1000
+    )
+
+
+catalog_app = typer.Typer(help="Search the SQLite catalog of saved captures")
+app.add_typer(catalog_app, name="catalog")
 configs_path = Path().home() / ".ares_iq"
 configs_file = configs_path / "config.ini"
 
 
-@app.command()
-def capture(
-        center: Annotated[float, typer.Option("--center", "-c", help='Center frequency of the capture in MHz')] = 2450,
-        bw: Annotated[float, typer.Option("--bw", "-w", help='Bandwidth of the capture in MHz')] = 160,
-        file_size: Annotated[float, typer.Option("--size", "-s", help='The amount of IQ data to capture in GB')] = 4,
-        verbose: Annotated[bool, typer.Option("--verbose", "-v", help='Show verbose output and progress bar')] = False,
-        extra_verbose: Annotated[bool, typer.Option("--extra-verbose", "-vvv", help='Like verbose, but show logging messages too')] = False):
+def _codec(coder: str | None) -> IQCodec | nullcontext:
+    if coder is None:
+        return nullcontext()
+    if coder not in CODERS:
+        print_error(f"compress must be one of {', '.join(CODERS)}")
+    return IQCodec(coder)
+
+
+def _enter_capture_stats(
+    stack: ExitStack, platform: SoftwareDefinedRadio
+) -> CaptureStats:
+    """Compute capture statistics of every capture until `stack` closes."""
+    capture_stats = stack.enter_context(CaptureStats(platform.full_scale))
+    platform.add_capture_listener(capture_stats)
+    stack.callback(platform.remove_capture_listener, capture_stats)
+    return capture_stats
+
+
+def _capture_budget(
+    file_size: float,
+    duration: float | None,
+    samples: int | None,
+    nbytes: int | None,
+    sample_bytes: int,
+) -> CaptureBudget:
+    given = [
+        option
+        for option, value in (
+            ("--duration", duration),
+            ("--samples", samples),
+            ("--bytes", nbytes),
+        )
+        if value is not None
+    ]
+    if len(given) > 1:
+        print_error(f"Only one of {', '.join(given)} can be given")
+    if duration is not None:
+        return CaptureBudget(seconds=duration, sample_bytes=sample_bytes)
+    if samples is not None:
+        return CaptureBudget(samples=samples, sample_bytes=sample_bytes)
+    return CaptureBudget(
+        bytes=nbytes if nbytes is not None else round(file_size * 1e9),
+        sample_bytes=sample_bytes,
+    )
+
+
+def _apply_cpu_placement():
+    # Thread placement is configured per platform
+    hw = load_config_section("platform").get("hw")
+    set_placement(load_cpu_placement(f"{hw}-configs") if hw else CpuPlacement())
+
+
+def _print_cpu_placement():
+    if get_placement().configured:
+        Console().print(placement_table())
+
+
+def _selected_platform() -> SoftwareDefinedRadio:
     configs = load_config_section("platform")
     if "hw" not in configs:
         raise typer.Abort("Please run set-platform first")
 
     if PLATFORMS[configs["hw"]] is None:
         raise typer.Abort(f"{configs['hw']} is not supported yet.")
-    PLATFORMS[configs["hw"]].capture_iq(center * 1e6, bw * 1e6, file_size, verbose, extra_verbose)
-    # save_iq_data(PLATFORMS[configs["hw"]].iq_data)  # TODO: separate save function into different package
+    _apply_cpu_placement()
+    return PLATFORMS[configs["hw"]]
+
+
+@app.command()
+def capture(
+    center: Annotated[
+        float,
+        typer.Option(
+            "--center", "-c", help="Center frequency of the capture in MHz"
+        ),
+    ] = 2450,
+    bw: Annotated[
+        float,
+        typer.Option("--bw", "-w", help="Bandwidth of the capture in MHz"),
+    ] = 160,
+    file_size: Annotated[
+        float,
+        typer.Option(
+            "--size",
+            "-s",
+            help="The amount of IQ data to capture in GB, split between the "
+            "streams and rounded up to whole captures",
+        ),
+    ] = 4,
+    duration: Annotated[
+        float | None,
+        typer.Option(
+            "--duration",
+            "-d",
+            help="Capture this many seconds of every stream instead of --size, "
+            "rounded up to whole captures",
+            min=0,
+        ),
+    ] = None,
+    samples: Annotated[
+        int | None,
+        typer.Option(
+            "--samples",
+            help="Capture this many samples of every stream instead of --size, "
+            "rounded up to whole captures",
+            min=0,
+        ),
+    ] = None,
+    nbytes: Annotated[
+        int | None,
+        typer.Option(
+            "--bytes",
+            help="Capture this many bytes in the saved format (complex64, or "
+            "int16 with --compress) split between the streams instead of "
+            "--size, rounded up to whole captures",
+            min=0,
+        ),
+    ] = None,
+    verbose: Annotated[
+        bool,
+        typer.Option(
+            "--verbose", "-v", help="Show verbose output and progress bar"
+        ),
+    ] = False,
+    extra_verbose: Annotated[
+        bool,
+        typer.Option(
+            "--extra-verbose",
+            "-vvv",
+            help="Like verbose, but show logging messages too",
+        ),
+    ] = False,
+    save: Annotated[
+        bool,
+        typer.Option(
+            "--save",
+            help="Save each stream (device or channel) to its own file",
+        ),
+    ] = False,
+    compress: Annotated[
+        str | None,
+        typer.Option(
+            "--compress",
+            help="Save as int16 compressed with a lossless block codec: "
+            f"{', '.join(CODERS)}. USRP samples are stored exactly, BB60 "
+            "samples are quantized to 16 bits",
+        ),
+    ] = None,
+    segment_size: Annotated[
+        float | None,
+        typer.Option(
+            "--segment-size",
+            help="Write each stream during the capture to segment files of at "
+            "most this many GB, with an index",
+            min=0,
+        ),
+    ] = None,
+    segment_seconds: Annotated[
+        float | None,
+        typer.Option(
+            "--segment-seconds",
+            help="Like --segment-size, but rotate segments after this many "
+            "seconds",
+            min=0,
+        ),
+    ] = None,
+    direct: Annotated[
+        bool,
+        typer.Option(
+            "--direct",
+            help="Write each stream during the capture to a raw .cf32 file "
+            "with O_DIRECT",
+        ),
+    ] = False,
+    direct_depth: Annotated[
+        int,
+        typer.Option("--direct-depth", help="O_DIRECT writes in flight", min=1),
+    ] = 4,
+    monitor: Annotated[
+        bool,
+        typer.Option(
+            "--monitor",
+            help="Show a live spectrum of each stream below the progress bars",
+        ),
+    ] = False,
+    psd_file: Annotated[
+        Path | None,
+        typer.Option(
+            "--psd-file", help="Save the monitored PSD frames to this .npz file"
+        ),
+    ] = None,
+    psd_nfft: Annotated[
+        int,
+        typer.Option(
+            "--psd-nfft", help="FFT size of the monitored PSD", min=16
+        ),
+    ] = 1024,
+    channelize: Annotated[
+        int | None,
+        typer.Option(
+            "--channelize",
+            help="Split each stream into this many subbands during the capture",
+            min=2,
+        ),
+    ] = None,
+    subbands: Annotated[
+        str | None,
+        typer.Option(
+            "--subbands",
+            help="Comma separated subbands to save with --channelize. Subband "
+            "c is centered c * rate / N from the center",
+        ),
+    ] = None,
+    shm_ring: Annotated[
+        str | None,
+        typer.Option(
+            "--shm-ring",
+            help="Share each stream during the capture with other processes in "
+            "a shared memory ring named NAME-<stream>, read with "
+            "ares_iq.shm_ring.SharedRingReader",
+        ),
+    ] = None,
+    shm_slots: Annotated[
+        int,
+        typer.Option(
+            "--shm-slots",
+            help="Captures held by each shared memory ring",
+            min=2,
+        ),
+    ] = 64,
+    net_sink: Annotated[
+        str | None,
+        typer.Option(
+            "--net-sink",
+            help="Send each stream during the capture to a `net-receive` at "
+            "udp://host:port or tcp://host:port",
+        ),
+    ] = None,
+    net_payload: Annotated[
+        int,
+        typer.Option(
+            "--net-payload",
+            help="Bytes of samples per UDP packet. The default fits a 9000 "
+            "byte MTU",
+        ),
+    ] = DEFAULT_PAYLOAD,
+    net_batch: Annotated[
+        int,
+        typer.Option(
+            "--net-batch",
+            help="UDP packets sent per sendmmsg call. 1 sends them one by one",
+            min=1,
+        ),
+    ] = DEFAULT_BATCH,
+    stats: Annotated[
+        bool,
+        typer.Option(
+            "--stats",
+            help="Compute the power, DC offset, IQ imbalance, clipping and "
+            "coarse occupancy of each capture during the capture and save them "
+            "with the samples",
+        ),
+    ] = False,
+):
+    """Capture IQ data with the selected platform."""
+    platform = _selected_platform()
+    if compress and not save:
+        print_error("--compress only applies to the files written with --save")
+    codec = _codec(compress)
+    budget = _capture_budget(
+        file_size,
+        duration,
+        samples,
+        nbytes,
+        INT16_IQ_BYTES if compress else COMPLEX64_BYTES,
+    )
+    # Capture listeners that are also context managers
+    listeners: list[Any] = []
+    capture_stats = None
+    if stats:
+        capture_stats = CaptureStats(platform.full_scale)
+        listeners.append(capture_stats)
+    spectrum = None
+    if monitor or psd_file:
+        spectrum = SpectrumMonitor(psd_nfft, record=psd_file is not None)
+        listeners.append(spectrum)
+    channelizer = None
+    if channelize is not None:
+        try:
+            selected = [
+                int(c) for c in (subbands or "").split(",") if c.strip()
+            ]
+        except ValueError:
+            print_error("subbands must be a comma separated list of integers")
+        lowest, highest = -(channelize // 2), (channelize - 1) // 2
+        if not selected or any(not lowest <= c <= highest for c in selected):
+            print_error(
+                f"--channelize {channelize} needs --subbands between {lowest} "
+                f"and {highest}"
+            )
+        channelizer = Channelizer(channelize, selected)
+        listeners.append(channelizer)
+    direct_writer = None
+    if direct:
+        direct_writer = DirectWriter(direct_depth)
+        listeners.append(direct_writer)
+    segments = None
+    if segment_size or segment_seconds:
+        segments = SegmentedWriter(
+            segment_size,
+            segment_seconds,
+            metadata=lambda: platform.stream_metadata,
+        )
+        listeners.append(segments)
+    ring_writer = None
+    if shm_ring:
+        ring_writer = SharedRingWriter(shm_ring, shm_slots)
+        listeners.append(ring_writer)
+    net_writer = None
+    if net_sink:
+        try:
+            net_writer = NetworkSink(
+                net_sink,
+                net_payload,
+                net_batch,
+                metadata=lambda: platform.stream_metadata,
+            )
+            listeners.append(net_writer)
+        except (ValueError, OSError) as e:
+            print_error(f"--net-sink: {e}")
+
+    direct_paths: list[Path] = []
+    with ExitStack() as stack:
+        if direct_writer is not None:
+            # Closed last, even if the capture fails, since captures may be
+            # written straight from the capture buffer
+            writer = direct_writer
+            stack.callback(
+                lambda: direct_paths.extend(
+                    writer.close(platform.stream_metadata, capture_stats)
+                )
+            )
+        for listener in listeners:
+            if listener is not direct_writer:
+                stack.enter_context(listener)
+            platform.add_capture_listener(listener)
+            stack.callback(platform.remove_capture_listener, listener)
+        platform.capture_iq(
+            center * 1e6, bw * 1e6, budget, verbose or monitor, extra_verbose
+        )
+        if ring_writer is not None and (verbose or extra_verbose):
+            typer.echo(f"Shared memory rings: {', '.join(ring_writer.names)}")
+
+    if capture_stats is not None:
+        for stream, dropped in capture_stats.dropped.items():
+            print_warning(
+                f"{stream}: capture statistics fell behind and skipped "
+                f"{dropped} captures"
+            )
+        if verbose or extra_verbose:
+            for stream in platform.stream_metadata:
+                _, columns = capture_stats.stats(stream)
+                if len(columns["clipped"]):
+                    typer.echo(
+                        f"{stream}: mean power "
+                        f"{np.median(columns['power_mean_db']):.1f} dB median, "
+                        f"{np.count_nonzero(columns['clipped'])} of "
+                        f"{len(columns['clipped'])} captures "
+                        "clipped, DC ratio up to "
+                        f"{np.max(columns['dc_ratio_db']):.1f} dB"
+                    )
+    if spectrum is not None:
+        if psd_file is not None:
+            spectrum.save(psd_file, platform.stream_metadata)
+        for stream, dropped in spectrum.dropped.items():
+            print_warning(
+                f"{stream}: spectrum monitor fell behind and skipped {dropped} "
+                "frames"
+            )
+    if channelizer is not None:
+        channelizer.finalize(platform.stream_metadata)
+        for stream, error in channelizer.errors.items():
+            print_warning(f"{stream}: {error}")
+        for stream, dropped in channelizer.dropped.items():
+            print_warning(
+                f"{stream}: channelizer fell behind and dropped {dropped} "
+                "captures"
+            )
+    if direct_writer is not None:
+        write_stats = direct_writer.stats()
+        if write_stats:
+            typer.echo(
+                f"Wrote {len(direct_paths)} files with O_DIRECT: "
+                f"{write_stats['mb']:.0f} MB at "
+                f"{write_stats['mb_per_s']:.0f} MB/s, queue depth "
+                f"{write_stats['depth_mean']:.1f} mean "
+                f"{write_stats['depth_max']} max, write latency "
+                f"{write_stats['latency_p50_ms']:.1f} ms p50 "
+                f"{write_stats['latency_p99_ms']:.1f} ms p99 "
+                f"{write_stats['latency_max_ms']:.1f} ms max"
+            )
+    if segments is not None:
+        segments.finalize(platform.stream_metadata, capture_stats)
+        for stream, dropped in segments.dropped.items():
+            print_warning(
+                f"{stream}: segment writer fell behind and dropped {dropped} "
+                "captures"
+            )
+        typer.echo(f"Segments written to {segments.directory}")
+    if net_writer is not None:
+        send_error = net_writer.close(platform.stream_metadata)
+        if send_error is not None:
+            print_warning(f"Network sink stopped sending: {send_error}")
+        for stream, dropped in net_writer.dropped.items():
+            print_warning(
+                f"{stream}: network sink fell behind and dropped {dropped} "
+                "captures"
+            )
+        if net_writer.sender.refused:
+            print_warning(
+                f"{net_writer.sender.refused} packets were refused, is "
+                "`net-receive` running?"
+            )
+    if save:
+        # TODO: separate save function into different package
+        with codec as stream_codec:
+            save_streams(platform, codec=stream_codec, stats=capture_stats)
+    platform.close()
+    if verbose or extra_verbose:
+        _print_cpu_placement()
+
+
+@app.command()
+def sweep(
+    centers: Annotated[
+        list[float],
+        typer.Argument(help="Center frequencies of the bands in MHz"),
+    ],
+    bw: Annotated[
+        float,
+        typer.Option("--bw", "-w", help="Bandwidth of each capture in MHz"),
+    ] = 160,
+    file_size: Annotated[
+        float,
+        typer.Option(
+            "--size",
+            "-s",
+            help="The amount of IQ data to capture per band in GB, rounded up "
+            "to whole captures",
+        ),
+    ] = 4,
+    duration: Annotated[
+        float | None,
+        typer.Option(
+            "--duration",
+            "-d",
+            help="Capture this many seconds of every stream per band instead "
+            "of --size, rounded up to whole captures",
+            min=0,
+        ),
+    ] = None,
+    samples: Annotated[
+        int | None,
+        typer.Option(
+            "--samples",
+            help="Capture this many samples of every stream per band instead "
+            "of --size, rounded up to whole captures",
+            min=0,
+        ),
+    ] = None,
+    nbytes: Annotated[
+        int | None,
+        typer.Option(
+            "--bytes",
+            help="Capture this many bytes per band in the saved format instead "
+            "of --size, rounded up to whole captures",
+            min=0,
+        ),
+    ] = None,
+    verbose: Annotated[
+        bool,
+        typer.Option(
+            "--verbose", "-v", help="Show verbose output and progress bar"
+        ),
+    ] = False,
+    extra_verbose: Annotated[
+        bool,
+        typer.Option(
+            "--extra-verbose",
+            "-vvv",
+            help="Like verbose, but show logging messages too",
+        ),
+    ] = False,
+    compress: Annotated[
+        str | None,
+        typer.Option(
+            "--compress",
+            help="Save as int16 compressed with a lossless block codec: "
+            f"{', '.join(CODERS)}",
+        ),
+    ] = None,
+    stats: Annotated[
+        bool,
+        typer.Option(
+            "--stats",
+            help="Compute the statistics of each capture like capture --stats "
+            "and save them with the samples",
+        ),
+    ] = False,
+):
+    """Capture and save a list of bands with one open device."""
+    platform = _selected_platform()
+    budget = _capture_budget(
+        file_size,
+        duration,
+        samples,
+        nbytes,
+        INT16_IQ_BYTES if compress else COMPLEX64_BYTES,
+    )
+    with ExitStack() as stack:
+        codec = stack.enter_context(_codec(compress))
+        capture_stats = _enter_capture_stats(stack, platform) if stats else None
+        for center in centers:
+            # The platform keeps its device and streamer between calls and only
+            # retunes
+            platform.capture_iq(
+                center * 1e6, bw * 1e6, budget, verbose, extra_verbose
+            )
+            if capture_stats is not None:
+                capture_stats.wait()
+            save_streams(platform, f"{center:g}MHz", codec, capture_stats)
+    platform.close()
+
+
+@app.command(name="capture-plan")
+def capture_plan(
+    plan_file: Annotated[
+        Path,
+        typer.Argument(
+            help="Plan with center (MHz), bw (MHz), size (GB) and optional tag "
+            "columns",
+            exists=True,
+            dir_okay=False,
+        ),
+    ],
+    verbose: Annotated[
+        bool,
+        typer.Option(
+            "--verbose", "-v", help="Show verbose output and progress bar"
+        ),
+    ] = False,
+    extra_verbose: Annotated[
+        bool,
+        typer.Option(
+            "--extra-verbose",
+            "-vvv",
+            help="Like verbose, but show logging messages too",
+        ),
+    ] = False,
+    stats: Annotated[
+        bool,
+        typer.Option(
+            "--stats",
+            help="Compute the statistics of each capture like capture --stats "
+            "and save them with the samples",
+        ),
+    ] = False,
+):
+    """Run every capture of a YAML or CSV plan with one open device."""
+    plan = load_capture_plan(plan_file)
+    if not plan:
+        return
+    platform = _selected_platform()
+
+    # Two buffers: one being captured into while the other is written
+    buffers = 2
+    platform.reserve(max(entry.size for entry in plan), buffers)
+    with ExitStack() as stack:
+        capture_stats = _enter_capture_stats(stack, platform) if stats else None
+        writer = stack.enter_context(
+            PipelinedWriter(depth=buffers, stats=capture_stats)
+        )
+        for entry in plan:
+            writer.wait_for_buffer()
+            platform.capture_iq(
+                entry.center * 1e6,
+                entry.bw * 1e6,
+                entry.size,
+                verbose,
+                extra_verbose,
+            )
+            if capture_stats is not None:
+                capture_stats.wait()
+            writer.submit(platform, entry.tag or f"{entry.center:g}MHz")
+    platform.close()
+
+
+@app.command()
+def record(
+    threshold: Annotated[
+        float,
+        typer.Option(
+            "--threshold",
+            "-t",
+            help="Mean capture power that starts an event in dB (dBFS for the "
+            "USRP, dBm for the BB60)",
+        ),
+    ],
+    center: Annotated[
+        float,
+        typer.Option(
+            "--center", "-c", help="Center frequency of the capture in MHz"
+        ),
+    ] = 2450,
+    bw: Annotated[
+        float,
+        typer.Option("--bw", "-w", help="Bandwidth of the capture in MHz"),
+    ] = 160,
+    file_size: Annotated[
+        float,
+        typer.Option(
+            "--size",
+            "-s",
+            help="The amount of IQ data monitored per pass in GB",
+        ),
+    ] = 1,
+    passes: Annotated[
+        int,
+        typer.Option(
+            "--passes",
+            "-n",
+            help="Number of passes. 0 records until interrupted",
+            min=0,
+        ),
+    ] = 0,
+    hysteresis: Annotated[
+        float,
+        typer.Option(
+            "--hysteresis",
+            help="dB below the threshold the power must fall to end an event",
+            min=0,
+        ),
+    ] = 3,
+    pre: Annotated[
+        int,
+        typer.Option("--pre", help="Captures saved before the trigger", min=0),
+    ] = 2,
+    post: Annotated[
+        int,
+        typer.Option(
+            "--post",
+            help="Captures saved after the power falls below the hysteresis",
+            min=0,
+        ),
+    ] = 2,
+    verbose: Annotated[
+        bool,
+        typer.Option(
+            "--verbose",
+            "-v",
+            help="Show verbose output, progress bar and trigger state",
+        ),
+    ] = False,
+    extra_verbose: Annotated[
+        bool,
+        typer.Option(
+            "--extra-verbose",
+            "-vvv",
+            help="Like verbose, but show logging messages too",
+        ),
+    ] = False,
+):
+    """Capture continuously and only save the captures around energy detections.
+
+    Each event is saved to its own file.
+    """
+    platform = _selected_platform()
+    # Configured first so the events can carry the stream metadata
+    platform.configure(center * 1e6, bw * 1e6, extra_verbose)
+    platform.reserve(file_size)
+    recorder = TriggeredRecorder(
+        threshold, hysteresis, pre, post, platform.stream_metadata
+    )
+    platform.add_capture_listener(recorder)
+    try:
+        with recorder:
+            for _ in itertools.count() if passes == 0 else range(passes):
+                platform.capture_iq(
+                    center * 1e6, bw * 1e6, file_size, verbose, extra_verbose
+                )
+    except KeyboardInterrupt:
+        # capture_iq stops its acquisition threads before the interrupt gets
+        # here, so nothing calls the recorder once it's closed
+        pass
+    finally:
+        platform.remove_capture_listener(recorder)
+    platform.close()
+    for stream, dropped in recorder.dropped.items():
+        print_warning(
+            f"{stream}: writer fell behind and dropped {dropped} captures"
+        )
+    typer.echo(f"Saved {len(recorder.events)} events")
+    if verbose or extra_verbose:
+        _print_cpu_placement()
+
+
+@app.command()
+def spectrogram(
+    files: Annotated[
+        list[Path],
+        typer.Argument(
+            help="Capture files saved by ares-iq", exists=True, dir_okay=False
+        ),
+    ],
+    nfft: Annotated[
+        int, typer.Option("--nfft", help="FFT size", min=16)
+    ] = 1024,
+    overlap: Annotated[
+        float,
+        typer.Option(
+            "--overlap",
+            help="Fraction of each FFT overlapping the next",
+            min=0,
+            max=0.99,
+        ),
+    ] = 0.5,
+    average: Annotated[
+        int,
+        typer.Option(
+            "--average", help="Number of FFTs averaged into each row", min=1
+        ),
+    ] = 1,
+    fmt: Annotated[
+        str,
+        typer.Option(
+            "--format",
+            help=f"Output type of the dB values: {', '.join(FORMATS)}",
+        ),
+    ] = "float16",
+    db_min: Annotated[
+        float,
+        typer.Option("--db-min", help="dB mapped to 0 by the uint8 format"),
+    ] = -140,
+    db_max: Annotated[
+        float,
+        typer.Option("--db-max", help="dB mapped to 255 by the uint8 format"),
+    ] = 0,
+    jobs: Annotated[
+        int | None,
+        typer.Option(
+            "--jobs",
+            "-j",
+            help="Worker processes. Defaults to the CPU count",
+            min=1,
+        ),
+    ] = None,
+    output_dir: Annotated[
+        Path | None,
+        typer.Option(
+            "--output-dir",
+            "-o",
+            help="Directory for the spectrograms. Defaults to next to each "
+            "capture",
+            file_okay=False,
+        ),
+    ] = None,
+    verbose: Annotated[
+        bool, typer.Option("--verbose", "-v", help="Show a progress bar")
+    ] = False,
+):
+    """Compute the spectrogram of saved captures.
+
+    Each FILE.h5 is written to FILE-spectrogram.h5.
+    """
+    if fmt not in FORMATS:
+        print_error(f"format must be one of {', '.join(FORMATS)}")
+    if db_max <= db_min:
+        print_error("db-max must be greater than db-min")
+    settings = SpectrogramSettings(
+        nfft, max(1, round(nfft * (1 - overlap))), average, fmt, db_min, db_max
+    )
+    if output_dir is not None:
+        output_dir.mkdir(parents=True, exist_ok=True)
+    out_files = [
+        (output_dir or file.parent) / f"{file.stem}-spectrogram.h5"
+        for file in files
+    ]
+    _apply_cpu_placement()
+    compute_spectrograms(files, out_files, settings, jobs, not verbose)
+
+
+@app.command()
+def resample(
+    files: Annotated[
+        list[Path],
+        typer.Argument(
+            help="Capture files saved by ares-iq", exists=True, dir_okay=False
+        ),
+    ],
+    up: Annotated[
+        int, typer.Option("--up", help="Upsampling factor", min=1)
+    ] = 1,
+    down: Annotated[
+        int, typer.Option("--down", help="Downsampling factor", min=1)
+    ] = 1,
+    shift: Annotated[
+        float,
+        typer.Option(
+            "--shift", help="Offset from the capture center moved to DC in MHz"
+        ),
+    ] = 0,
+    half_length: Annotated[
+        int,
+        typer.Option(
+            "--half-length",
+            help="Filter half length in multiples of max(up, down)",
+            min=1,
+        ),
+    ] = 10,
+    jobs: Annotated[
+        int | None,
+        typer.Option(
+            "--jobs",
+            "-j",
+            help="Worker processes. Defaults to the CPU count",
+            min=1,
+        ),
+    ] = None,
+    output_dir: Annotated[
+        Path | None,
+        typer.Option(
+            "--output-dir",
+            "-o",
+            help="Directory for the resampled files. Defaults to next to each "
+            "capture",
+            file_okay=False,
+        ),
+    ] = None,
+    verbose: Annotated[
+        bool, typer.Option("--verbose", "-v", help="Show a progress bar")
+    ] = False,
+):
+    """Resample saved captures by up/down with a polyphase filter.
+
+    Each FILE.h5 is written to FILE-resampled.h5.
+    """
+    if output_dir is not None:
+        output_dir.mkdir(parents=True, exist_ok=True)
+    out_files = [
+        (output_dir or file.parent) / f"{file.stem}-resampled.h5"
+        for file in files
+    ]
+    _apply_cpu_placement()
+    resample_files(
+        files,
+        out_files,
+        ResampleSettings(up, down, shift * 1e6, half_length),
+        jobs,
+        not verbose,
+    )
+
+
+@app.command()
+def extract(
+    path: Annotated[
+        Path,
+        typer.Argument(
+            help="Capture file (.h5 or .cf32) or recording directory",
+            exists=True,
+        ),
+    ],
+    start: Annotated[
+        dt.datetime,
+        typer.Option(
+            "--start",
+            help="Local time of the first sample",
+            formats=TIME_FORMATS,
+        ),
+    ],
+    end: Annotated[
+        dt.datetime | None,
+        typer.Option(
+            "--end",
+            help="Local time the range ends before",
+            formats=TIME_FORMATS,
+        ),
+    ] = None,
+    duration: Annotated[
+        float | None,
+        typer.Option(
+            "--duration",
+            "-d",
+            help="Seconds from --start instead of --end",
+            min=0,
+        ),
+    ] = None,
+    stream: Annotated[
+        str | None,
+        typer.Option(
+            "--stream", help="Stream of a recording with more than one"
+        ),
+    ] = None,
+    tag: Annotated[
+        str | None,
+        typer.Option("--tag", help="Tag added to the saved file name"),
+    ] = None,
+    verbose: Annotated[
+        bool,
+        typer.Option("--verbose", "-v", help="Show how long the read took"),
+    ] = False,
+):
+    """Save the samples between two times of a capture to a new file.
+
+    The capture is a capture file or a stream of a segmented recording
+    directory. Only the samples in range are read.
+    """
+    start_ns = _datetime_ns(start)
+    if end is not None and duration is None:
+        end_ns = _datetime_ns(end)
+    elif duration is not None and end is None:
+        end_ns = start_ns + round(duration * 1e9)
+    else:
+        print_error("Give one of --end and --duration")
+    began = time.perf_counter()
+    try:
+        time_slice = read_time_range(path, start_ns, end_ns, stream)
+        metadata = time_range_metadata(path, stream)
+    except (ValueError, KeyError, OSError) as e:
+        print_error(str(e))
+    if not len(time_slice.samples):
+        print_error(
+            f"{path} has no samples between {start} and "
+            f"{dt.datetime.fromtimestamp(end_ns / 1e9)}"
+        )
+    if verbose:
+        typer.echo(
+            f"Read {len(time_slice.samples)} samples in "
+            f"{len(time_slice.offsets)} pieces in "
+            f"{(time.perf_counter() - began) * 1e3:.1f} ms"
+        )
+    typer.echo(
+        f"Saved {save_time_slice(time_slice, start_ns, end_ns, metadata, tag)}"
+    )
+
+
+@app.command(name="codec-benchmark")
+def codec_benchmark(
+    coder: Annotated[
+        str, typer.Option("--coder", help=f"Entropy coder: {', '.join(CODERS)}")
+    ] = "zlib",
+    level: Annotated[
+        int, typer.Option("--level", help="Compression level of the coder")
+    ] = 1,
+    samples: Annotated[
+        float, typer.Option("--samples", help="Samples per source in millions")
+    ] = 8,
+    block_samples: Annotated[
+        int, typer.Option("--block-samples", help="Samples per block", min=1)
+    ] = 262144,
+    workers: Annotated[
+        int | None, typer.Option("--workers", "-j", help="Codec threads", min=1)
+    ] = None,
+):
+    """Report the ratio and throughput of the IQ codec on simulated signals."""
+    if coder not in CODERS:
+        print_error(f"coder must be one of {', '.join(CODERS)}")
+    samples = max(block_samples, int(samples * 1e6))
+    Console().print(
+        run_codec_benchmark(samples, block_samples, coder, level, workers)
+    )
+
+
+@app.command(name="net-receive")
+def net_receive(
+    listen: Annotated[
+        str,
+        typer.Option(
+            "--listen",
+            "-l",
+            help="udp://host:port or tcp://host:port to listen on",
+        ),
+    ] = "udp://0.0.0.0:4991",
+    duration: Annotated[
+        float | None,
+        typer.Option(
+            "--duration", "-d", help="Stop after this many seconds", min=0
+        ),
+    ] = None,
+    idle: Annotated[
+        float,
+        typer.Option(
+            "--idle",
+            help="Stop when no packet came for this many seconds",
+            min=0,
+        ),
+    ] = 5,
+    tag: Annotated[
+        str | None,
+        typer.Option("--tag", help="Tag added to the saved file names"),
+    ] = None,
+    segment_size: Annotated[
+        float | None,
+        typer.Option(
+            "--segment-size",
+            help="Write each stream while receiving to segment files of at "
+            "most this many GB, with an index",
+            min=0,
+        ),
+    ] = None,
+    segment_seconds: Annotated[
+        float | None,
+        typer.Option(
+            "--segment-seconds",
+            help="Like --segment-size, but rotate segments after this many "
+            "seconds",
+            min=0,
+        ),
+    ] = None,
+):
+    """Receive the streams of `capture --net-sink` and save them.
+
+    Each stream is saved to its own file, or to segments while receiving.
+    """
+    segments = None
+    if segment_size or segment_seconds:
+        segments = SegmentedWriter(
+            segment_size,
+            segment_seconds,
+            tag,
+            metadata=lambda: receiver.metadata,
+        )
+    try:
+        receiver = NetworkReceiver(
+            listen,
+            keep=segments is None,
+            listeners=[segments] if segments else None,
+        )
+    except (ValueError, OSError) as e:
+        print_error(f"--listen: {e}")
+    _apply_cpu_placement()
+    typer.echo(f"Listening on {receiver.url}")
+    with segments or nullcontext():
+        try:
+            ended = receiver.run(duration, idle)
+        except KeyboardInterrupt:
+            ended = False
+    for stream, stats in receiver.stats().items():
+        typer.echo(
+            f"{stream}: {stats.captures} captures, {stats.lost} lost "
+            f"({stats.incomplete} incomplete), "
+            f"{stats.late_packets} late packets"
+        )
+        if stats.lost:
+            print_warning(f"{stream}: lost {stats.lost} captures")
+    if receiver.seconds:
+        typer.echo(
+            f"Received {receiver.bytes / 1e6:.0f} MB in {receiver.packets} "
+            "packets at "
+            f"{receiver.bytes / 1e6 / receiver.seconds:.0f} MB/s"
+            f"{'' if ended else ', the sender did not end every stream'}"
+        )
+    if segments is not None:
+        segments.finalize(receiver.metadata)
+        typer.echo(f"Segments written to {segments.directory}")
+        return
+    for path in save_received(receiver, tag):
+        typer.echo(f"Saved {path}")
+
+
+@app.command(name="net-benchmark")
+def net_benchmark(
+    size: Annotated[
+        float, typer.Option("--size", "-s", help="GB streamed per run")
+    ] = 2,
+    samples_per_capture: Annotated[
+        int, typer.Option("--spc", help="Samples per capture", min=1)
+    ] = 200000,
+    payload: Annotated[
+        int, typer.Option("--payload", help="Bytes of samples per UDP packet")
+    ] = DEFAULT_PAYLOAD,
+    batch: Annotated[
+        int,
+        typer.Option(
+            "--batch", help="UDP packets sent per sendmmsg call", min=1
+        ),
+    ] = DEFAULT_BATCH,
+    rate: Annotated[
+        float,
+        typer.Option(
+            "--rate",
+            help="Pace the sender at this many MS/s like a device. 0 sends as "
+            "fast as possible",
+            min=0,
+        ),
+    ] = 0,
+    host: Annotated[
+        str, typer.Option("--host", help="Address to stream over")
+    ] = "127.0.0.1",
+):
+    """Benchmark network streaming over loopback.
+
+    Reports the sustained throughput, loss and CPU cost per GB.
+    """
+    try:
+        table = run_net_benchmark(
+            size, samples_per_capture, payload, batch, rate * 1e6, host
+        )
+    except (ValueError, OSError) as e:
+        print_error(str(e))
+    Console().print(table)
+
+
+@app.command()
+def serve(
+    socket_file: Annotated[
+        Path, typer.Option("--socket", help="Unix socket to listen on")
+    ] = SOCKET_FILE,
+    center: Annotated[
+        float,
+        typer.Option(
+            "--center",
+            "-c",
+            help="Center frequency to open the device with in MHz",
+        ),
+    ] = 2450,
+    bw: Annotated[
+        float,
+        typer.Option(
+            "--bw", "-w", help="Bandwidth to open the device with in MHz"
+        ),
+    ] = 160,
+    warm_size: Annotated[
+        float,
+        typer.Option(
+            "--warm-size",
+            help="Preallocate the capture buffers for jobs up to this size in "
+            "GB",
+        ),
+    ] = 0,
+    extra_verbose: Annotated[
+        bool,
+        typer.Option("--extra-verbose", "-vvv", help="Show logging messages"),
+    ] = False,
+):
+    """Keep the platform open and run capture jobs received on a Unix socket.
+
+    Jobs are JSON lines {"center": MHz, "bw": MHz, "size": GB, "tag": str} and
+    each gets a JSON line reply.
+    """
+    platform = _selected_platform()
+    platform.configure(center * 1e6, bw * 1e6, extra_verbose)
+    platform.reserve(warm_size)
+    with CaptureServer(platform, socket_file, extra_verbose) as server:
+        typer.echo(f"Listening on {socket_file}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+    platform.close()
+
+
+@app.command()
+def submit(
+    center: Annotated[
+        float,
+        typer.Option(
+            "--center", "-c", help="Center frequency of the capture in MHz"
+        ),
+    ] = 2450,
+    bw: Annotated[
+        float,
+        typer.Option("--bw", "-w", help="Bandwidth of the capture in MHz"),
+    ] = 160,
+    file_size: Annotated[
+        float,
+        typer.Option(
+            "--size", "-s", help="The amount of IQ data to capture in GB"
+        ),
+    ] = 4,
+    tag: Annotated[
+        str | None,
+        typer.Option("--tag", help="Tag added to the saved file names"),
+    ] = None,
+    socket_file: Annotated[
+        Path, typer.Option("--socket", help="Unix socket of the daemon")
+    ] = SOCKET_FILE,
+):
+    """Submit a capture job to a running `serve` daemon."""
+    result = submit_job(
+        socket_file, {"center": center, "bw": bw, "size": file_size, "tag": tag}
+    )
+    typer.echo(json.dumps(result))
+    if result["status"] != "ok":
+        raise typer.Exit(code=1)
+
+
+@app.command()
+def doctor(
+    file_size: Annotated[
+        float,
+        typer.Option(
+            "--size", "-s", help="The amount of IQ data per capture in GB"
+        ),
+    ] = 4,
+    addr: Annotated[
+        str, typer.Option("--addr", help="IPv4 address of a network device")
+    ] = "192.168.10.2",
+    interface: Annotated[
+        str | None,
+        typer.Option(
+            "--interface",
+            "-i",
+            help="Interface of a network device. Found from the routing table "
+            "by default",
+        ),
+    ] = None,
+):
+    """Check the host settings that limit sustained streaming.
+
+    Each setting is checked against what the configured platform needs and
+    fixes are suggested.
+    """
+    platform = _selected_platform()
+    try:
+        ipaddress.IPv4Address(addr)
+    except ValueError:
+        print_error(f"{addr} is not an IPv4 address")
+    req = platform.stream_requirements(file_size)
+    checks = run_checks(req, addr, interface)
+    Console().print(
+        checks_table(
+            checks,
+            f"{req.channels} x {req.rate / 1e6:g} MS/s, "
+            f"{req.bytes_per_second / 1e6:.0f} MB/s",
+        )
+    )
+    for fix in fixes(checks):
+        typer.echo(fix)
+    if any(check.status == "fail" for check in checks):
+        raise typer.Exit(code=1)
+
+
+@app.command()
+def autotune(
+    center: Annotated[
+        float,
+        typer.Option(
+            "--center", "-c", help="Center frequency of the trials in MHz"
+        ),
+    ] = 2450,
+    bw: Annotated[
+        float, typer.Option("--bw", "-w", help="Bandwidth of the trials in MHz")
+    ] = 160,
+    file_size: Annotated[
+        float,
+        typer.Option(
+            "--size",
+            "-s",
+            help="The amount of IQ data captured per trial in GB",
+            min=0,
+        ),
+    ] = 0.5,
+    spp: Annotated[
+        str | None,
+        typer.Option(
+            "--spp", help="Comma separated samples per packet to try (USRP)"
+        ),
+    ] = None,
+    spc: Annotated[
+        str | None,
+        typer.Option(
+            "--spc", help="Comma separated samples per capture to try"
+        ),
+    ] = None,
+    num_recv_frames: Annotated[
+        str | None,
+        typer.Option(
+            "--num-recv-frames",
+            help="Comma separated UHD receive frame counts to try (USRP)",
+        ),
+    ] = None,
+    recv_frame_size: Annotated[
+        str | None,
+        typer.Option(
+            "--recv-frame-size",
+            help="Comma separated UHD receive frame sizes in bytes to try "
+            "(USRP)",
+        ),
+    ] = None,
+    dry_run: Annotated[
+        bool,
+        typer.Option(
+            "--dry-run",
+            help="Report the trials without saving the best settings",
+        ),
+    ] = False,
+    verbose: Annotated[
+        bool, typer.Option("--verbose", "-v", help="Show a progress bar")
+    ] = False,
+):
+    """Find the best stream settings with short captures.
+
+    Captures run over a grid of stream settings, measuring overflows, recv
+    latency and CPU, and the best settings are saved to the platform configs.
+    """
+    platform = _selected_platform()
+    values = {
+        name: parse_values(name, spec)
+        for name, spec in (
+            ("spp", spp),
+            ("spc", spc),
+            ("num-recv-frames", num_recv_frames),
+            ("recv-frame-size", recv_frame_size),
+        )
+        if spec is not None
+    }
+    grid = platform.tuning_grid(values)
+    results = run_trials(
+        grid,
+        lambda settings: platform.tune_trial(
+            settings, center * 1e6, bw * 1e6, file_size
+        ),
+        not verbose,
+    )
+    platform.close()
+
+    best = best_trial(results)
+    Console().print(trials_table(results, best))
+    if best is None:
+        print_error(
+            "Every trial lost data or failed. Check the host with `ares-iq "
+            "doctor` or lower the rate"
+        )
+        return
+    settings = ", ".join(
+        f"{name}={value}" for name, value in best.settings.items()
+    )
+    if dry_run:
+        typer.echo(f"Best settings: {settings}")
+        return
+    platform.save_tuning(best.settings)
+    typer.echo(f"Saved {settings}")
+
+
+@catalog_app.command(name="rebuild")
+def catalog_rebuild(
+    directories: Annotated[
+        list[Path] | None,
+        typer.Argument(
+            help="Directories to scan. Defaults to ./ares-iq-data",
+            exists=True,
+            file_okay=False,
+        ),
+    ] = None,
+    full: Annotated[
+        bool, typer.Option("--full", help="Read every file again")
+    ] = False,
+    jobs: Annotated[
+        int | None,
+        typer.Option(
+            "--jobs",
+            "-j",
+            help="Worker processes. Defaults to the CPU count",
+            min=1,
+        ),
+    ] = None,
+    verbose: Annotated[
+        bool, typer.Option("--verbose", "-v", help="Show a progress bar")
+    ] = False,
+):
+    """Catalog the capture files under the directories, in parallel.
+
+    Files that did not change since they were cataloged are skipped.
+    """
+    _apply_cpu_placement()
+    added, skipped, removed = rebuild(
+        directories or [SAVE_DIR], full, jobs, not verbose
+    )
+    typer.echo(
+        f"Cataloged {added} files, {skipped} unchanged, removed {removed} "
+        "missing"
+    )
+
+
+@catalog_app.command(name="query")
+def catalog_query(
+    start: Annotated[
+        dt.datetime | None,
+        typer.Option(
+            "--start", help="Files with samples from this local time on"
+        ),
+    ] = None,
+    end: Annotated[
+        dt.datetime | None,
+        typer.Option("--end", help="Files with samples up to this local time"),
+    ] = None,
+    frequency: Annotated[
+        float | None,
+        typer.Option(
+            "--freq", "-f", help="Files whose band covers this frequency in MHz"
+        ),
+    ] = None,
+    platform: Annotated[
+        str | None, typer.Option("--platform", help="Files from this platform")
+    ] = None,
+    kind: Annotated[
+        str | None,
+        typer.Option(
+            "--kind",
+            help="capture, compressed, segment, direct, event, resampled or "
+            "subband",
+        ),
+    ] = None,
+    min_power: Annotated[
+        float | None,
+        typer.Option(
+            "--min-power",
+            help="Files with captures in the time range whose mean power "
+            "reaches this many dB (needs capture --stats)",
+        ),
+    ] = None,
+    clipped: Annotated[
+        bool | None,
+        typer.Option(
+            "--clipped/--not-clipped",
+            help="Files with, or without, clipped captures (needs capture "
+            "--stats)",
+        ),
+    ] = None,
+    limit: Annotated[
+        int | None,
+        typer.Option("--limit", "-n", help="At most this many files", min=1),
+    ] = None,
+    paths: Annotated[
+        bool, typer.Option("--paths", help="Print only the paths")
+    ] = False,
+):
+    """List the cataloged files matching every filter."""
+    with Catalog() as catalog:
+        rows = catalog.query(
+            int(start.timestamp() * 1e9) if start else None,
+            int(end.timestamp() * 1e9) if end else None,
+            frequency * 1e6 if frequency is not None else None,
+            platform,
+            kind,
+            min_power,
+            clipped,
+            limit,
+        )
+    if paths:
+        for row in rows:
+            typer.echo(row["path"])
+        return
+    Console().print(files_table(rows, min_power is not None))
 
 
 def valid_platforms(platform: str):
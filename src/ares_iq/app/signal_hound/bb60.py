@@ -1,56 +1,148 @@
-from .bbdevice.bb_api import (BBDeviceError, bb_get_serial_number_list_2, bb_open_device, bb_configure_ref_level,
-                              bb_configure_gain_atten, bb_configure_IQ_center, bb_configure_IQ, bb_initiate,
-                              bb_get_IQ_unpacked, bb_close_device, BB_DEVICE_BB60A,
-                              BB60A_MAX_RT_SPAN, BB60C_MAX_RT_SPAN, BB_AUTO_GAIN, BB_AUTO_ATTEN, BB_MIN_DECIMATION,
-                              BB_STREAMING, BB_STREAM_IQ, BB_FALSE)
-from ares_iq.print_utils import print_warning, print_error, CaptureProgress
-from ares_iq.configurations import load_config_section, save_config_section
+import threading
+import time
+from ctypes import byref, c_int
+from typing import AsyncIterator, Iterator
+
+import numpy as np
+import numpy.typing as npt
 import typer
+from rich.console import RenderableType, RichCast
 from typing_extensions import Annotated
+
+from ares_iq.affinity import (
+    load_cpu_placement,
+    placed_thread,
+    update_cpu_configs,
+)
+from ares_iq.autotune import TrialResult, measure, tuning_grid
+from ares_iq.buffers import (
+    BufferAllocator,
+    load_buffer_settings,
+    update_buffer_configs,
+    warmup_summary,
+)
+from ares_iq.capture_budget import CaptureBudget, budget_summary
+from ares_iq.configurations import load_config_section, save_config_section
+from ares_iq.doctor import StreamRequirements
 from ares_iq.iq_data import IQData
-import math
+from ares_iq.print_utils import MultiCaptureProgress, print_error, print_warning
+from ares_iq.stream import DEFAULT_PASS, IQBatch, astream_iq, stream_iq
+from ares_iq.typing import CaptureListener
+
+from .bbdevice.bb_api import (
+    BB60A_MAX_RT_SPAN,
+    BB60C_MAX_RT_SPAN,
+    BB_AUTO_ATTEN,
+    BB_AUTO_GAIN,
+    BB_DEVICE_BB60A,
+    BB_FALSE,
+    BB_MIN_DECIMATION,
+    BB_STREAM_IQ,
+    BB_STREAMING,
+    BBDeviceError,
+    bb_abort,
+    bb_close_device,
+    bb_configure_gain_atten,
+    bb_configure_IQ,
+    bb_configure_IQ_center,
+    bb_configure_ref_level,
+    bb_get_serial_number_list_2,
+    bb_initiate,
+    bb_query_IQ_parameters,
+    bbGetIQUnpacked,
+    bbOpenDeviceBySerialNumber,
+)
 
+# Default of the `spc` config
 SAMPLES_PER_CAPTURE = 262144
-BYTES_PER_CAPTURE = (16 * SAMPLES_PER_CAPTURE) + 8
+# IQ sample rate without decimation
+BB_IQ_RATE = 40e6
+TUNING_DEFAULTS = {"spc": (65536, 262144, 1048576)}
 
 
-class BB60Device:
-    _handle: object = None
-    _max_bw: float = 0
-    _center: float = 0
-    _bw: float = 0
-    _iq_data: list[IQData] = []
-    _quantized_data: list[None] = []
-    app = typer.Typer()
+def _print_bb_error(err: BBDeviceError, config_name: str):
+    s = f"{config_name}: {str(err)}"
+    if err.warning:
+        print_warning(s)
+    else:
+        print_error(s)
+
+
+def _get_iq_into(handle, iq: npt.NDArray[np.complex64]) -> dict:
+    """`bb_get_IQ_unpacked` that fills a recycled buffer.
+
+    The API wrapper allocates a new array per capture.
+    """
+    data_remaining = c_int(-1)
+    sample_loss = c_int(-1)
+    sec = c_int(-1)
+    nano = c_int(-1)
+    status = bbGetIQUnpacked(
+        handle,
+        iq,
+        len(iq),
+        c_int(0),
+        0,
+        BB_FALSE,
+        byref(data_remaining),
+        byref(sample_loss),
+        byref(sec),
+        byref(nano),
+    )
+    if status != 0:
+        raise BBDeviceError(status)
+    return {
+        "data_remaining": data_remaining.value,
+        "sample_loss": sample_loss.value,
+        "sec": sec.value,
+        "nano": nano.value,
+    }
 
-    @staticmethod
-    def _print_bb_error(err: BBDeviceError, config_name: str):
-        s = f"{config_name}: {str(err)}"
-        if err.warning:
-            print_warning(s)
-        else:
-            print_error(s)
-
-    def _open_device(self):
-        devices = bb_get_serial_number_list_2()
-        device_count = devices["device_count"].value
-        if device_count == 0:
-            print_error("No BB60 devices found")
-        elif device_count > 1:
-            print_error("Multiple BB60 devices found. Please connect 1 device only")
 
-        max_bw = BB60A_MAX_RT_SPAN if devices["device_types"][0] == BB_DEVICE_BB60A else BB60C_MAX_RT_SPAN
-        self._handle = bb_open_device()["handle"]
-        self._max_bw = max_bw.value
+class _BB60Worker:
+    """A single BB60 and the acquisition thread that streams from it."""
+
+    def __init__(self, serial: int, device_type: int):
+        self.serial = serial
+        self.max_bw = (
+            BB60A_MAX_RT_SPAN
+            if device_type == BB_DEVICE_BB60A
+            else BB60C_MAX_RT_SPAN
+        ).value
+        self.handle: object = None
+        self.iq_data: list[IQData] = []
+        self._buffers: list[npt.NDArray[np.complex64]] = []
+        self._next_buffer = 0
+        self.lost_captures = 0
+        self.latencies: list[float] = []
+        self.metadata: dict[str, float | int | str] = {}
+        self.error: BBDeviceError | None = None
+        self._thread: threading.Thread | None = None
+        self._stop = threading.Event()
+
+    @property
+    def name(self) -> str:
+        return f"bb60-{self.serial}"
 
     def _call_config_func(self, func, config_name, *args):
         try:
-            func(self._handle, *args)
+            func(self.handle, *args)
         except BBDeviceError as e:
-            self._print_bb_error(e, config_name)
+            _print_bb_error(e, f"{self.name} {config_name}")
 
-    def _configure_bb_device(self):
+    def open(self):
+        device = c_int(-1)
+        status = bbOpenDeviceBySerialNumber(byref(device), self.serial)
+        # The device is open despite a warning, so the handle is kept to close
+        # it later
+        if status >= 0:
+            self.handle = device.value
+        if status != 0:
+            raise BBDeviceError(status)
+
+    def configure(self, center: float, bw: float):
         configs = load_config_section("bb60-configs")
+        device_configs = load_config_section(self.name)
 
         # Reference level
         ref_level = -20.0
@@ -59,63 +151,607 @@ class BB60Device:
         self._call_config_func(bb_configure_ref_level, "Reference level", ref_level)
 
         # Gain and attenuation
-        bb_configure_gain_atten(self._handle, BB_AUTO_GAIN, BB_AUTO_ATTEN)
+        bb_configure_gain_atten(self.handle, BB_AUTO_GAIN, BB_AUTO_ATTEN)
 
         # Center frequency
-        self._call_config_func(bb_configure_IQ_center, "Center Frequency", self._center)
+        if "center" in device_configs:
+            center = float(device_configs["center"])
+        self._call_config_func(
+            bb_configure_IQ_center, "Center Frequency", center
+        )
+        self.metadata = {
+            "platform": "bb60",
+            "serial": self.serial,
+            "center": center,
+            "ref_level": ref_level,
+        }
 
         # Bandwidth
         decimation = BB_MIN_DECIMATION
         if 'decimation' in configs:
             decimation = int(configs['decimation'])
-        self._max_bw = self._max_bw / decimation
-        if self._bw > self._max_bw:
+        max_bw = self.max_bw / decimation
+        if bw > max_bw:
+            print_warning(
+                f"{self.name}: Unable to set the bandwidth to {bw / 1.0e6} "
+                f"MHz. Setting to {max_bw / 1.0e6} MHz"
+            )
+            bw = max_bw
+        self._call_config_func(bb_configure_IQ, "Bandwidth", decimation, bw)
+
+    def _capture(
+        self, progress: MultiCaptureProgress, listeners: list[CaptureListener]
+    ):
+        # Buffers that aren't pre-faulted are allocated when this thread fills
+        # them, so they land on the node of its CPUs
+        with placed_thread("acquisition"):
+            try:
+                for iq in self.iq_data:
+                    if self._stop.is_set():
+                        break
+                    start = time.perf_counter()
+                    data = _get_iq_into(self.handle, iq.iq)
+                    self.latencies.append(time.perf_counter() - start)
+                    iq.ts_sec = data["sec"]
+                    iq.ts_nsec = data["nano"]
+                    lost = data["sample_loss"] != BB_FALSE
+                    self.lost_captures += lost
+                    progress.update(self.name, lost)
+                    for listener in listeners:
+                        listener(self.name, iq)
+            except BBDeviceError as e:
+                # Reading fails once the stream is aborted
+                if not self._stop.is_set():
+                    self.error = e
+
+    def reserve(
+        self,
+        captures: int,
+        samples_per_capture: int,
+        buffers: int,
+        allocator: BufferAllocator,
+    ):
+        self._buffers = [
+            allocator.empty((captures, samples_per_capture), np.complex64)
+            for _ in range(buffers)
+        ]
+        self._next_buffer = 0
+
+    def _next_capture_buffer(
+        self,
+        captures: int,
+        samples_per_capture: int,
+        allocator: BufferAllocator,
+    ) -> npt.NDArray[np.complex64]:
+        if not self._buffers:
+            self._buffers = [
+                allocator.empty((0, samples_per_capture), np.complex64)
+            ]
+        slot = self._next_buffer
+        self._next_buffer = (slot + 1) % len(self._buffers)
+        buffer = self._buffers[slot]
+        if buffer.shape[0] < captures or buffer.shape[1] != samples_per_capture:
+            # Page aligned so the captures can be written with O_DIRECT without
+            # a copy
+            self._buffers[slot] = allocator.empty(
+                (captures, samples_per_capture), np.complex64
+            )
+        return self._buffers[slot]
+
+    def prepare(
+        self,
+        captures: int,
+        samples_per_capture: int,
+        allocator: BufferAllocator,
+    ):
+        """Get the buffer of the next capture ready before it starts."""
+        buffer = self._next_capture_buffer(
+            captures, samples_per_capture, allocator
+        )
+        self.iq_data = [IQData() for _ in range(captures)]
+        for iq, buf in zip(self.iq_data, buffer):
+            iq.iq = buf
+
+    def _initiate(self):
+        bb_initiate(self.handle, BB_STREAMING, BB_STREAM_IQ)
+        params = bb_query_IQ_parameters(self.handle)
+        self.metadata["rate"] = params["sample_rate"]
+        self.metadata["bandwidth"] = params["bandwidth"]
+
+    def query_stream(self):
+        """Start and stop the stream to learn its sample rate and bandwidth."""
+        self._initiate()
+        bb_abort(self.handle)
+
+    def start(
+        self, progress: MultiCaptureProgress, listeners: list[CaptureListener]
+    ):
+        self._initiate()
+        self.lost_captures = 0
+        self.latencies = []
+        self.error = None
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._capture,
+            args=(progress, listeners),
+            name=self.name,
+            daemon=True,
+        )
+        self._thread.start()
+
+    def join(self):
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+            bb_abort(self.handle)
+
+    def abort(self):
+        """Stop streaming before the capture ends and wait for the thread."""
+        if self._thread is None:
+            return
+        self._stop.set()
+        bb_abort(self.handle)
+        self._thread.join()
+        self._thread = None
+
+    def close(self):
+        if self.handle is not None:
+            bb_close_device(self.handle)
+            self.handle = None
+
+
+class BB60Device:
+    """The connected BB60s, each streaming on a worker thread of its own."""
+
+    _workers: list[_BB60Worker] = []
+    _listeners: list[CaptureListener] = []
+    _iq_data: list[IQData] = []
+    _allocator: BufferAllocator | None = None
+    _quantized_data: list[None] = []
+    app = typer.Typer()
+
+    @staticmethod
+    def _selected_serials() -> list[int] | None:
+        configs = load_config_section("bb60-configs")
+        if "serials" not in configs or not configs["serials"].strip():
+            return None
+        return [int(serial) for serial in configs["serials"].split(",")]
+
+    @staticmethod
+    def _samples_per_capture() -> int:
+        return int(
+            load_config_section("bb60-configs").get("spc", SAMPLES_PER_CAPTURE)
+        )
+
+    @staticmethod
+    def _sample_rate() -> float:
+        # What bb_query_IQ_parameters reports, which is only available once the
+        # stream is initiated
+        return BB_IQ_RATE / int(
+            load_config_section("bb60-configs").get(
+                "decimation", BB_MIN_DECIMATION
+            )
+        )
+
+    def _captures_for(
+        self, file_size: float | CaptureBudget, samples_per_capture: int
+    ) -> int:
+        return CaptureBudget.from_size(file_size).captures(
+            self._sample_rate(), len(self._workers), samples_per_capture
+        )
+
+    def _open_devices(self):
+        devices = bb_get_serial_number_list_2()
+        device_count = devices["device_count"].value
+        if device_count == 0:
+            print_error("No BB60 devices found")
+
+        attached = {
+            int(serial): int(device_type)
+            for serial, device_type in zip(
+                devices["serials"][:device_count],
+                devices["device_types"][:device_count],
+            )
+        }
+        serials = self._selected_serials()
+        if serials is None:
+            serials = list(attached.keys())
+
+        missing = [str(serial) for serial in serials if serial not in attached]
+        if missing:
+            print_error(f"BB60 device(s) not found: {', '.join(missing)}")
+
+        self._workers = [
+            _BB60Worker(serial, attached[serial]) for serial in serials
+        ]
+        for worker in self._workers:
+            try:
+                worker.open()
+            except BBDeviceError as e:
+                if not e.warning:
+                    self.close()
+                _print_bb_error(e, worker.name)
+
+    def _close_devices(self):
+        for worker in self._workers:
+            worker.close()
+
+    def close(self) -> None:
+        self._close_devices()
+        self._workers = []
+
+    def abort(self) -> None:
+        """Stop the capture in progress on every BB60 and wait for them."""
+        for worker in self._workers:
+            worker.abort()
+
+    def stream_iq(
+        self,
+        center: float,
+        bw: float,
+        batch: int = 64,
+        depth: int = 4,
+        backpressure: str = "block",
+        pass_size: float | CaptureBudget = DEFAULT_PASS,
+    ) -> Iterator[IQBatch]:
+        return stream_iq(
+            self, center, bw, batch, depth, backpressure, pass_size
+        )
+
+    def astream_iq(
+        self,
+        center: float,
+        bw: float,
+        batch: int = 64,
+        depth: int = 4,
+        backpressure: str = "block",
+        pass_size: float | CaptureBudget = DEFAULT_PASS,
+    ) -> AsyncIterator[IQBatch]:
+        return astream_iq(
+            self, center, bw, batch, depth, backpressure, pass_size
+        )
+
+    def add_capture_listener(self, listener: CaptureListener) -> None:
+        self._listeners = self._listeners + [listener]
+
+    def remove_capture_listener(self, listener: CaptureListener) -> None:
+        self._listeners = [
+            registered
+            for registered in self._listeners
+            if registered is not listener
+        ]
+
+    @staticmethod
+    def _buffer_allocator() -> BufferAllocator:
+        return BufferAllocator(load_buffer_settings("bb60-configs"))
+
+    @staticmethod
+    def _check_buffers(allocator: BufferAllocator):
+        if allocator.bytes and allocator.settings.lock and not allocator.locked:
             print_warning(
-                f"Unable to set the bandwidth to {self._bw / 1.0e6} MHz. Setting to {self._max_bw / 1.0e6} MHz")
-            self._bw = self._max_bw
-        self._call_config_func(bb_configure_IQ, "Bandwidth", decimation, self._bw)
+                "Unable to lock the capture buffers in memory. Raise the "
+                "memlock limit (ulimit -l)"
+            )
 
-    def capture_iq(self, center: float, bw: float, file_size_gb: float, verbose: bool, extra: bool) -> None:
-        self._bw = bw
-        self._center = center
+    def reserve(
+        self, file_size_gb: float | CaptureBudget, buffers: int = 1
+    ) -> None:
+        if not self._workers:
+            self._open_devices()
+        samples_per_capture = self._samples_per_capture()
+        captures = self._captures_for(file_size_gb, samples_per_capture)
+        allocator = self._buffer_allocator()
+        for worker in self._workers:
+            worker.reserve(captures, samples_per_capture, buffers, allocator)
+        self._check_buffers(allocator)
 
-        self._open_device()
-        self._configure_bb_device()
-        bb_initiate(self._handle, BB_STREAMING, BB_STREAM_IQ)
+    def _prepare(
+        self, file_size: float | CaptureBudget, samples_per_capture: int
+    ) -> int:
+        """Prepare the buffers of a capture.
+
+        :return: The number of captures per device.
+        """
+        captures = self._captures_for(file_size, samples_per_capture)
+        # Buffers are prepared before the progress starts so their page faults
+        # aren't counted as capture time
+        self._allocator = self._buffer_allocator()
+        for worker in self._workers:
+            worker.prepare(captures, samples_per_capture, self._allocator)
+        self._check_buffers(self._allocator)
+        return captures
+
+    def _stream(self, captures: int, samples_per_capture: int, hide: bool):
+        streams = {worker.name: captures for worker in self._workers}
+        extra_renderables: list[RenderableType] = []
+        for listener in self._listeners:
+            if isinstance(listener, RichCast):
+                extra_renderables.append(listener)
+        with MultiCaptureProgress(
+            streams, samples_per_capture, hide, extra_renderables
+        ) as progress:
+            for worker in self._workers:
+                worker.start(progress, self._listeners)
+            try:
+                for worker in self._workers:
+                    worker.join()
+            except BaseException:
+                # Interrupted, e.g. by Ctrl-C. The acquisition threads are
+                # stopped before the caller tears down the listeners they call
+                # and closes the devices they read from
+                self.abort()
+                raise
+
+        for worker in self._workers:
+            if worker.error is not None:
+                _print_bb_error(worker.error, worker.name)
+            rate = float(worker.metadata["rate"])
+            if rate != self._sample_rate():
+                print_warning(
+                    f"{worker.name}: streamed at {rate / 1e6:g} MS/s instead "
+                    "of the "
+                    f"{self._sample_rate() / 1e6:g} MS/s the capture was sized "
+                    "for"
+                )
+
+    def _configure_workers(self, center: float, bw: float):
+        # Devices stay open between captures so repeated captures only pay for
+        # reconfiguration
+        if not self._workers:
+            self._open_devices()
+        for worker in self._workers:
+            worker.configure(center, bw)
+
+    def configure(
+        self, center: float, bw: float, extra_verbose: bool = False
+    ) -> None:
+        self._configure_workers(center, bw)
+        for worker in self._workers:
+            worker.query_stream()
+
+    def capture_iq(
+        self,
+        center: float,
+        bw: float,
+        file_size_gb: float | CaptureBudget,
+        verbose: bool,
+        extra: bool,
+    ) -> None:
+        self._configure_workers(center, bw)
 
         # Pre-allocate to avoid doing it later...
-        file_size = file_size_gb * 1e9
-        captures = math.ceil(file_size / BYTES_PER_CAPTURE)
-        self._iq_data = [IQData() for _ in range(captures)]
-
-        with CaptureProgress(captures, SAMPLES_PER_CAPTURE, not (verbose or extra)) as progress:
-            for iq in self._iq_data:
-                data = bb_get_IQ_unpacked(self._handle, SAMPLES_PER_CAPTURE, BB_FALSE)
-                iq.iq = data["iq"]
-                iq.ts_sec = data["sec"]
-                iq.ts_nsec = data["nano"]
-                progress.update()
-            progress.update()
+        samples_per_capture = self._samples_per_capture()
+        captures = self._prepare(file_size_gb, samples_per_capture)
+        if captures and (verbose or extra):
+            allocator = self._allocator
+            if allocator is not None and allocator.bytes:
+                typer.echo(
+                    warmup_summary(
+                        allocator.warmup_seconds,
+                        allocator.bytes,
+                        allocator.locked,
+                        allocator.huge_pages,
+                    )
+                )
+            typer.echo(
+                budget_summary(
+                    captures,
+                    samples_per_capture,
+                    self._sample_rate(),
+                    len(self._workers),
+                    CaptureBudget.from_size(file_size_gb).sample_bytes,
+                )
+            )
 
+        self._stream(captures, samples_per_capture, not (verbose or extra))
+        for worker in self._workers:
+            if worker.lost_captures:
+                print_warning(
+                    f"{worker.name}: sample loss in {worker.lost_captures} of "
+                    f"{captures} captures"
+                )
+
+        self._iq_data = self._workers[0].iq_data
         self._quantize()
 
-        bb_close_device(self._handle)
+    def tuning_grid(self, values: dict[str, list[int]]) -> list[dict[str, int]]:
+        return tuning_grid("bb60", TUNING_DEFAULTS, values)
+
+    def tune_trial(
+        self,
+        settings: dict[str, int],
+        center: float,
+        bw: float,
+        file_size_gb: float,
+    ) -> TrialResult:
+        self._configure_workers(center, bw)
+        captures = self._prepare(file_size_gb, settings["spc"])
+
+        def capture():
+            self._stream(captures, settings["spc"], True)
+            return (
+                captures * len(self._workers),
+                sum(worker.lost_captures for worker in self._workers),
+                [
+                    latency
+                    for worker in self._workers
+                    for latency in worker.latencies
+                ],
+            )
+
+        return measure(settings, capture)
+
+    def save_tuning(self, settings: dict[str, int]) -> None:
+        configs = load_config_section("bb60-configs")
+        configs["spc"] = str(settings["spc"])
+        save_config_section("bb60-configs", configs)
 
     @staticmethod
     @app.command(name='bb60-config', help='Set default configurations for the BB60')
-    def config(ref_level: Annotated[float | None, typer.Option(help='Reference level of the BB60')] = None,
-               decimation: Annotated[int | None, typer.Option(help='Downsample factor')] = None):
+    def config(
+        ref_level: Annotated[
+            float | None, typer.Option(help="Reference level of the BB60")
+        ] = None,
+        decimation: Annotated[
+            int | None, typer.Option(help="Downsample factor")
+        ] = None,
+        spc: Annotated[
+            int | None, typer.Option(help="Samples per capture")
+        ] = None,
+        serials: Annotated[
+            str | None,
+            typer.Option(
+                help="Comma separated serial numbers of the BB60s to capture "
+                "from. Empty selects all"
+            ),
+        ] = None,
+        acquisition_cpus: Annotated[
+            str | None,
+            typer.Option(
+                help="CPUs of the acquisition threads, e.g. 2-3. `none` lets "
+                "them run anywhere"
+            ),
+        ] = None,
+        writer_cpus: Annotated[
+            str | None,
+            typer.Option(help="CPUs of the threads writing captures to disk"),
+        ] = None,
+        worker_cpus: Annotated[
+            str | None,
+            typer.Option(
+                help="CPUs of the threads and processes analyzing captures"
+            ),
+        ] = None,
+        realtime_priority: Annotated[
+            int | None,
+            typer.Option(
+                help="Run the acquisition threads with SCHED_FIFO at this "
+                "priority. 0 disables"
+            ),
+        ] = None,
+        numa_node: Annotated[
+            int | None,
+            typer.Option(
+                help="NUMA node of the BB60 USB controllers. Threads without "
+                "CPUs run on its CPUs. "
+                "-1 disables"
+            ),
+        ] = None,
+        prefault_buffers: Annotated[
+            bool | None,
+            typer.Option(
+                help="Touch every page of new capture buffers before the "
+                "capture"
+            ),
+        ] = None,
+        lock_buffers: Annotated[
+            bool | None,
+            typer.Option(
+                help="Lock the capture buffers in memory. Needs a large enough "
+                "memlock limit"
+            ),
+        ] = None,
+        huge_pages: Annotated[
+            str | None,
+            typer.Option(
+                help="Huge pages for the capture buffers: `none`, "
+                "`transparent` or `explicit` "
+                "(vm.nr_hugepages)"
+            ),
+        ] = None,
+    ):
         configs = load_config_section("bb60-configs")
         if ref_level is not None:
             configs['ref-level'] = str(ref_level)
         if decimation is not None:
             configs['decimation'] = str(decimation)
+        if spc is not None:
+            if spc <= 0:
+                print_error("spc must be a non-zero positive integer")
+            configs["spc"] = str(spc)
+        if serials is not None:
+            try:
+                configs["serials"] = ",".join(
+                    str(int(s)) for s in serials.split(",") if s.strip()
+                )
+            except ValueError:
+                print_error(
+                    "serials must be a comma separated list of integers"
+                )
+        update_cpu_configs(
+            configs,
+            acquisition_cpus,
+            writer_cpus,
+            worker_cpus,
+            realtime_priority,
+            numa_node,
+        )
+        update_buffer_configs(
+            configs, prefault_buffers, lock_buffers, huge_pages
+        )
         save_config_section("bb60-configs", configs)
 
+    @staticmethod
+    @app.command(
+        name="bb60-device-config", help="Set configurations for a specific BB60"
+    )
+    def device_config(
+        serial: Annotated[
+            int, typer.Argument(help="Serial number of the BB60")
+        ],
+        center: Annotated[
+            float | None,
+            typer.Option(
+                help="Center frequency in MHz. Overrides the capture center "
+                "for this device"
+            ),
+        ] = None,
+    ):
+        section = f"bb60-{serial}"
+        configs = load_config_section(section)
+        if center is not None:
+            configs["center"] = str(center * 1e6)
+        save_config_section(section, configs)
+
+    def stream_requirements(self, file_size_gb: float) -> StreamRequirements:
+        # Without opening the devices only the selected serials are known
+        devices = len(self._selected_serials() or [None])
+        placement = load_cpu_placement("bb60-configs")
+        buffers = load_buffer_settings("bb60-configs")
+        return StreamRequirements(
+            self._sample_rate(),
+            devices,
+            0,
+            devices,
+            file_size_gb,
+            False,
+            placement.acquisition_cpus,
+            buffers.lock,
+            buffers.huge_pages,
+            placement.realtime_priority,
+        )
+
     @property
     def iq_data(self):
         return self._iq_data
 
+    @property
+    def iq_streams(self) -> dict[str, list[IQData]]:
+        return {worker.name: worker.iq_data for worker in self._workers}
+
+    @property
+    def full_scale(self) -> float:
+        # Samples are scaled so I^2 + Q^2 is in mW, and the ADC saturates around
+        # the reference level
+        return 10 ** (
+            float(load_config_section("bb60-configs").get("ref-level", -20.0))
+            / 20
+        )
+
+    @property
+    def stream_metadata(self) -> dict[str, dict[str, float | int | str]]:
+        return {worker.name: worker.metadata for worker in self._workers}
+
     @property
     def quantized_data(self):
         return self._quantized_data
@@ -1,9 +1,20 @@
-from ares_iq_ext.usrp import _USRP
-from ares_iq.iq_data import IQData
-from decimal import Decimal
+import os
 from abc import ABCMeta, abstractmethod
-from ares_iq.print_utils import print_error
+from contextlib import AbstractContextManager, nullcontext
+from decimal import Decimal
+from typing import AsyncIterator, Iterator
+
+import typer
+from ares_iq_ext.usrp import _USRP, _CaptureBudget
+from rich.console import RenderableType, RichCast
 
+from ares_iq.affinity import get_placement, record_thread
+from ares_iq.buffers import warmup_summary
+from ares_iq.capture_budget import CaptureBudget, budget_summary
+from ares_iq.iq_data import IQData
+from ares_iq.print_utils import MultiCaptureProgress, print_error, print_warning
+from ares_iq.stream import DEFAULT_PASS, IQBatch, astream_iq, stream_iq
+from ares_iq.typing import CaptureListener
 
 __USRPMeta = type(_USRP)
 
@@ -14,26 +25,192 @@ class _USRPMeta(__USRPMeta, ABCMeta):
 
 class USRP(_USRP, metaclass=_USRPMeta):
     _iq_data: list[IQData]
+    _iq_streams: dict[str, list[IQData]]
     _quantized_data: list[None]
+    _listeners: list[CaptureListener] = []
+    platform = "usrp"
+
+    def __init__(self, configs):
+        super().__init__(configs)
+        self._lock_buffers = configs.lock_buffers
 
     @abstractmethod
     def _stream_args(self):
         pass
 
-    def capture_iq(self, center: float, bw: float, file_size: float, verbose: bool, extra: bool):
+    @staticmethod
+    def _budget(file_size: float | CaptureBudget) -> _CaptureBudget:
+        budget = CaptureBudget.from_size(file_size)
+        budget_ = _CaptureBudget()
+        budget_.seconds = budget.seconds
+        budget_.samples = budget.samples
+        budget_.bytes = budget.bytes
+        budget_.sample_bytes = budget.sample_bytes
+        return budget_
+
+    def captures_for(self, file_size: float | CaptureBudget) -> int:
+        return super().captures_for(self._budget(file_size))
+
+    def reserve(
+        self, file_size_gb: float | CaptureBudget, buffers: int = 1
+    ) -> None:
+        super().reserve(self._budget(file_size_gb), buffers)
+
+    def configure(
+        self, center: float, bw: float, extra_verbose: bool = False
+    ) -> None:
+        self._stream_args()
+        try:
+            super().configure(center, bw, extra_verbose)
+        except ValueError as e:
+            print_error(str(e))
+
+    def capture_iq(
+        self,
+        center: float,
+        bw: float,
+        file_size: float | CaptureBudget,
+        verbose: bool,
+        extra: bool,
+    ):
         self._stream_args()
+        budget = self._budget(file_size)
+        listeners = self._listeners
+        progress: AbstractContextManager = nullcontext()
+        on_capture = None
+        if listeners:
+            # The C++ progress bar can't share the terminal with the listeners,
+            # so progress is drawn from Python
+            captures = super().captures_for(budget)
+            streams = {f"ch{chan}": captures for chan in range(self.channels)}
+            extra_renderables: list[RenderableType] = []
+            for listener in listeners:
+                if isinstance(listener, RichCast):
+                    extra_renderables.append(listener)
+            progress = bars = MultiCaptureProgress(
+                streams,
+                self.samples_per_capture,
+                not (verbose or extra),
+                extra_renderables,
+            )
+
+            def on_capture(chan: int, samples, ts: float):
+                stream = f"ch{chan}"
+                iq = self._to_iq_data([samples], [ts])[0]
+                bars.update(stream)
+                for listener in listeners:
+                    listener(stream, iq)
+
         try:
-            iq_data, timestamps = super().capture_iq(center, bw, file_size, verbose, extra)
+            with progress:
+                iq_data, timestamps = super().capture_iq(
+                    center, bw, budget, verbose, extra, on_capture
+                )
         except ValueError as e:
             print_error(str(e))
+        self._record_recv_threads()
+        # Nothing to report for empty captures
+        captures = iq_data.shape[1]
+        self._report_warmup((verbose or extra) and captures > 0)
+        if (verbose or extra) and captures:
+            typer.echo(
+                budget_summary(
+                    captures,
+                    self.samples_per_capture,
+                    self.rate,
+                    self.channels,
+                    budget.sample_bytes,
+                )
+            )
 
-        self._iq_data = [IQData() for _ in range(len(timestamps))]
-        for data, ts, iq in zip(iq_data, timestamps, self._iq_data):
+        self._iq_streams = {}
+        for chan, (chan_data, chan_timestamps) in enumerate(
+            zip(iq_data, timestamps)
+        ):
+            self._iq_streams[f"ch{chan}"] = self._to_iq_data(
+                chan_data, chan_timestamps
+            )
+        self._iq_data = self._iq_streams["ch0"]
+
+        self._quantize()
+
+    def _report_warmup(self, verbose: bool):
+        if not self.warmup_bytes:
+            return
+        if verbose:
+            typer.echo(
+                warmup_summary(
+                    self.warmup_time,
+                    self.warmup_bytes,
+                    self.buffers_locked,
+                    self.buffer_huge_pages,
+                )
+            )
+        if self._lock_buffers and not self.buffers_locked:
+            print_warning(
+                "Unable to lock the capture buffers in memory. Raise the "
+                "memlock limit (ulimit -l)"
+            )
+
+    def _record_recv_threads(self):
+        cpus = get_placement().acquisition_cpus or tuple(
+            sorted(os.sched_getaffinity(0))
+        )
+        # Without a realtime priority the receive threads get UHD's default
+        # priority
+        policy = "fifo" if self.recv_realtime else "uhd"
+        for chan, cpu in enumerate(self.recv_cpus):
+            name = (
+                f"usrp-recv-ch{chan}"
+                if len(self.recv_cpus) > 1
+                else "usrp-recv"
+            )
+            record_thread("acquisition", name, None, cpus, policy, cpu)
+
+    @staticmethod
+    def _to_iq_data(iq_data, timestamps) -> list[IQData]:
+        captures = [IQData() for _ in range(len(timestamps))]
+        for data, ts, iq in zip(iq_data, timestamps, captures):
             iq.iq = data
             iq.ts_sec = int(ts)
             iq.ts_nsec = int((Decimal(ts) - iq.ts_sec) * Decimal('1e9'))
+        return captures
 
-        self._quantize()
+    def stream_iq(
+        self,
+        center: float,
+        bw: float,
+        batch: int = 64,
+        depth: int = 4,
+        backpressure: str = "block",
+        pass_size: float | CaptureBudget = DEFAULT_PASS,
+    ) -> Iterator[IQBatch]:
+        return stream_iq(
+            self, center, bw, batch, depth, backpressure, pass_size
+        )
+
+    def astream_iq(
+        self,
+        center: float,
+        bw: float,
+        batch: int = 64,
+        depth: int = 4,
+        backpressure: str = "block",
+        pass_size: float | CaptureBudget = DEFAULT_PASS,
+    ) -> AsyncIterator[IQBatch]:
+        return astream_iq(
+            self, center, bw, batch, depth, backpressure, pass_size
+        )
+
+    def add_capture_listener(self, listener: CaptureListener) -> None:
+        self._listeners = self._listeners + [listener]
+
+    def remove_capture_listener(self, listener: CaptureListener) -> None:
+        self._listeners = [
+            registered
+            for registered in self._listeners
+            if registered is not listener
+        ]
 
     @abstractmethod
     def _quantize(self):
@@ -43,6 +220,34 @@ class USRP(_USRP, metaclass=_USRPMeta):
     def iq_data(self) -> list[IQData]:
         return self._iq_data
 
+    @property
+    def iq_streams(self) -> dict[str, list[IQData]]:
+        return self._iq_streams
+
+    @property
+    def full_scale(self) -> float:
+        # sc16 samples are converted to fc32 with 32767 mapped to 1
+        return 1.0
+
+    @property
+    def stream_metadata(self) -> dict[str, dict[str, float | int | str]]:
+        metadata = {
+            "center": self.center,
+            "bandwidth": self.bandwidth,
+            "rate": self.rate,
+            "gain": self.gain,
+            "tune_time": self.tune_time,
+            "start_time": self.start_time,
+            "time_source": self.time_source,
+            "dev_args": self.dev_args,
+            "subdev": self.subdev,
+            "platform": self.platform,
+        }
+        return {
+            f"ch{chan}": metadata | {"channel": chan}
+            for chan in range(self.channels)
+        }
+
     @property
     def quantized_data(self) -> list[None]:
         return self._quantized_data
@@ -4,16 +4,33 @@ import typer
 from typing_extensions import Annotated
 from ares_iq.configurations import load_config_section, save_config_section
 from ares_iq.print_utils import print_error
+from ares_iq.affinity import load_cpu_placement, update_cpu_configs
+from ares_iq.buffers import load_buffer_settings, update_buffer_configs
+from ares_iq.doctor import StreamRequirements
+from ares_iq.autotune import TrialResult, measure, tuning_grid
+
+DEFAULT_SPP = 200
+# CHDR header with timestamp in each receive frame
+CHDR_HEADER = 16
+TUNING_DEFAULTS = {
+    "spp": (200, 1000, 1996),
+    "spc": (100000, 200000, 1000000),
+    "num-recv-frames": (256, 1024),
+    "recv-frame-size": (8000,),
+}
 
 
 class X310Device(USRP):
     app = typer.Typer()
+    platform = "x310"
 
     @staticmethod
     def _load_configs():
         configs = load_config_section('x310-configs')
         configs_ = _USRPConfigs()
-        configs_.dev_args = "type=x300"
+        configs_.dev_args = X310Device._device_args(
+            configs.get("num-recv-frames"), configs.get("recv-frame-size")
+        )
 
         if "spc" in configs:
             configs_.samples_per_capture = int(configs["spc"])
@@ -30,11 +47,45 @@ class X310Device(USRP):
         if "gain" in configs:
             configs_.gain = float(configs["gain"])
 
+        if "streamer-per-channel" in configs:
+            configs_.streamer_per_channel = configs.getboolean(
+                "streamer-per-channel"
+            )
+
+        if "time-source" in configs:
+            configs_.time_source = configs["time-source"]
+
+        if "start-lead" in configs:
+            configs_.start_lead = float(configs["start-lead"])
+
+        placement = load_cpu_placement("x310-configs")
+        configs_.acquisition_cpus = list(placement.acquisition_cpus)
+        configs_.realtime_priority = placement.realtime_priority
+
+        buffers = load_buffer_settings("x310-configs")
+        configs_.prefault_buffers = buffers.prefault
+        configs_.lock_buffers = buffers.lock
+        configs_.huge_pages = buffers.huge_pages
+
         return configs_
 
-    def __init__(self):
-        configs = self._load_configs()
-        super().__init__(configs)
+    @staticmethod
+    def _device_args(
+        num_recv_frames: str | int | None, recv_frame_size: str | int | None
+    ) -> str:
+        args = "type=x300"
+        if num_recv_frames:
+            args += f",num_recv_frames={num_recv_frames}"
+        if recv_frame_size:
+            args += f",recv_frame_size={recv_frame_size}"
+        return args
+
+    def __init__(
+        self, configs: _USRPConfigs | None = None, spp: int | None = None
+    ):
+        """:param spp: Samples per packet instead of the configured one"""
+        super().__init__(configs or self._load_configs())
+        self._spp_override = spp
 
     def _quantize(self):
         pass
@@ -48,21 +99,195 @@ class X310Device(USRP):
 
         save_config_section("x310-stream-configs", configs)
 
-    def _stream_args(self):
+    @staticmethod
+    def _stream_spp() -> int:
         configs = load_config_section("x310-stream-configs")
         if "spp" not in configs:
-            spp = 200
-        else:
-            spp = int(configs["spp"])
-        self._set_stream_args(spp)
+            return DEFAULT_SPP
+        return int(configs["spp"])
+
+    def _stream_args(self):
+        self._set_stream_args(self._spp_override or self._stream_spp())
+
+    def stream_requirements(self, file_size_gb: float) -> StreamRequirements:
+        placement = load_cpu_placement("x310-configs")
+        buffers = load_buffer_settings("x310-configs")
+        return StreamRequirements(
+            self.rate,
+            self.channels,
+            self._stream_spp(),
+            self.channels if self.streamer_per_channel else 1,
+            file_size_gb,
+            True,
+            placement.acquisition_cpus,
+            buffers.lock,
+            buffers.huge_pages,
+            placement.realtime_priority,
+        )
+
+    def tuning_grid(self, values: dict[str, list[int]]) -> list[dict[str, int]]:
+        grid = [
+            settings
+            for settings in tuning_grid("x310", TUNING_DEFAULTS, values)
+            if settings["spp"] * 4 + CHDR_HEADER <= settings["recv-frame-size"]
+        ]
+        if not grid:
+            print_error(
+                "No spp fits in a receive frame. spp can be at most "
+                f"(recv-frame-size - {CHDR_HEADER}) / 4"
+            )
+        return grid
+
+    def tune_trial(
+        self,
+        settings: dict[str, int],
+        center: float,
+        bw: float,
+        file_size_gb: float,
+    ) -> TrialResult:
+        configs = self._load_configs()
+        configs.samples_per_capture = settings["spc"]
+        configs.dev_args = self._device_args(
+            settings["num-recv-frames"], settings["recv-frame-size"]
+        )
+        # The transport args only apply when the device is opened, so each trial
+        # opens its own
+        device = X310Device(configs, settings["spp"])
+        try:
+            # Opened, tuned and allocated before the measured capture
+            device.configure(center, bw)
+            device.reserve(file_size_gb)
+
+            def capture():
+                device.capture_iq(center, bw, file_size_gb, False, False)
+                return (
+                    device.captures_for(file_size_gb),
+                    device.overflows,
+                    device.recv_latencies,
+                )
+
+            return measure(settings, capture)
+        finally:
+            device.close()
+
+    def save_tuning(self, settings: dict[str, int]) -> None:
+        stream_configs = load_config_section("x310-stream-configs")
+        stream_configs["spp"] = str(settings["spp"])
+        save_config_section("x310-stream-configs", stream_configs)
+        configs = load_config_section("x310-configs")
+        for key in ("spc", "num-recv-frames", "recv-frame-size"):
+            configs[key] = str(settings[key])
+        save_config_section("x310-configs", configs)
 
     @staticmethod
     @app.command('x310-configs', help='Set x310 device configs')
-    def dev_configs(spc: Annotated[int | None, typer.Option(help='Samples per capture')] = None,
-                    subdev: Annotated[str | None, typer.Option(help='RX frontend specification')] = None,
-                    ref: Annotated[str | None, typer.Option(help='Clock source for the USRP device')] = None,
-                    rate: Annotated[float | None, typer.Option(help='RX sample rate')] = None,
-                    gain: Annotated[float | None, typer.Option(help='Overall RX gain')] = None):
+    def dev_configs(
+        spc: Annotated[
+            int | None, typer.Option(help="Samples per capture")
+        ] = None,
+        subdev: Annotated[
+            str | None, typer.Option(help="RX frontend specification")
+        ] = None,
+        ref: Annotated[
+            str | None, typer.Option(help="Clock source for the USRP device")
+        ] = None,
+        rate: Annotated[
+            float | None, typer.Option(help="RX sample rate")
+        ] = None,
+        gain: Annotated[
+            float | None, typer.Option(help="Overall RX gain")
+        ] = None,
+        streamer_per_channel: Annotated[
+            bool | None,
+            typer.Option(
+                help="Use one streamer and receive thread per channel instead "
+                "of one time aligned "
+                'streamer for all channels (e.g. subdev "A:0 B:0")'
+            ),
+        ] = None,
+        time_source: Annotated[
+            str | None,
+            typer.Option(
+                help="Set the device time from `external` PPS (host time) or "
+                "`gpsdo` (GPS time). "
+                "`none` leaves the device time unsynchronized"
+            ),
+        ] = None,
+        start_lead: Annotated[
+            float | None,
+            typer.Option(
+                help="Start captures on the first whole second of device time "
+                "at least this many "
+                "seconds after the stream command. 0 starts immediately"
+            ),
+        ] = None,
+        acquisition_cpus: Annotated[
+            str | None,
+            typer.Option(
+                help="CPUs of the receive threads, e.g. 2-3. `none` lets them "
+                "run anywhere"
+            ),
+        ] = None,
+        writer_cpus: Annotated[
+            str | None,
+            typer.Option(help="CPUs of the threads writing captures to disk"),
+        ] = None,
+        worker_cpus: Annotated[
+            str | None,
+            typer.Option(
+                help="CPUs of the threads and processes analyzing captures"
+            ),
+        ] = None,
+        realtime_priority: Annotated[
+            int | None,
+            typer.Option(
+                help="Run the receive threads with SCHED_FIFO at this priority "
+                "instead of the UHD "
+                "default. 0 disables"
+            ),
+        ] = None,
+        numa_node: Annotated[
+            int | None,
+            typer.Option(
+                help="NUMA node of the NIC. Threads without CPUs run on its "
+                "CPUs. -1 disables"
+            ),
+        ] = None,
+        prefault_buffers: Annotated[
+            bool | None,
+            typer.Option(
+                help="Touch every page of new capture buffers before streaming"
+            ),
+        ] = None,
+        lock_buffers: Annotated[
+            bool | None,
+            typer.Option(
+                help="Lock the capture buffers in memory. Needs a large enough "
+                "memlock limit"
+            ),
+        ] = None,
+        huge_pages: Annotated[
+            str | None,
+            typer.Option(
+                help="Huge pages for the capture buffers: `none`, "
+                "`transparent` or `explicit` "
+                "(vm.nr_hugepages)"
+            ),
+        ] = None,
+        num_recv_frames: Annotated[
+            int | None,
+            typer.Option(
+                help="UHD receive frames buffered by the transport. 0 uses the "
+                "UHD default"
+            ),
+        ] = None,
+        recv_frame_size: Annotated[
+            int | None,
+            typer.Option(
+                help="UHD receive frame size in bytes. 0 uses the UHD default"
+            ),
+        ] = None,
+    ):
         configs = load_config_section('x310-configs')
 
         if spc is not None:
@@ -84,4 +309,46 @@ class X310Device(USRP):
         if gain is not None:
             configs["gain"] = str(gain)
 
+        if streamer_per_channel is not None:
+            configs["streamer-per-channel"] = str(streamer_per_channel)
+
+        if time_source is not None:
+            if not (
+                time_source == "none"
+                or time_source == "external"
+                or time_source == "gpsdo"
+            ):
+                print_error(
+                    "time-source must be `none`, `external`, or `gpsdo`"
+                )
+            configs["time-source"] = (
+                "" if time_source == "none" else time_source
+            )
+
+        if start_lead is not None:
+            if start_lead < 0:
+                print_error("start-lead must be a positive number of seconds")
+            configs["start-lead"] = str(start_lead)
+
+        for key, value in (
+            ("num-recv-frames", num_recv_frames),
+            ("recv-frame-size", recv_frame_size),
+        ):
+            if value is not None:
+                if value < 0:
+                    print_error(f"{key} must be a positive integer or 0")
+                configs[key] = str(value) if value else ""
+
+        update_cpu_configs(
+            configs,
+            acquisition_cpus,
+            writer_cpus,
+            worker_cpus,
+            realtime_priority,
+            numa_node,
+        )
+        update_buffer_configs(
+            configs, prefault_buffers, lock_buffers, huge_pages
+        )
+
         save_config_section('x310-configs', configs)
@@ -0,0 +1,157 @@
+"""Search for the stream settings that keep up with the device."""
+
+import itertools
+import time
+from typing import Callable, Mapping, NamedTuple, Sequence
+
+import numpy as np
+from rich.progress import Progress
+from rich.table import Table
+from typer import Exit
+
+from .print_utils import print_error
+
+
+class TrialResult(NamedTuple):
+    """What one auto-tune trial measured."""
+
+    settings: dict[str, int]
+    captures: int = 0
+    lost: int = 0
+    """Overflows (USRP) or captures with sample loss (BB60)"""
+    seconds: float = 0
+    cpu_percent: float = 0
+    """CPU time of the process over the capture time. 100 is one CPU busy"""
+    latency_p50_ms: float = 0
+    """Time a call receiving one capture took"""
+    latency_p99_ms: float = 0
+    error: str = ""
+
+
+def parse_values(name: str, spec: str) -> list[int]:
+    """Parse the comma separated values of a tuning option."""
+    try:
+        values = [int(value) for value in spec.split(",") if value.strip()]
+    except ValueError:
+        values = []
+    if not values or any(value <= 0 for value in values):
+        print_error(
+            f"{name} must be a comma separated list of positive integers"
+        )
+    return values
+
+
+def tuning_grid(
+    platform: str,
+    defaults: Mapping[str, Sequence[int]],
+    values: dict[str, list[int]],
+) -> list[dict[str, int]]:
+    """Every combination of the tuned settings.
+
+    `values` replace the defaults of the settings they name.
+    """
+    unknown = set(values) - set(defaults)
+    if unknown:
+        print_error(f"{platform} doesn't tune {', '.join(sorted(unknown))}")
+    axes = {
+        name: values.get(name, default) for name, default in defaults.items()
+    }
+    return [
+        dict(zip(axes, combination))
+        for combination in itertools.product(*axes.values())
+    ]
+
+
+def measure(
+    settings: dict[str, int],
+    capture: Callable[[], tuple[int, int, Sequence[float]]],
+) -> TrialResult:
+    """Time `capture`, which streams with `settings`.
+
+    `capture` returns the number of captures, the lost count and the seconds
+    each receive call took.
+    """
+    wall, cpu = time.perf_counter(), time.process_time()
+    captures, lost, latencies = capture()
+    seconds = time.perf_counter() - wall
+    cpu_seconds = time.process_time() - cpu
+    latencies_ms = np.asarray(latencies) * 1e3
+    return TrialResult(
+        settings,
+        captures,
+        lost,
+        seconds,
+        100 * cpu_seconds / seconds if seconds else 0,
+        float(np.percentile(latencies_ms, 50)) if len(latencies_ms) else 0,
+        float(np.percentile(latencies_ms, 99)) if len(latencies_ms) else 0,
+    )
+
+
+def run_trials(
+    grid: list[dict[str, int]],
+    trial: Callable[[dict[str, int]], TrialResult],
+    hide: bool = False,
+) -> list[TrialResult]:
+    """Run a trial for each settings of the grid.
+
+    Settings the device rejects are kept with an error.
+    """
+    results = []
+    with Progress(transient=hide, disable=hide) as progress:
+        task = progress.add_task("Tuning", total=len(grid))
+        for settings in grid:
+            try:
+                results.append(trial(settings))
+            except Exit:
+                results.append(
+                    TrialResult(settings, error="rejected, see above")
+                )
+            progress.advance(task)
+    return results
+
+
+def best_trial(results: list[TrialResult]) -> TrialResult | None:
+    """The lossless trial with the least CPU, then the lowest p99 latency.
+
+    None if every trial lost data.
+    """
+    lossless = [
+        result
+        for result in results
+        if not result.error and result.captures and not result.lost
+    ]
+    return min(
+        lossless,
+        key=lambda result: (result.cpu_percent, result.latency_p99_ms),
+        default=None,
+    )
+
+
+def trials_table(results: list[TrialResult], best: TrialResult | None) -> Table:
+    """The trials as a table with `best` highlighted."""
+    table = Table(
+        title="Auto-tune trials",
+        caption="p50 and p99 of the time taken to receive one capture",
+    )
+    names = list(results[0].settings) if results else []
+    for column in names + ["captures", "lost", "CPU %", "p50 ms", "p99 ms"]:
+        table.add_column(column, justify="right")
+    table.add_column("status")
+    for result in results:
+        if result.error:
+            status = result.error
+        elif result.lost:
+            status = "lost data"
+        else:
+            status = "best" if result is best else "ok"
+        table.add_row(
+            *[str(result.settings[name]) for name in names],
+            str(result.captures),
+            str(result.lost),
+            f"{result.cpu_percent:.0f}",
+            f"{result.latency_p50_ms:.2f}",
+            f"{result.latency_p99_ms:.2f}",
+            status,
+            style="bold green" if result is best else None,
+        )
+    return table
@@ -0,0 +1,165 @@
+"""Capture buffers that are pre-faulted, locked and huge page backed."""
+
+import ctypes
+import mmap
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from configparser import SectionProxy
+from typing import NamedTuple
+
+import numpy as np
+
+from .affinity import get_placement, pin_cpus
+from .configurations import load_config_section
+from .print_utils import print_error
+
+HUGE_PAGES = ("none", "transparent", "explicit")
+"""Huge page backing of capture buffers, from the least to the most.
+transparent: madvise the buffers for transparent huge pages, explicit: pages
+reserved with vm.nr_hugepages, falling back to transparent huge pages.
+"""
+
+# Not exported by the mmap module before Python 3.13
+MAP_HUGETLB = getattr(mmap, "MAP_HUGETLB", 0x40000)
+PREFAULT_CHUNK = 64 << 20
+_libc = ctypes.CDLL(None, use_errno=True)
+
+
+def huge_page_size() -> int:
+    """Size of the default huge pages in bytes."""
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("Hugepagesize:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return 2 << 20
+
+
+class BufferSettings(NamedTuple):
+    """How capture buffers are allocated."""
+
+    prefault: bool = True
+    """Touch every page so the acquisition threads don't page fault"""
+    lock: bool = False
+    """mlock the buffers. Needs a large enough RLIMIT_MEMLOCK"""
+    huge_pages: str = "none"
+    """One of `HUGE_PAGES`"""
+
+
+def load_buffer_settings(section: str) -> BufferSettings:
+    """Load the buffer settings from a platform config section.
+
+    The keys are `prefault-buffers`, `lock-buffers` and `huge-pages`.
+    """
+    configs = load_config_section(section)
+    return BufferSettings(
+        configs.getboolean("prefault-buffers", True),
+        configs.getboolean("lock-buffers", False),
+        configs.get("huge-pages", "none"),
+    )
+
+
+def update_buffer_configs(
+    configs: SectionProxy,
+    prefault_buffers: bool | None,
+    lock_buffers: bool | None,
+    huge_pages: str | None,
+):
+    """Validate and set the buffer options of a platform config command."""
+    if prefault_buffers is not None:
+        configs["prefault-buffers"] = str(prefault_buffers)
+    if lock_buffers is not None:
+        configs["lock-buffers"] = str(lock_buffers)
+    if huge_pages is not None:
+        if huge_pages not in HUGE_PAGES:
+            print_error(f"huge-pages must be one of {', '.join(HUGE_PAGES)}")
+        configs["huge-pages"] = huge_pages
+
+
+class BufferAllocator:
+    """Allocates page aligned capture buffers as set in `settings`.
+
+    Buffers are pre-faulted in parallel, locked and backed by huge pages. The
+    time spent is kept apart from the capture time in `warmup_seconds` until
+    `reset`.
+    """
+
+    def __init__(self, settings: BufferSettings):
+        self.settings = settings
+        self.reset()
+
+    def reset(self):
+        self.warmup_seconds = 0.0
+        self.bytes = 0
+        self.locked = self.settings.lock
+        self.huge_pages = self.settings.huge_pages
+
+    def _map(self, nbytes: int) -> mmap.mmap:
+        flags = mmap.MAP_PRIVATE | mmap.MAP_ANONYMOUS
+        mode = self.settings.huge_pages
+        if mode == "explicit":
+            huge = huge_page_size()
+            try:
+                return mmap.mmap(
+                    -1, -(-nbytes // huge) * huge, flags | MAP_HUGETLB
+                )
+            except OSError:
+                # Not enough pages reserved
+                mode = "transparent"
+        buffer = mmap.mmap(-1, nbytes, flags)
+        if mode == "transparent":
+            try:
+                buffer.madvise(mmap.MADV_HUGEPAGE)
+            except OSError:
+                mode = "none"
+        self.huge_pages = min(self.huge_pages, mode, key=HUGE_PAGES.index)
+        return buffer
+
+    @staticmethod
+    def _prefault(pages: np.ndarray):
+        """:param pages: The first byte of every page"""
+        step = PREFAULT_CHUNK // mmap.PAGESIZE
+        chunks = [
+            pages[start : start + step] for start in range(0, len(pages), step)
+        ]
+        # Pinned like the acquisition threads so the pages land on their node
+        with ThreadPoolExecutor(
+            min(os.cpu_count() or 1, len(chunks)),
+            initializer=pin_cpus,
+            initargs=(get_placement().acquisition_cpus,),
+        ) as pool:
+            list(pool.map(lambda chunk: chunk.fill(0), chunks))
+
+    def empty(self, shape, dtype) -> np.ndarray:
+        """`np.empty` from fresh memory mapped pages."""
+        start = time.perf_counter()
+        nbytes = int(np.prod(shape)) * np.dtype(dtype).itemsize
+        buffer = self._map(max(nbytes, 1))
+        raw = np.frombuffer(buffer, dtype=np.uint8, count=max(nbytes, 1))
+        if self.settings.prefault:
+            self._prefault(raw[:: mmap.PAGESIZE])
+        if self.locked:
+            self.locked = (
+                _libc.mlock(
+                    ctypes.c_void_p(raw.ctypes.data),
+                    ctypes.c_size_t(len(buffer)),
+                )
+                == 0
+            )
+        self.bytes += len(buffer)
+        self.warmup_seconds += time.perf_counter() - start
+        return raw[:nbytes].view(dtype).reshape(shape)
+
+
+def warmup_summary(
+    seconds: float, nbytes: int, locked: bool, huge_pages: str
+) -> str:
+    """Summary of the buffer preparation before a capture."""
+    return (
+        f"Prepared {nbytes / 1e9:.2f} GB of capture buffers in {seconds:.2f} s "
+        f"before the capture (locked: {'yes' if locked else 'no'}, huge pages: "
+        f"{huge_pages})"
+    )
@@ -0,0 +1,72 @@
+"""How much a capture takes, in seconds, samples or bytes."""
+
+import math
+from typing import NamedTuple
+
+COMPLEX64_BYTES = 8
+INT16_IQ_BYTES = 4
+# Absorbs the rounding of seconds * rate so exact durations don't take an
+# extra capture
+_SAMPLE_TOLERANCE = 1e-6
+
+
+class CaptureBudget(NamedTuple):
+    """How much a capture takes.
+
+    The first of `seconds`, `samples` and `bytes` that is set is used. Captures
+    are saved as whole captures of the platform's samples per capture, so the
+    budget is rounded up to whole captures.
+    """
+
+    seconds: float = 0
+    """Seconds of every stream"""
+    samples: int = 0
+    """Samples of every stream"""
+    bytes: int = 0
+    """Bytes of samples split evenly between the streams"""
+    sample_bytes: int = COMPLEX64_BYTES
+    """Bytes of a sample in the storage format the `bytes` are counted in"""
+
+    @classmethod
+    def from_size(cls, size: "float | CaptureBudget") -> "CaptureBudget":
+        """Budget of a capture size in GB as taken by `capture_iq`.
+
+        Budgets are returned as they are.
+        """
+        if isinstance(size, CaptureBudget):
+            return size
+        return cls(bytes=round(size * 1e9))
+
+    def samples_per_stream(self, rate: float, streams: int) -> int:
+        """Samples of every stream the budget asks for at `rate`."""
+        if self.seconds > 0:
+            return math.ceil(self.seconds * rate - _SAMPLE_TOLERANCE)
+        if self.samples > 0:
+            return self.samples
+        return math.ceil(self.bytes / (self.sample_bytes * streams))
+
+    def captures(
+        self, rate: float, streams: int, samples_per_capture: int
+    ) -> int:
+        """The fewest captures per stream that hold the budget.
+
+        The last one may run past the budget.
+        """
+        return -(-self.samples_per_stream(rate, streams) // samples_per_capture)
+
+
+def budget_summary(
+    captures: int,
+    samples_per_capture: int,
+    rate: float,
+    streams: int,
+    sample_bytes: int,
+) -> str:
+    """The capture plan as rounded up to whole captures."""
+    samples = captures * samples_per_capture
+    gb = samples * sample_bytes * streams / 1e9
+    return (
+        f"Capture plan: {captures} x {samples_per_capture} samples per stream "
+        f"at {rate / 1e6:g} MS/s = {samples} samples, {samples / rate:.6g} s, "
+        f"{gb:.3f} GB over {streams} streams"
+    )
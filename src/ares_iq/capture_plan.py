@@ -0,0 +1,82 @@
+"""Lists of captures run one after another with one open device."""
+
+import csv
+from pathlib import Path
+from typing import NamedTuple
+
+from .print_utils import print_error
+
+
+class CapturePlanEntry(NamedTuple):
+    """One capture of a plan."""
+
+    center: float
+    """Center frequency in MHz"""
+    bw: float
+    """Bandwidth in MHz"""
+    size: float
+    """Amount of IQ data to capture in GB"""
+    tag: str | None = None
+    """Tag added to the saved file names"""
+
+
+def _to_entry(row: dict, line: int) -> CapturePlanEntry:
+    try:
+        center, bw, size = (
+            float(row["center"]),
+            float(row["bw"]),
+            float(row["size"]),
+        )
+    except (KeyError, TypeError, ValueError):
+        print_error(
+            f"Capture plan entry {line} must have numeric `center`, `bw` and "
+            f"`size` fields: {row}"
+        )
+    tag = row.get("tag") or None
+    return CapturePlanEntry(center, bw, size, None if tag is None else str(tag))
+
+
+def _load_yaml(plan_file: Path) -> list[dict]:
+    try:
+        import yaml
+    except ImportError:
+        print_error(
+            "YAML capture plans need PyYAML. Install ares-iq\\[yaml] or use a "
+            "CSV plan"
+        )
+    with open(plan_file) as f:
+        plan = yaml.safe_load(f)
+    if isinstance(plan, dict):
+        plan = plan.get("captures")
+    if not isinstance(plan, list):
+        print_error(
+            "A YAML capture plan must be a list of captures or have a "
+            "`captures` list"
+        )
+    return plan
+
+
+def _load_csv(plan_file: Path) -> list[dict]:
+    with open(plan_file, newline="") as f:
+        return [
+            {
+                key.strip(): value.strip()
+                for key, value in row.items()
+                if key is not None
+            }
+            for row in csv.DictReader(f)
+        ]
+
+
+def load_capture_plan(plan_file: Path) -> list[CapturePlanEntry]:
+    """Load a capture plan.
+
+    CSV plans have a `center,bw,size[,tag]` header. YAML plans are a list of
+    mappings with the same keys, optionally under a `captures` key. Frequencies
+    are in MHz and sizes in GB like the `capture` command.
+    """
+    if plan_file.suffix.lower() in (".yaml", ".yml"):
+        rows = _load_yaml(plan_file)
+    else:
+        rows = _load_csv(plan_file)
+    return [_to_entry(row, line) for line, row in enumerate(rows, start=1)]
@@ -0,0 +1,112 @@
+"""Daemon that keeps the platform open and runs capture jobs."""
+
+import json
+import socket
+import socketserver
+import time
+from pathlib import Path
+
+from typer import Exit
+
+from .configurations import CONFIG_DIR
+from .save_iq_data import save_streams
+from .typing import SoftwareDefinedRadio
+
+SOCKET_FILE = CONFIG_DIR / "capture.sock"
+
+
+class _CaptureJobHandler(socketserver.StreamRequestHandler):
+    server: "CaptureServer"
+
+    def handle(self):
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            try:
+                result = self.server.run_job(json.loads(line))
+            # The platform already printed the error on the daemon's console
+            except Exit:
+                result = {
+                    "status": "error",
+                    "error": "Capture failed, see the daemon output",
+                }
+            # Keep the daemon alive, the client gets the error
+            except Exception as e:
+                result = {
+                    "status": "error",
+                    "error": str(e) or type(e).__name__,
+                }
+            self.wfile.write((json.dumps(result) + "\n").encode())
+
+
+class CaptureServer(socketserver.UnixStreamServer):
+    """Runs capture jobs on an already opened platform.
+
+    Jobs are handled one at a time since they share the device.
+    """
+
+    def __init__(
+        self,
+        platform: SoftwareDefinedRadio,
+        socket_file: Path,
+        extra_verbose: bool = False,
+    ):
+        self._platform = platform
+        self._extra_verbose = extra_verbose
+        self._socket_file = Path(socket_file)
+        self._socket_file.unlink(missing_ok=True)
+        super().__init__(str(self._socket_file), _CaptureJobHandler)
+
+    def server_close(self):
+        super().server_close()
+        self._socket_file.unlink(missing_ok=True)
+
+    @staticmethod
+    def _job_value(job: dict, key: str) -> float:
+        if key not in job:
+            raise ValueError(f"Job is missing '{key}'")
+        try:
+            value = float(job[key])
+        except (TypeError, ValueError):
+            raise ValueError(f"Job '{key}' must be a number") from None
+        if value <= 0:
+            raise ValueError(f"Job '{key}' must be positive")
+        return value
+
+    def run_job(self, job: dict) -> dict:
+        """Capture and save the job.
+
+        Raises ValueError if the job is invalid.
+        """
+        if not isinstance(job, dict):
+            raise ValueError("Job must be a JSON object")
+        center, bw, size = (
+            self._job_value(job, key) for key in ("center", "bw", "size")
+        )
+        tag = job.get("tag")
+        if tag is not None and not isinstance(tag, str):
+            raise ValueError("Job 'tag' must be a string")
+        start = time.perf_counter()
+        self._platform.capture_iq(
+            center * 1e6, bw * 1e6, size, False, self._extra_verbose
+        )
+        captured = time.perf_counter()
+        paths = save_streams(self._platform, tag)
+        saved = time.perf_counter()
+        return {
+            "status": "ok",
+            "files": [str(path) for path in paths],
+            "capture_s": captured - start,
+            "save_s": saved - captured,
+        }
+
+
+def submit_job(socket_file: Path, job: dict) -> dict:
+    """Send a job to a `CaptureServer` and wait for its reply."""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(str(socket_file))
+        with sock.makefile("rwb") as f:
+            f.write((json.dumps(job) + "\n").encode())
+            f.flush()
+            sock.shutdown(socket.SHUT_WR)
+            return json.loads(f.readline())
@@ -0,0 +1,314 @@
+"""Per capture statistics computed during a capture."""
+
+import queue
+import threading
+from pathlib import Path
+
+import h5py
+import numpy as np
+import numpy.typing as npt
+
+from .affinity import placed_thread
+from .iq_data import IQData
+
+STATS_GROUP = "capture_stats"
+OCCUPANCY_BINS = 32
+# Samples of each capture the occupancy is estimated from, in FFTs of
+# OCCUPANCY_NFFT samples
+OCCUPANCY_SAMPLES = 65536
+OCCUPANCY_NFFT = 256
+# Samples within this fraction of full scale count as clipped
+CLIP_FRACTION = 0.9999
+# Captures computed at once
+STATS_BATCH = 16
+COLUMNS = {
+    "power_mean_db": np.float32,
+    "power_peak_db": np.float32,
+    "dc": np.complex64,
+    "dc_ratio_db": np.float32,
+    "gain_imbalance_db": np.float32,
+    "phase_imbalance_deg": np.float32,
+    "clipped": np.int32,
+    "occupancy_db": np.float16,
+}
+"""Per capture statistics, one row per capture:
+- power_mean_db, power_peak_db: Mean and peak sample power (dBFS for the USRP,
+dBm for the BB60)
+- dc: Mean of the samples
+- dc_ratio_db: Power of the DC offset relative to the mean power, near 0 for DC
+dominated captures
+- gain_imbalance_db, phase_imbalance_deg: I/Q amplitude and quadrature error
+estimated from the I and Q statistics
+- clipped: Samples with I or Q at full scale
+- occupancy_db: Power spectral density of OCCUPANCY_BINS subbands across the
+capture bandwidth, DC centered, scaled so white noise reads its mean power.
+(captures, bins)
+Rows of captures that have no statistics are NaN, with -1 clipped samples.
+"""
+_TINY = np.finfo(np.float32).tiny
+
+
+def _db(power: npt.NDArray) -> npt.NDArray[np.float32]:
+    return (10 * np.log10(power + _TINY)).astype(np.float32)
+
+
+def compute_stats(
+    iq: npt.NDArray[np.complex64], full_scale: float = 1.0
+) -> dict[str, npt.NDArray]:
+    """Statistics of each capture of `iq` (captures, samples).
+
+    The statistics are vectorized over the captures.
+    """
+    power = iq.real**2 + iq.imag**2
+    mean_power = power.mean(axis=1)
+    dc = iq.mean(axis=1)
+    i = iq.real - dc.real[:, None]
+    q = iq.imag - dc.imag[:, None]
+    i_power, q_power = (i**2).mean(axis=1), (q**2).mean(axis=1)
+    correlation = (i * q).mean(axis=1) / np.sqrt(i_power * q_power + _TINY)
+    limit = np.float32(full_scale * CLIP_FRACTION)
+    clipped = np.count_nonzero(
+        (np.abs(iq.real) >= limit) | (np.abs(iq.imag) >= limit), axis=1
+    )
+
+    nfft = (
+        min(OCCUPANCY_NFFT, iq.shape[1]) // OCCUPANCY_BINS * OCCUPANCY_BINS
+        or OCCUPANCY_BINS
+    )
+    segments = max(1, min(OCCUPANCY_SAMPLES, iq.shape[1]) // nfft)
+    head = iq[:, : segments * nfft]
+    if head.shape[1] < nfft:
+        head = np.pad(head, ((0, 0), (0, nfft - head.shape[1])))
+    spectra = np.fft.fft(head.reshape(len(iq), segments, nfft), axis=-1)
+    psd = (
+        np.fft.fftshift(
+            (spectra.real**2 + spectra.imag**2).mean(axis=1), axes=-1
+        )
+        / nfft
+    )
+    occupancy = psd.reshape(len(iq), OCCUPANCY_BINS, -1).mean(axis=-1)
+
+    return {
+        "power_mean_db": _db(mean_power),
+        "power_peak_db": _db(power.max(axis=1)),
+        "dc": dc.astype(np.complex64),
+        "dc_ratio_db": _db(np.abs(dc) ** 2 / (mean_power + _TINY)),
+        "gain_imbalance_db": _db(i_power / (q_power + _TINY)),
+        "phase_imbalance_deg": np.degrees(
+            np.arcsin(np.clip(correlation, -1, 1))
+        ).astype(np.float32),
+        "clipped": clipped.astype(np.int32),
+        "occupancy_db": _db(occupancy).astype(np.float16),
+    }
+
+
+def empty_stats(captures: int) -> dict[str, npt.NDArray]:
+    """Rows of `captures` captures without statistics."""
+    columns = {}
+    for name, dtype in COLUMNS.items():
+        shape = (
+            (captures, OCCUPANCY_BINS)
+            if name == "occupancy_db"
+            else (captures,)
+        )
+        columns[name] = np.full(
+            shape, -1 if name == "clipped" else np.nan, dtype=dtype
+        )
+    return columns
+
+
+class CaptureStats:
+    """Capture listener that computes the statistics in `COLUMNS`.
+
+    Statistics are computed on a worker thread, a batch of captures at a time,
+    so files can be triaged later without reading the samples. Captures are
+    copied to a queue of `max_queued` captures. Captures that don't fit are
+    dropped and counted, and get NaN rows.
+    """
+
+    def __init__(self, full_scale: float = 1.0, max_queued: int = 64):
+        self._full_scale = full_scale
+        self._queue: queue.Queue = queue.Queue(maxsize=max_queued)
+        self._lock = threading.Lock()
+        self._timestamps: dict[str, list[npt.NDArray[np.int64]]] = {}
+        self._columns: dict[str, list[dict[str, npt.NDArray]]] = {}
+        self._dropped: dict[str, int] = {}
+        self._thread: threading.Thread | None = None
+
+    def __enter__(self):
+        """Start the worker thread."""
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        """Compute what is queued and stop the worker thread."""
+        self.stop()
+
+    def start(self):
+        self._thread = threading.Thread(
+            target=self._run, name="capture-stats", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+    def __call__(self, stream: str, iq: IQData):
+        try:
+            # Copied since the capture buffer is recycled
+            self._queue.put_nowait(
+                (stream, iq.iq.copy(), iq.ts_sec * 1_000_000_000 + iq.ts_nsec)
+            )
+        except queue.Full:
+            with self._lock:
+                self._dropped[stream] = self._dropped.get(stream, 0) + 1
+
+    def _compute(self, batch: list[tuple[str, npt.NDArray[np.complex64], int]]):
+        groups: dict[
+            tuple[str, int], list[tuple[npt.NDArray[np.complex64], int]]
+        ] = {}
+        for stream, iq, ts in batch:
+            groups.setdefault((stream, len(iq)), []).append((iq, ts))
+        for (stream, _), captures in groups.items():
+            columns = compute_stats(
+                np.stack([iq for iq, _ in captures]), self._full_scale
+            )
+            with self._lock:
+                self._timestamps.setdefault(stream, []).append(
+                    np.array([ts for _, ts in captures], dtype=np.int64)
+                )
+                self._columns.setdefault(stream, []).append(columns)
+
+    def _run(self):
+        with placed_thread("worker"):
+            done = False
+            while not done:
+                batch = []
+                item = self._queue.get()
+                # Whatever queued up meanwhile is computed together
+                while item is not None:
+                    batch.append(item)
+                    if len(batch) == STATS_BATCH:
+                        break
+                    try:
+                        item = self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                done = item is None
+                if batch:
+                    self._compute(batch)
+                for _ in range(len(batch) + done):
+                    self._queue.task_done()
+
+    def wait(self):
+        """Block until the captures queued so far are computed.
+
+        Call it before saving captures with their statistics.
+        """
+        self._queue.join()
+
+    def stats(
+        self, stream: str
+    ) -> tuple[npt.NDArray[np.int64], dict[str, npt.NDArray]]:
+        """Timestamps in ns and statistics of `stream` computed so far.
+
+        Captures are in timestamp order.
+        """
+        with self._lock:
+            ts_chunks, chunks = (
+                list(self._timestamps.get(stream, [])),
+                list(self._columns.get(stream, [])),
+            )
+        if not chunks:
+            return np.empty(0, dtype=np.int64), empty_stats(0)
+        timestamps = np.concatenate(ts_chunks)
+        order = np.argsort(timestamps, kind="stable")
+        return timestamps[order], {
+            name: np.concatenate([chunk[name] for chunk in chunks])[order]
+            for name in COLUMNS
+        }
+
+    def for_timestamps(
+        self, stream: str, timestamps: npt.NDArray[np.int64]
+    ) -> dict[str, npt.NDArray]:
+        """Statistics of the captures of `stream` with `timestamps`.
+
+        Rows are in the order of `timestamps`. Unknown captures get NaN rows.
+        """
+        timestamps = np.asarray(timestamps, dtype=np.int64).reshape(-1)
+        known, columns = self.stats(stream)
+        rows = empty_stats(len(timestamps))
+        index = np.clip(
+            np.searchsorted(known, timestamps), 0, max(0, len(known) - 1)
+        )
+        found = (
+            (index < len(known)) & (known[index] == timestamps)
+            if len(known)
+            else np.zeros(len(timestamps), bool)
+        )
+        for name in COLUMNS:
+            rows[name][found] = columns[name][index[found]]
+        return rows
+
+    @property
+    def dropped(self) -> dict[str, int]:
+        with self._lock:
+            return dict(self._dropped)
+
+
+def write_stats(f: h5py.File, columns: dict[str, npt.NDArray]):
+    """Write statistics to the `capture_stats` group of an open capture file.
+
+    Earlier statistics are replaced.
+    """
+    if STATS_GROUP in f:
+        del f[STATS_GROUP]
+    group = f.create_group(STATS_GROUP)
+    for name, column in columns.items():
+        group.create_dataset(name, data=column)
+
+
+def write_stats_sidecar(path: Path, columns: dict[str, npt.NDArray]) -> Path:
+    """Write statistics to `<name>.stats.npz` next to a capture file.
+
+    Used for files that can't be rewritten.
+    """
+    stats_path = Path(path).with_suffix(".stats.npz")
+    np.savez(stats_path, **columns)
+    return stats_path
+
+
+def add_stats(path: Path, stats: CaptureStats, stream: str):
+    """Write the statistics of the captures in a capture file.
+
+    Captures are matched by timestamp.
+    """
+    with h5py.File(path, "r+") as f:
+        write_stats(f, stats.for_timestamps(stream, f["iq_ts"][:]))
+
+
+def load_stats(
+    path: Path, start: int = 0, stop: int | None = None
+) -> dict[str, npt.NDArray]:
+    """Read the statistics of captures `start` to `stop` of a saved file.
+
+    The samples aren't read. Files without a `capture_stats` group (`.cf32`
+    files and recording segments) have them in a `.stats.npz` sidecar. Empty if
+    the capture had no statistics.
+    """
+    path = Path(path)
+    if path.suffix != ".cf32":
+        with h5py.File(path, "r") as f:
+            if STATS_GROUP in f:
+                return {
+                    name: dataset[start:stop]
+                    for name, dataset in f[STATS_GROUP].items()
+                }
+    stats_path = path.with_suffix(".stats.npz")
+    if not stats_path.exists():
+        return {}
+    with np.load(stats_path) as columns:
+        return {name: columns[name][start:stop] for name in columns.files}
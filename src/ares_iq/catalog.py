@@ -0,0 +1,482 @@
+"""Catalog of capture files in SQLite, searchable by time and frequency."""
+
+import datetime as dt
+import json
+import multiprocessing
+import os
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Iterable
+
+import h5py
+import numpy as np
+from rich.progress import Progress
+from rich.table import Table
+
+from .affinity import get_placement, pin_cpus
+from .capture_stats import load_stats
+from .configurations import CONFIG_DIR, load_config_section
+from .print_utils import print_warning
+
+CATALOG_FILE = CONFIG_DIR / "catalog.sqlite"
+PATTERNS = ("*.h5", "*.cf32")
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    id INTEGER PRIMARY KEY,
+    path TEXT UNIQUE NOT NULL,
+    kind TEXT NOT NULL,
+    platform TEXT,
+    center REAL,
+    bandwidth REAL,
+    rate REAL,
+    gain REAL,
+    low_hz REAL,
+    high_hz REAL,
+    start_ns INTEGER,
+    end_ns INTEGER,
+    captures INTEGER NOT NULL,
+    samples_per_capture INTEGER NOT NULL,
+    samples INTEGER NOT NULL,
+    compressed INTEGER NOT NULL,
+    recording TEXT,
+    segment INTEGER,
+    first_sample INTEGER,
+    power_max_db REAL,
+    clipped_captures INTEGER,
+    metadata TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS files_time ON files (start_ns, end_ns);
+CREATE INDEX IF NOT EXISTS files_frequency ON files (low_hz, high_hz);
+CREATE TABLE IF NOT EXISTS captures (
+    file_id INTEGER NOT NULL REFERENCES files (id) ON DELETE CASCADE,
+    capture INTEGER NOT NULL,
+    ts_ns INTEGER NOT NULL,
+    power_mean_db REAL,
+    power_peak_db REAL,
+    dc_ratio_db REAL,
+    gain_imbalance_db REAL,
+    phase_imbalance_deg REAL,
+    clipped INTEGER,
+    occupancy_db BLOB,
+    PRIMARY KEY (file_id, capture)
+);
+CREATE INDEX IF NOT EXISTS captures_time ON captures (ts_ns);
+CREATE INDEX IF NOT EXISTS captures_power ON captures (file_id, power_mean_db);
+"""
+_STATS = (
+    "power_mean_db",
+    "power_peak_db",
+    "dc_ratio_db",
+    "gain_imbalance_db",
+    "phase_imbalance_deg",
+    "clipped",
+)
+
+
+def catalog_path() -> Path:
+    """Catalog file from the configuration, or the default one."""
+    return Path(load_config_section("catalog").get("path", CATALOG_FILE))
+
+
+def _float(value) -> float | None:
+    return (
+        None if value is None or not np.isfinite(float(value)) else float(value)
+    )
+
+
+def _platform(attrs: dict) -> str | None:
+    if "platform" in attrs:
+        return str(attrs["platform"])
+    # Files saved before the platform was recorded
+    if "ref_level" in attrs:
+        return "bb60"
+    if "type=x300" in str(attrs.get("dev_args", "")):
+        return "x310"
+    return None
+
+
+def _kind(path: Path, attrs: dict, compressed: bool) -> str:
+    if "segment" in attrs:
+        return "segment"
+    if "resample_up" in attrs:
+        return "resampled"
+    if "subband" in attrs:
+        return "subband"
+    if path.suffix == ".cf32":
+        return "direct"
+    if path.name.startswith("event-"):
+        return "event"
+    return "compressed" if compressed else "capture"
+
+
+def read_file_record(path: Path) -> tuple[dict, list[tuple]] | None:
+    """Catalog row of a capture file and the rows of its captures.
+
+    Only the metadata, timestamps and statistics are read. None if the file
+    isn't an ares-iq capture.
+    """
+    path = Path(path).absolute()
+    try:
+        if path.suffix == ".cf32":
+            with open(path.with_suffix(".json")) as f:
+                sidecar = json.load(f)
+            attrs = sidecar.get("metadata", {})
+            ts = np.asarray(sidecar["timestamps"], dtype=np.int64)
+            samples_per_capture, compressed = (
+                int(sidecar["samples_per_capture"]),
+                False,
+            )
+        else:
+            with h5py.File(path, "r") as f:
+                if "iq_ts" not in f or (
+                    "iq_data" not in f and "iq_blocks" not in f
+                ):
+                    return None
+                attrs = {
+                    key: value.item()
+                    if isinstance(value, np.generic)
+                    else value
+                    for key, value in f.attrs.items()
+                }
+                ts = f["iq_ts"][:].reshape(-1).astype(np.int64)
+                compressed = "iq_blocks" in f
+                samples_per_capture = (
+                    int(attrs["samples_per_capture"])
+                    if compressed
+                    else f["iq_data"].shape[1]
+                )
+        stats = load_stats(path)
+        stat = path.stat()
+    except (OSError, KeyError, ValueError):
+        return None
+
+    center, rate = _float(attrs.get("center")), _float(attrs.get("rate"))
+    bandwidth = _float(attrs.get("bandwidth")) or rate
+    duration_ns = round(samples_per_capture / rate * 1e9) if rate else 0
+    has_stats = bool(stats) and len(stats.get("power_mean_db", [])) == len(ts)
+    record = {
+        "path": str(path),
+        "kind": _kind(path, attrs, compressed),
+        "platform": _platform(attrs),
+        "center": center,
+        "bandwidth": bandwidth,
+        "rate": rate,
+        "gain": _float(attrs.get("gain")),
+        "low_hz": center - bandwidth / 2
+        if center is not None and bandwidth
+        else center,
+        "high_hz": center + bandwidth / 2
+        if center is not None and bandwidth
+        else center,
+        "start_ns": int(ts.min()) if len(ts) else None,
+        "end_ns": int(ts.max()) + duration_ns if len(ts) else None,
+        "captures": len(ts),
+        "samples_per_capture": samples_per_capture,
+        "samples": len(ts) * samples_per_capture,
+        "compressed": int(compressed),
+        "recording": str(path.parent) if "segment" in attrs else None,
+        "segment": attrs.get("segment"),
+        "first_sample": attrs.get("first_sample"),
+        "power_max_db": _float(np.nanmax(stats["power_mean_db"]))
+        if has_stats
+        and len(ts)
+        and not np.all(np.isnan(stats["power_mean_db"]))
+        else None,
+        "clipped_captures": int(np.count_nonzero(stats["clipped"] > 0))
+        if has_stats
+        else None,
+        "metadata": json.dumps(attrs, default=str),
+        "size": stat.st_size,
+        "mtime": stat.st_mtime,
+    }
+    # Captures are only cataloged with statistics, the file row covers their
+    # time range
+    captures = []
+    if has_stats:
+        columns = [
+            [_float(value) for value in stats[name]] for name in _STATS[:-1]
+        ]
+        for i, timestamp in enumerate(ts):
+            occupancy = (
+                stats["occupancy_db"][i].astype(np.float16).tobytes()
+                if "occupancy_db" in stats
+                else None
+            )
+            captures.append(
+                (
+                    i,
+                    int(timestamp),
+                    *[column[i] for column in columns],
+                    int(stats["clipped"][i]),
+                    occupancy,
+                )
+            )
+    return record, captures
+
+
+class Catalog:
+    """SQLite catalog of capture files.
+
+    A row per file and per capture, indexed on time and frequency.
+    """
+
+    def __init__(self, path: Path | None = None):
+        self.path = path or catalog_path()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # Saves from several processes can register at once
+        self._db = sqlite3.connect(self.path, timeout=30)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA foreign_keys=ON")
+        self._db.executescript(SCHEMA)
+
+    def __enter__(self):
+        """Use the catalog until the block exits."""
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        """Close the catalog."""
+        self.close()
+
+    def close(self):
+        self._db.close()
+
+    def add(self, record: dict, captures: list[tuple]):
+        """Add or replace a file and its captures."""
+        with self._db:
+            self._db.execute(
+                "DELETE FROM files WHERE path = ?", (record["path"],)
+            )
+            columns = ", ".join(record)
+            values = ", ".join("?" * len(record))
+            cursor = self._db.execute(
+                f"INSERT INTO files ({columns}) VALUES ({values})",
+                list(record.values()),
+            )
+            self._db.executemany(
+                f"INSERT INTO captures VALUES ({cursor.lastrowid}, "
+                "?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                captures,
+            )
+
+    def indexed(self) -> dict[str, tuple[int, float]]:
+        """Size and mtime of every cataloged file."""
+        return {
+            row["path"]: (row["size"], row["mtime"])
+            for row in self._db.execute("SELECT path, size, mtime FROM files")
+        }
+
+    def remove(self, paths: Iterable[str]):
+        with self._db:
+            self._db.executemany(
+                "DELETE FROM files WHERE path = ?", [(path,) for path in paths]
+            )
+
+    def query(
+        self,
+        start_ns: int | None = None,
+        end_ns: int | None = None,
+        frequency: float | None = None,
+        platform: str | None = None,
+        kind: str | None = None,
+        min_power_db: float | None = None,
+        clipped: bool | None = None,
+        limit: int | None = None,
+    ) -> list[sqlite3.Row]:
+        """Files overlapping the time range that cover `frequency` in Hz.
+
+        With `min_power_db`, only files with captures in the time range whose
+        mean power reaches it, counted in `active`. `clipped` keeps the files
+        with, or without, clipped captures.
+        """
+        where: list[str] = []
+        params: dict[str, float | str | None] = {
+            "start": start_ns,
+            "end": end_ns,
+            "min_power": min_power_db,
+        }
+        if start_ns is not None:
+            where.append("f.end_ns >= :start")
+        if end_ns is not None:
+            where.append("f.start_ns <= :end")
+        if frequency is not None:
+            where.append("f.low_hz <= :frequency AND f.high_hz >= :frequency")
+            params["frequency"] = frequency
+        if platform is not None:
+            where.append("f.platform = :platform")
+            params["platform"] = platform
+        if kind is not None:
+            where.append("f.kind = :kind")
+            params["kind"] = kind
+        if clipped is not None:
+            where.append(
+                "f.clipped_captures > 0"
+                if clipped
+                else "f.clipped_captures = 0"
+            )
+        active = "NULL"
+        if min_power_db is not None:
+            active = (
+                "(SELECT COUNT(*) FROM captures c WHERE c.file_id = f.id "
+                "AND c.power_mean_db >= :min_power"
+                + (" AND c.ts_ns >= :start" if start_ns is not None else "")
+                + (" AND c.ts_ns <= :end" if end_ns is not None else "")
+                + ")"
+            )
+        sql = f"SELECT f.*, {active} AS active FROM files f"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        if min_power_db is not None:
+            sql = f"SELECT * FROM ({sql}) WHERE active > 0"
+        sql += " ORDER BY start_ns"
+        if limit:
+            sql += f" LIMIT {int(limit)}"
+        return self._db.execute(sql, params).fetchall()
+
+    def captures(self, path: str) -> list[sqlite3.Row]:
+        return self._db.execute(
+            "SELECT c.* FROM captures c JOIN files f ON f.id = c.file_id "
+            "WHERE f.path = ? ORDER BY c.capture",
+            (path,),
+        ).fetchall()
+
+
+def register_files(paths: Iterable[Path]):
+    """Catalog newly written files.
+
+    Cataloging never fails a save, problems are reported as warnings.
+    """
+    paths = list(paths)
+    if not paths or load_config_section("catalog").get(
+        "register", "yes"
+    ).lower() in ("no", "false", "0"):
+        return
+    try:
+        with Catalog() as catalog:
+            for path in paths:
+                entry = read_file_record(path)
+                if entry is not None:
+                    catalog.add(*entry)
+    except (sqlite3.Error, OSError) as e:
+        print_warning(f"Could not catalog {len(paths)} files: {e}")
+
+
+def scan(directories: list[Path]) -> list[Path]:
+    """Capture files under `directories`."""
+    return sorted(
+        {
+            path.absolute()
+            for directory in directories
+            for pattern in PATTERNS
+            for path in Path(directory).rglob(pattern)
+        }
+    )
+
+
+def rebuild(
+    directories: list[Path],
+    full: bool = False,
+    jobs: int | None = None,
+    hide: bool = False,
+    catalog_file: Path | None = None,
+) -> tuple[int, int, int]:
+    """Catalog the capture files under `directories`.
+
+    Files are read on a pool of `jobs` processes. Files that didn't change
+    since they were cataloged are skipped unless `full`, and files that are
+    gone are removed. Returns the files cataloged, skipped and removed.
+    """
+    paths = scan(directories)
+    with Catalog(catalog_file) as catalog:
+        indexed = catalog.indexed()
+        roots = [
+            str(Path(directory).absolute()) + os.sep
+            for directory in directories
+        ]
+        gone = [
+            path
+            for path in indexed
+            if path.startswith(tuple(roots)) and not os.path.exists(path)
+        ]
+        catalog.remove(gone)
+        todo = []
+        for path in paths:
+            stat = path.stat()
+            if full or indexed.get(str(path)) != (stat.st_size, stat.st_mtime):
+                todo.append(path)
+        added = 0
+        # Spawned rather than forked since HDF5 isn't fork safe
+        with (
+            ProcessPoolExecutor(
+                jobs,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=pin_cpus,
+                initargs=(get_placement().worker_cpus,),
+            ) as pool,
+            Progress(transient=hide, disable=hide) as progress,
+        ):
+            bar = progress.add_task("catalog", total=len(todo))
+            for entry in pool.map(read_file_record, todo, chunksize=16):
+                if entry is not None:
+                    catalog.add(*entry)
+                    added += 1
+                progress.advance(bar)
+    return added, len(paths) - len(todo), len(gone)
+
+
+def _time(ns: int | None) -> str:
+    return (
+        "-"
+        if ns is None
+        else dt.datetime.fromtimestamp(ns / 1e9).strftime("%y-%m-%d %H:%M:%S")
+    )
+
+
+def files_table(rows: list[sqlite3.Row], active: bool) -> Table:
+    """Table of cataloged files, with the `active` captures column if set."""
+    table = Table(
+        title=f"{len(rows)} files",
+        caption="max dB is the highest mean power of a capture, clipped and "
+        "active count captures",
+    )
+    table.add_column("file", overflow="fold")
+    for column in [
+        "MHz",
+        "bw",
+        "start",
+        "s",
+        "captures",
+        "max dB",
+        "clipped",
+    ] + (["active"] if active else []):
+        table.add_column(
+            column, justify="left" if column == "start" else "right"
+        )
+    for row in rows:
+        name = Path(row["path"]).name
+        seconds = (
+            (row["end_ns"] - row["start_ns"]) / 1e9
+            if row["start_ns"] is not None
+            else None
+        )
+        table.add_row(
+            name
+            if row["recording"] is None
+            else f"{Path(row['recording']).name}/{name}",
+            "-" if row["center"] is None else f"{row['center'] / 1e6:g}",
+            "-" if row["bandwidth"] is None else f"{row['bandwidth'] / 1e6:g}",
+            _time(row["start_ns"]),
+            "-" if seconds is None else f"{seconds:.3g}",
+            str(row["captures"]),
+            "-"
+            if row["power_max_db"] is None
+            else f"{row['power_max_db']:.1f}",
+            "-"
+            if row["clipped_captures"] is None
+            else str(row["clipped_captures"]),
+            *([str(row["active"])] if active else []),
+        )
+    return table
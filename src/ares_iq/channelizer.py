@@ -0,0 +1,230 @@
+"""Polyphase channelizer splitting streams into subbands during a capture."""
+
+import queue
+import threading
+from pathlib import Path
+
+import h5py
+import numpy as np
+import numpy.typing as npt
+
+from .affinity import placed_thread
+from .catalog import register_files
+from .iq_data import IQData
+from .save_iq_data import _new_file_path
+
+
+class PolyphaseFilterBank:
+    """Critically sampled analysis filter bank.
+
+    A stream is split into `channels` subbands, each decimated by `channels`.
+    Subband `c` is centered `c * rate / channels` from the stream center, so
+    `c` runs from `-(channels // 2)` to `(channels - 1) // 2`. The prototype
+    lowpass has `taps` taps per branch and the last `taps - 1` input blocks
+    carry over between calls, so a stream can be processed in pieces.
+    """
+
+    def __init__(self, channels: int, selected: list[int], taps: int = 8):
+        self.channels = channels
+        self.taps = taps
+        self._selected = [c % channels for c in selected]
+        n = np.arange(channels * taps)
+        center = (len(n) - 1) / 2
+        h = np.sinc((n - center) / channels) * np.kaiser(len(n), 8.0) / channels
+        # _branches[t, p] = h[t * channels + p]
+        self._branches = h.reshape(taps, channels).astype(np.float32)
+        self._history = np.zeros((taps - 1, channels), dtype=np.complex64)
+        self.delay = channels - 1 - center
+        """Offset in input samples between an output and the input sample it is
+        centered on
+        """
+
+    def process(
+        self, x: npt.NDArray[np.complex64]
+    ) -> npt.NDArray[np.complex64]:
+        """Filter a piece of the stream.
+
+        :param x: Input samples. The length must be a multiple of the number of
+        channels.
+        :return: The selected subbands with shape (selected, len(x) / channels).
+        """
+        if len(x) % self.channels:
+            raise ValueError(
+                f"{len(x)} samples per capture is not a multiple of "
+                f"{self.channels} channels"
+            )
+        # Each block reversed so branch p sees x[m * channels + channels - 1 -
+        # p]
+        blocks = np.concatenate(
+            (self._history, x.reshape(-1, self.channels)[:, ::-1])
+        )
+        self._history = blocks[len(blocks) - (self.taps - 1) :]
+        outputs = len(blocks) - (self.taps - 1)
+        branch_sums = np.zeros((outputs, self.channels), dtype=np.complex64)
+        for t in range(self.taps):
+            branch_sums += (
+                blocks[self.taps - 1 - t : self.taps - 1 - t + outputs]
+                * self._branches[t]
+            )
+        subbands = np.fft.ifft(branch_sums, axis=1) * self.channels
+        return subbands[:, self._selected].T.astype(np.complex64)
+
+
+class Channelizer:
+    """Capture listener that splits each stream into subbands.
+
+    Each stream is split into `channels` subbands during the capture and the
+    `selected` subbands (see `PolyphaseFilterBank`) are written to their own
+    files at the reduced rate. Each stream is filtered on its own worker
+    thread. Captures arriving while more than `max_queued` are waiting
+    are dropped and counted. The files hold one row per capture and get the
+    stream metadata, adjusted to the subband, when `finalize` is called.
+    """
+
+    def __init__(
+        self,
+        channels: int,
+        selected: list[int],
+        taps: int = 8,
+        tag: str | None = None,
+        max_queued: int = 64,
+    ):
+        self._channels = channels
+        self._selected = selected
+        self._taps = taps
+        self._tag = tag
+        self._max_queued = max_queued
+        self._queues: dict[str, queue.Queue] = {}
+        self._workers: list[threading.Thread] = []
+        self._files: dict[str, list[Path]] = {}
+        self._delay = 0.0
+        self._dropped: dict[str, int] = {}
+        self._errors: dict[str, Exception] = {}
+
+    def __enter__(self):
+        """Filter captures until the block exits."""
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        """Stop the workers."""
+        self.stop()
+
+    def stop(self):
+        for stream_queue in self._queues.values():
+            stream_queue.put(None)
+        for worker in self._workers:
+            worker.join()
+        self._queues = {}
+        self._workers = []
+
+    def __call__(self, stream: str, iq: IQData):
+        if stream not in self._queues:
+            self._queues[stream] = queue.Queue(maxsize=self._max_queued)
+            worker = threading.Thread(
+                target=self._run,
+                args=(stream, self._queues[stream]),
+                name=f"channelizer-{stream}",
+                daemon=True,
+            )
+            self._workers.append(worker)
+            worker.start()
+        try:
+            # Copied since the capture buffer is recycled
+            self._queues[stream].put_nowait(
+                (iq.iq.copy(), iq.ts_sec * 1_000_000_000 + iq.ts_nsec)
+            )
+        except queue.Full:
+            self._dropped[stream] = self._dropped.get(stream, 0) + 1
+
+    def _open_files(self, stream: str, row_samples: int) -> list[h5py.File]:
+        files = []
+        for channel in self._selected:
+            tags = [
+                t for t in (self._tag, stream, f"sub{channel}") if t is not None
+            ]
+            path = _new_file_path("-".join(tags), prefix="channel")
+            f = h5py.File(path, "w")
+            f.create_dataset(
+                "iq_data",
+                shape=(0, row_samples),
+                maxshape=(None, row_samples),
+                chunks=(1, row_samples),
+                dtype=np.complex64,
+            )
+            f.create_dataset(
+                "iq_ts", shape=(0, 1), maxshape=(None, 1), dtype=np.int64
+            )
+            files.append(f)
+            self._files.setdefault(stream, []).append(path)
+        return files
+
+    def _run(self, stream: str, stream_queue: queue.Queue):
+        with placed_thread("worker"):
+            bank = PolyphaseFilterBank(
+                self._channels, self._selected, self._taps
+            )
+            self._delay = bank.delay
+            files: list[h5py.File] = []
+            try:
+                while (item := stream_queue.get()) is not None:
+                    if stream in self._errors:
+                        continue
+                    iq, ts = item
+                    try:
+                        subbands = bank.process(iq)
+                    except ValueError as e:
+                        self._errors[stream] = e
+                        continue
+                    if not files:
+                        files = self._open_files(stream, subbands.shape[1])
+                    for f, subband in zip(files, subbands):
+                        f["iq_data"].resize(len(f["iq_data"]) + 1, axis=0)
+                        f["iq_data"][-1] = subband
+                        f["iq_ts"].resize(len(f["iq_ts"]) + 1, axis=0)
+                        f["iq_ts"][-1] = ts
+            finally:
+                for f in files:
+                    f.close()
+
+    def finalize(self, metadata: dict[str, dict]) -> list[Path]:
+        """Tag the files with the metadata of their stream and catalog them.
+
+        The timestamps are shifted by the filter delay. Call after the capture
+        and `stop`.
+        :return: The written files.
+        """
+        paths = []
+        for stream, stream_paths in self._files.items():
+            stream_metadata = metadata.get(stream, {})
+            rate = float(stream_metadata.get("rate", 0))
+            for channel, path in zip(self._selected, stream_paths):
+                attrs = dict(stream_metadata) | {
+                    "channelizer_channels": self._channels,
+                    "subband": channel,
+                }
+                if rate:
+                    attrs["rate"] = rate / self._channels
+                    attrs["center"] = (
+                        float(stream_metadata.get("center", 0))
+                        + channel * rate / self._channels
+                    )
+                    attrs["bandwidth"] = attrs["rate"]
+                with h5py.File(path, "r+") as f:
+                    f.attrs.update(attrs)
+                    if rate:
+                        f["iq_ts"][:] += np.int64(
+                            round(self._delay * 1e9 / rate)
+                        )
+                paths.append(path)
+        # Cataloged once tagged, since the catalog reads the frequency and
+        # the timestamps
+        register_files(paths)
+        return paths
+
+    @property
+    def dropped(self) -> dict[str, int]:
+        return dict(self._dropped)
+
+    @property
+    def errors(self) -> dict[str, Exception]:
+        return dict(self._errors)
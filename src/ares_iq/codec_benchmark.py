@@ -0,0 +1,131 @@
+"""Benchmark of the IQ codec on simulated sources."""
+
+import time
+
+import numpy as np
+import numpy.typing as npt
+from rich.table import Table
+
+from .codec import SC16_SCALE, IQCodec, to_int16
+
+
+def _lowpass(
+    x: npt.NDArray[np.complex128], fraction: float
+) -> npt.NDArray[np.complex128]:
+    spectrum = np.fft.fft(x)
+    freqs = np.fft.fftfreq(len(x))
+    spectrum[np.abs(freqs) > fraction / 2] = 0
+    return np.fft.ifft(spectrum)
+
+
+def _noise(
+    rng: np.random.Generator, samples: int, level_db: float
+) -> npt.NDArray[np.complex128]:
+    return (
+        (rng.standard_normal(samples) + 1j * rng.standard_normal(samples))
+        * 10 ** (level_db / 20)
+        / np.sqrt(2)
+    )
+
+
+def simulated_sources(
+    samples: int, seed: int = 0
+) -> dict[str, npt.NDArray[np.complex64]]:
+    """Signals like the ones we capture, on the 16-bit grid of the USRP samples.
+
+    - noise: Band filling noise at -20 dBFS
+    - quiet: Receiver noise at -60 dBFS with nothing on the air
+    - tone: CW carrier at -10 dBFS over receiver noise
+    - bursts: 4x oversampled QPSK bursts with a 20 % duty cycle over receiver
+    noise
+    - narrowband: Noise occupying an eighth of the capture bandwidth
+    """
+    rng = np.random.default_rng(seed)
+    n = np.arange(samples)
+    floor = _noise(rng, samples, -60)
+
+    symbols = (
+        rng.integers(0, 2, samples // 4) * 2
+        - 1
+        + 1j * (rng.integers(0, 2, samples // 4) * 2 - 1)
+    )
+    qpsk = (
+        _lowpass(np.repeat(symbols, 4)[:samples], 0.25)
+        * 10 ** (-15 / 20)
+        / np.sqrt(2)
+    )
+    period = 50_000
+    gate = (n % period) < period // 5
+
+    sources = {
+        "noise": _noise(rng, samples, -20),
+        "quiet": floor,
+        "tone": 10 ** (-10 / 20) * np.exp(2j * np.pi * 0.1 * n) + floor,
+        "bursts": np.where(gate, qpsk, 0) + floor,
+        "narrowband": _lowpass(_noise(rng, samples, -20), 1 / 8) * np.sqrt(8),
+    }
+    return {
+        name: (np.round(signal.view(np.float64) * SC16_SCALE) / SC16_SCALE)
+        .astype(np.float32)
+        .view(np.complex64)
+        for name, signal in sources.items()
+    }
+
+
+def run_codec_benchmark(
+    samples: int,
+    block_samples: int,
+    coder: str = "zlib",
+    level: int = 1,
+    workers: int | None = None,
+    repeats: int = 3,
+) -> Table:
+    """Benchmark the codec on simulated sources.
+
+    Each source is encoded and decoded in blocks and the compression ratio and
+    the throughput in MB/s of int16 IQ are reported, the best of `repeats`
+    runs.
+    """
+    table = Table(
+        title=f"{coder} level {level}, {block_samples} samples per block"
+    )
+    for column in (
+        "source",
+        "ratio",
+        "vs complex64",
+        "delta blocks",
+        "encode MB/s",
+        "decode MB/s",
+    ):
+        table.add_column(
+            column, justify="left" if column == "source" else "right"
+        )
+
+    blocks = samples // block_samples
+    with IQCodec(coder, level, workers) as codec:
+        for name, signal in simulated_sources(blocks * block_samples).items():
+            iq = to_int16(signal.reshape(blocks, block_samples), SC16_SCALE)
+            encode_s = decode_s = np.inf
+            for _ in range(repeats):
+                start = time.perf_counter()
+                encoded = codec.encode(iq)
+                encode_s = min(encode_s, time.perf_counter() - start)
+                start = time.perf_counter()
+                decoded = codec.decode(encoded)
+                decode_s = min(decode_s, time.perf_counter() - start)
+            if not np.array_equal(decoded, iq):
+                raise AssertionError(
+                    f"{name} did not decode to the original samples"
+                )
+
+            compressed = sum(len(block) for block in encoded)
+            delta = sum(block[5] & 1 for block in encoded)
+            table.add_row(
+                name,
+                f"{iq.nbytes / compressed:.2f}",
+                f"{2 * iq.nbytes / compressed:.2f}",
+                f"{delta}/{blocks}",
+                f"{iq.nbytes / encode_s / 1e6:.0f}",
+                f"{iq.nbytes / decode_s / 1e6:.0f}",
+            )
+    return table
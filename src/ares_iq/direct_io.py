@@ -0,0 +1,271 @@
+"""Capture writer bypassing the page cache with O_DIRECT."""
+
+import json
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import Any
+
+import numpy as np
+import numpy.typing as npt
+
+from .affinity import place_current_thread
+from .capture_stats import CaptureStats, write_stats_sidecar
+from .catalog import register_files
+from .iq_data import IQData
+from .print_utils import print_warning
+from .save_iq_data import _new_file_path
+
+ALIGNMENT = os.sysconf("SC_PAGE_SIZE")
+STAGING_BYTES = 8 << 20
+
+
+def aligned_empty(shape, dtype, alignment: int = ALIGNMENT) -> np.ndarray:
+    """`np.empty` with the data aligned to `alignment` bytes.
+
+    O_DIRECT needs aligned buffers.
+    """
+    nbytes = int(np.prod(shape)) * np.dtype(dtype).itemsize
+    raw = np.empty(nbytes + alignment, dtype=np.uint8)
+    offset = -raw.ctypes.data % alignment
+    return raw[offset : offset + nbytes].view(dtype).reshape(shape)
+
+
+def _open_direct(path: Path) -> tuple[int, bool]:
+    flags = os.O_WRONLY | os.O_CREAT | os.O_TRUNC
+    try:
+        return os.open(path, flags | os.O_DIRECT, 0o644), True
+    except OSError:
+        # tmpfs and some network file systems don't support O_DIRECT
+        return os.open(path, flags, 0o644), False
+
+
+class _DirectStream:
+    def __init__(self, path: Path, samples_per_capture: int):
+        self.path = path
+        self.fd, self.direct = _open_direct(path)
+        self.samples_per_capture = samples_per_capture
+        self.offset = 0
+        self.nbytes = 0
+        self.staging: npt.NDArray[np.uint8] | None = None
+        self.staged = 0
+        self.timestamps: list[int] = []
+
+
+class DirectWriter:
+    """Capture listener that writes each stream to a raw complex64 file.
+
+    Files are written with O_DIRECT during the capture, bypassing the page
+    cache so writeback never stalls the receive loop. Up to `depth` writes are
+    in flight on a thread pool. Captures that are page aligned and a whole
+    number of pages long are written straight from the capture buffer, so they
+    must not be reused before `close`. Others are copied into page aligned
+    staging buffers. Each `<name>.cf32` file gets a `<name>.json` with the
+    capture timestamps and the stream metadata.
+    """
+
+    def __init__(self, depth: int = 4, tag: str | None = None):
+        self._depth = depth
+        self._tag = tag
+        self._pool = ThreadPoolExecutor(
+            depth,
+            thread_name_prefix="direct-writer",
+            initializer=place_current_thread,
+            initargs=("writer",),
+        )
+        self._streams: dict[str, _DirectStream] = {}
+        self._free_staging: list[npt.NDArray[np.uint8]] = []
+        self._pending: list[Future] = []
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._depth_samples: list[int] = []
+        self._latencies: list[float] = []
+        self._bytes = 0
+        self._zero_copy = 0
+        self._staged_writes = 0
+        self._start: float | None = None
+        self._end: float | None = None
+
+    def __enter__(self):
+        """Write captures until the block exits."""
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        """Finish the writes and write the sidecar files."""
+        self.close()
+
+    def _stream(self, stream: str, samples: int) -> _DirectStream:
+        with self._lock:
+            if stream not in self._streams:
+                tags = [t for t in (self._tag, stream) if t is not None]
+                path = _new_file_path("-".join(tags)).with_suffix(".cf32")
+                self._streams[stream] = _DirectStream(path, samples)
+            return self._streams[stream]
+
+    def _pwrite(
+        self,
+        fd: int,
+        data: memoryview,
+        offset: int,
+        staging: npt.NDArray[np.uint8] | None,
+    ):
+        start = time.perf_counter()
+        written = 0
+        while written < len(data):
+            written += os.pwrite(fd, data[written:], offset + written)
+        end = time.perf_counter()
+        with self._lock:
+            self._in_flight -= 1
+            self._latencies.append(end - start)
+            self._end = end
+            if staging is not None:
+                self._free_staging.append(staging)
+
+    def _submit(
+        self,
+        state: _DirectStream,
+        data: memoryview,
+        staging: npt.NDArray[np.uint8] | None = None,
+    ):
+        # Streams of different devices are written from their own acquisition
+        # threads
+        with self._lock:
+            self._in_flight += 1
+            self._depth_samples.append(self._in_flight)
+            if self._start is None:
+                self._start = time.perf_counter()
+            # Surface write errors and keep the list short for long recordings
+            pending = []
+            for future in self._pending:
+                if not future.done():
+                    pending.append(future)
+                else:
+                    future.result()
+            pending.append(
+                self._pool.submit(
+                    self._pwrite, state.fd, data, state.offset, staging
+                )
+            )
+            self._pending = pending
+        state.offset += len(data)
+
+    def _take_staging(self) -> npt.NDArray[np.uint8]:
+        with self._lock:
+            if self._free_staging:
+                return self._free_staging.pop()
+        return aligned_empty(STAGING_BYTES, np.uint8)
+
+    def __call__(self, stream: str, iq: IQData):
+        samples = iq.iq
+        state = self._stream(stream, len(samples))
+        state.timestamps.append(iq.ts_sec * 1_000_000_000 + iq.ts_nsec)
+        state.nbytes += samples.nbytes
+        with self._lock:
+            self._bytes += samples.nbytes
+        if (
+            state.staged == 0
+            and samples.flags.c_contiguous
+            and samples.ctypes.data % ALIGNMENT == 0
+            and samples.nbytes % ALIGNMENT == 0
+        ):
+            with self._lock:
+                self._zero_copy += 1
+            self._submit(state, samples.view(np.uint8).reshape(-1).data)
+            return
+
+        data = np.ascontiguousarray(samples).view(np.uint8).reshape(-1)
+        while len(data):
+            if state.staging is None:
+                state.staging = self._take_staging()
+            count = min(len(data), STAGING_BYTES - state.staged)
+            state.staging[state.staged : state.staged + count] = data[:count]
+            state.staged += count
+            data = data[count:]
+            if state.staged == STAGING_BYTES:
+                with self._lock:
+                    self._staged_writes += 1
+                self._submit(state, state.staging.data, state.staging)
+                state.staging, state.staged = None, 0
+
+    def close(
+        self,
+        metadata: dict[str, dict] | None = None,
+        stats: CaptureStats | None = None,
+    ) -> list[Path]:
+        """Finish writing and write the sidecar files.
+
+        What is left is written, every write waited for and the capture
+        statistics `stats` saved in a `<name>.stats.npz`. Returns the data
+        files.
+        """
+        for state in self._streams.values():
+            if state.staging is not None and state.staged:
+                # The last write is padded to a whole page and the file cut back
+                # to the data written
+                padded = -(-state.staged // ALIGNMENT) * ALIGNMENT
+                self._submit(state, state.staging[:padded].data, state.staging)
+                state.staging, state.staged = None, 0
+        with self._lock:
+            pending, self._pending = self._pending, []
+        for future in pending:
+            future.result()
+        self._pool.shutdown()
+
+        paths = []
+        for stream, state in self._streams.items():
+            os.ftruncate(state.fd, state.nbytes)
+            os.close(state.fd)
+            sidecar: dict[str, Any] = {
+                "dtype": "complex64",
+                "samples_per_capture": state.samples_per_capture,
+                "timestamps": state.timestamps,
+                "metadata": {},
+            }
+            for key, value in (metadata or {}).get(stream, {}).items():
+                sidecar["metadata"][key] = (
+                    value.item() if isinstance(value, np.generic) else value
+                )
+            if stats is not None:
+                stats_path = write_stats_sidecar(
+                    state.path,
+                    stats.for_timestamps(
+                        stream, np.array(state.timestamps, dtype=np.int64)
+                    ),
+                )
+                sidecar["capture_stats"] = stats_path.name
+            with open(state.path.with_suffix(".json"), "w") as f:
+                json.dump(sidecar, f)
+            if not state.direct:
+                print_warning(
+                    f"{state.path.parent} does not support O_DIRECT, {stream} "
+                    "was written through the page cache"
+                )
+            paths.append(state.path)
+        self._streams = {}
+        register_files(paths)
+        return paths
+
+    def stats(self) -> dict[str, float]:
+        """Throughput, queue depth and write latency of the writes so far."""
+        with self._lock:
+            latencies = np.array(self._latencies) * 1e3
+            depths = np.array(self._depth_samples)
+            written = self._bytes
+            seconds = (self._end or 0) - (self._start or 0)
+            zero_copy, staged_writes = self._zero_copy, self._staged_writes
+        if not len(latencies):
+            return {}
+        return {
+            "mb": written / 1e6,
+            "seconds": seconds,
+            "mb_per_s": written / 1e6 / seconds if seconds else 0,
+            "depth_mean": float(depths.mean()),
+            "depth_max": int(depths.max()),
+            "latency_p50_ms": float(np.percentile(latencies, 50)),
+            "latency_p99_ms": float(np.percentile(latencies, 99)),
+            "latency_max_ms": float(latencies.max()),
+            "zero_copy_writes": zero_copy,
+            "staged_writes": staged_writes,
+        }
@@ -0,0 +1,575 @@
+"""Checks of the host settings that limit sustained streaming."""
+
+import array
+import fcntl
+import ipaddress
+import os
+import resource
+import shutil
+import socket
+import struct
+import subprocess
+from pathlib import Path
+from typing import NamedTuple
+
+from rich.table import Table
+
+from .affinity import format_cpus, node_cpus, parse_cpus
+
+SC16_BYTES = 4
+# CHDR header with timestamp, UDP and IPv4 headers of a streamed packet
+PACKET_OVERHEAD = 16 + 8 + 20
+# Socket buffer UHD asks for with an X300 over 10 GbE, and the time of streaming
+# it should hold at least
+UHD_SOCKET_BUFFER = 33554432
+SOCKET_BUFFER_SECONDS = 0.1
+# Stream throughput the link should have headroom for
+LINK_UTILIZATION = 0.8
+SYSCTL_FILE = "/etc/sysctl.d/90-ares-iq.conf"
+
+SIOCETHTOOL = 0x8946
+ETHTOOL_GRINGPARAM = 0x10
+SIOCGIFADDR = 0x8915
+
+STATUS_STYLES = {
+    "ok": "green",
+    "info": "cyan",
+    "warn": "yellow",
+    "fail": "bold red",
+}
+
+
+class Check(NamedTuple):
+    """Result of checking one host setting."""
+
+    name: str
+    status: str
+    """ok, info, warn or fail"""
+    found: str
+    needed: str = ""
+    fix: str = ""
+
+
+class StreamRequirements(NamedTuple):
+    """What a stream needs from the host."""
+
+    rate: float
+    """Sample rate per channel"""
+    channels: int
+    spp: int
+    """Samples per packet"""
+    streamers: int
+    capture_gb: float
+    """Capture buffer memory needed in GB"""
+    network: bool = False
+    """Whether the device streams over Ethernet"""
+    acquisition_cpus: tuple[int, ...] = ()
+    lock_buffers: bool = False
+    huge_pages: str = "none"
+    realtime_priority: int = 0
+
+    @property
+    def bytes_per_second(self) -> float:
+        return self.rate * SC16_BYTES * self.channels
+
+    @property
+    def packet_bytes(self) -> int:
+        return self.spp * SC16_BYTES + PACKET_OVERHEAD
+
+    @property
+    def socket_buffer(self) -> int:
+        return max(
+            UHD_SOCKET_BUFFER,
+            int(self.bytes_per_second / self.streamers * SOCKET_BUFFER_SECONDS),
+        )
+
+
+def _read(path: str | Path) -> str | None:
+    try:
+        return Path(path).read_text().strip()
+    except OSError:
+        return None
+
+
+def _sysctl(name: str) -> int | None:
+    value = _read(Path("/proc/sys") / name.replace(".", "/"))
+    return None if value is None else int(value.split()[0])
+
+
+def _meminfo() -> dict[str, int]:
+    """/proc/meminfo in bytes, or pages for the HugePages_ counts."""
+    info = {}
+    for line in (_read("/proc/meminfo") or "").splitlines():
+        key, _, value = line.partition(":")
+        parts = value.split()
+        if parts:
+            info[key] = int(parts[0]) * (1024 if parts[1:] == ["kB"] else 1)
+    return info
+
+
+def device_interface(addr: str) -> tuple[str, str] | None:
+    """Interface and IPv4 address of the subnet the host shares with `addr`.
+
+    Found from the routing table.
+    """
+    target = int(ipaddress.IPv4Address(addr))
+    best = None
+    for line in (_read("/proc/net/route") or "").splitlines()[1:]:
+        fields = line.split()
+        # Little endian hex in /proc/net/route
+        dest, gateway, mask = (
+            int.from_bytes(bytes.fromhex(fields[i]), "little")
+            for i in (1, 2, 7)
+        )
+        # Routes through a gateway (like the default route) don't reach a
+        # directly attached device
+        if (
+            gateway == 0
+            and target & mask == dest
+            and (best is None or mask > best[1])
+        ):
+            best = (fields[0], mask)
+    if best is None:
+        return None
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        try:
+            ifreq = fcntl.ioctl(
+                sock.fileno(),
+                SIOCGIFADDR,
+                struct.pack("256s", best[0].encode()[:15]),
+            )
+        except OSError:
+            return best[0], ""
+    return best[0], socket.inet_ntoa(ifreq[20:24])
+
+
+def _ring_sizes(interface: str) -> tuple[int, int] | None:
+    """Current and maximum RX ring size from the ethtool ioctl."""
+    ringparam = array.array("I", [ETHTOOL_GRINGPARAM] + [0] * 8)
+    address, _ = ringparam.buffer_info()
+    ifreq = struct.pack("16sP", interface.encode()[:15], address)
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        try:
+            fcntl.ioctl(sock.fileno(), SIOCETHTOOL, ifreq)
+        except OSError:
+            return None
+    # cmd, rx_max_pending, rx_mini_max_pending, rx_jumbo_max_pending,
+    # tx_max_pending, rx_pending, ...
+    return ringparam[5], ringparam[1]
+
+
+def _interface_irqs(interface: str) -> dict[int, tuple[int, ...]]:
+    irqs = {}
+    for line in (_read("/proc/interrupts") or "").splitlines():
+        irq, _, rest = line.partition(":")
+        if (
+            irq.strip().isdigit()
+            and rest.split()
+            and rest.split()[-1].startswith(interface)
+        ):
+            cpus = _read(f"/proc/irq/{irq.strip()}/smp_affinity_list")
+            if cpus is not None:
+                irqs[int(irq)] = parse_cpus(cpus)
+    return irqs
+
+
+def _nm_managed(interface: str) -> bool | None:
+    if shutil.which("nmcli") is None:
+        return None
+    try:
+        output = subprocess.run(
+            ["nmcli", "-t", "-f", "DEVICE,STATE", "device"],
+            capture_output=True,
+            text=True,
+            timeout=5,
+        ).stdout
+    except (OSError, subprocess.TimeoutExpired):
+        return None
+    for line in output.splitlines():
+        device, _, state = line.partition(":")
+        if device == interface:
+            return state != "unmanaged"
+    return None
+
+
+def check_socket_buffers(req: StreamRequirements) -> list[Check]:
+    """Check the maximum socket buffer sizes."""
+    checks = []
+    for name in ("net.core.rmem_max", "net.core.wmem_max"):
+        value = _sysctl(name)
+        needed = req.socket_buffer
+        if value is None:
+            checks.append(Check(name, "info", "unknown"))
+        elif value < needed:
+            checks.append(
+                Check(
+                    name,
+                    "fail" if name.startswith("net.core.rmem") else "warn",
+                    str(value),
+                    f">= {needed}",
+                    f"sudo sysctl -w {name}={needed} && "
+                    f"echo '{name} = {needed}' | sudo tee -a {SYSCTL_FILE}",
+                )
+            )
+        else:
+            checks.append(Check(name, "ok", str(value), f">= {needed}"))
+    return checks
+
+
+def check_interface(
+    req: StreamRequirements, addr: str, interface: str | None
+) -> list[Check]:
+    """Check the MTU, link speed, rings and management of the interface."""
+    local = device_interface(addr)
+    if local is None:
+        subnet = ipaddress.IPv4Network(f"{addr}/24", strict=False)
+        host = next(ip for ip in subnet.hosts() if str(ip) != addr)
+        checks = [
+            Check(
+                "route",
+                "fail",
+                f"no interface reaches {addr}",
+                f"an address in {subnet}",
+                f"sudo ip addr add {host}/24 dev {interface or '<interface>'}",
+            )
+        ]
+        if interface is None:
+            return checks
+    else:
+        checks = [
+            Check(
+                "route",
+                "ok",
+                f"{addr} via {local[0]}"
+                + (f" ({local[1]})" if local[1] else ""),
+            )
+        ]
+        interface = interface or local[0]
+    if _read(f"/sys/class/net/{interface}/mtu") is None:
+        return checks + [
+            Check("interface", "fail", f"{interface} doesn't exist")
+        ]
+
+    managed = _nm_managed(interface)
+    if managed:
+        checks.append(
+            Check(
+                "NetworkManager",
+                "warn",
+                f"{interface} is managed",
+                "unmanaged",
+                f"sudo nmcli dev set {interface} managed no",
+            )
+        )
+    elif managed is not None:
+        checks.append(
+            Check("NetworkManager", "ok", f"{interface} is unmanaged")
+        )
+
+    mtu = _read(f"/sys/class/net/{interface}/mtu")
+    if mtu is not None:
+        needed = req.packet_bytes
+        if int(mtu) < needed:
+            checks.append(
+                Check(
+                    "MTU",
+                    "fail",
+                    mtu,
+                    f">= {needed} for spp {req.spp}",
+                    f"sudo ip link set dev {interface} mtu 9000, or lower spp "
+                    "with x310-stream-args --spp "
+                    f"{(int(mtu) - PACKET_OVERHEAD) // SC16_BYTES}",
+                )
+            )
+        else:
+            checks.append(
+                Check("MTU", "ok", mtu, f">= {needed} for spp {req.spp}")
+            )
+
+    speed = _read(f"/sys/class/net/{interface}/speed")
+    if speed is not None and int(speed) > 0:
+        needed_mbps = req.bytes_per_second * 8 / 1e6 / LINK_UTILIZATION
+        status = "ok" if int(speed) >= needed_mbps else "fail"
+        checks.append(
+            Check(
+                "link speed",
+                status,
+                f"{int(speed)} Mb/s",
+                f">= {needed_mbps:.0f} Mb/s for "
+                f"{req.bytes_per_second / 1e6:.0f} MB/s",
+                ""
+                if status == "ok"
+                else "use the 10 GbE port or lower the rate with "
+                "x310-configs --rate",
+            )
+        )
+
+    rings = _ring_sizes(interface)
+    if rings is not None:
+        current, maximum = rings
+        if current < maximum:
+            checks.append(
+                Check(
+                    "RX ring",
+                    "warn",
+                    str(current),
+                    str(maximum),
+                    f"sudo ethtool -G {interface} rx {maximum}",
+                )
+            )
+        else:
+            checks.append(Check("RX ring", "ok", str(current), str(maximum)))
+
+    checks += check_irqs(req, interface)
+    return checks
+
+
+def check_irqs(req: StreamRequirements, interface: str) -> list[Check]:
+    """Check that the interface interrupts avoid the acquisition CPUs."""
+    irqs = _interface_irqs(interface)
+    if not irqs:
+        return []
+    found = ", ".join(
+        f"{irq}: {format_cpus(cpus)}" for irq, cpus in irqs.items()
+    )
+    if not req.acquisition_cpus:
+        return [
+            Check(
+                "IRQ affinity",
+                "info",
+                found,
+                "",
+                "set acquisition-cpus to keep the receive threads off "
+                "these CPUs",
+            )
+        ]
+    shared = [
+        irq
+        for irq, cpus in irqs.items()
+        if set(cpus) & set(req.acquisition_cpus)
+    ]
+    if not shared:
+        return [
+            Check(
+                "IRQ affinity",
+                "ok",
+                found,
+                f"not on {format_cpus(req.acquisition_cpus)}",
+            )
+        ]
+    # Keep the interrupts on the same node as the receive threads
+    node = _read(f"/sys/class/net/{interface}/device/numa_node")
+    candidates = (
+        node_cpus(int(node))
+        if node and int(node) >= 0
+        else tuple(sorted(os.sched_getaffinity(0)))
+    )
+    others = format_cpus(set(candidates) - set(req.acquisition_cpus))
+    fix = (
+        " && ".join(
+            f"echo {others} | sudo tee /proc/irq/{irq}/smp_affinity_list"
+            for irq in shared
+        )
+        if others
+        else "free a CPU for the interrupts in acquisition-cpus"
+    )
+    return [
+        Check(
+            "IRQ affinity",
+            "warn",
+            found,
+            f"not on {format_cpus(req.acquisition_cpus)}",
+            fix,
+        )
+    ]
+
+
+def check_cpus(req: StreamRequirements) -> list[Check]:
+    """Check the CPU governor and the realtime priority limit."""
+    cpus = req.acquisition_cpus or tuple(sorted(os.sched_getaffinity(0)))
+    governors: dict[str, list[int]] = {}
+    for cpu in cpus:
+        governor = _read(
+            f"/sys/devices/system/cpu/cpu{cpu}/cpufreq/scaling_governor"
+        )
+        if governor is not None:
+            governors.setdefault(governor, []).append(cpu)
+    checks = []
+    if governors:
+        found = ", ".join(
+            f"{governor} on {format_cpus(on)}"
+            for governor, on in governors.items()
+        )
+        slow = [
+            cpu
+            for governor, on in governors.items()
+            if governor != "performance"
+            for cpu in on
+        ]
+        if slow:
+            checks.append(
+                Check(
+                    "CPU governor",
+                    "warn",
+                    found,
+                    "performance",
+                    f"sudo cpupower -c {format_cpus(slow)} frequency-set "
+                    "-g performance",
+                )
+            )
+        else:
+            checks.append(Check("CPU governor", "ok", found, "performance"))
+
+    if req.realtime_priority > 0:
+        soft, _ = resource.getrlimit(resource.RLIMIT_RTPRIO)
+        if (
+            soft != resource.RLIM_INFINITY
+            and soft < req.realtime_priority
+            and os.geteuid() != 0
+        ):
+            checks.append(
+                Check(
+                    "rtprio limit",
+                    "fail",
+                    str(soft),
+                    f">= {req.realtime_priority}",
+                    f"add '{os.environ.get('USER', '<user>')} - rtprio "
+                    f"{req.realtime_priority}' to "
+                    "/etc/security/limits.d/ares-iq.conf and log in again",
+                )
+            )
+        else:
+            checks.append(
+                Check(
+                    "rtprio limit",
+                    "ok",
+                    _limit(soft, 1),
+                    f">= {req.realtime_priority}",
+                )
+            )
+    return checks
+
+
+def _limit(soft: int, scale: float, unit: str = "") -> str:
+    if os.geteuid() == 0:
+        return "root"
+    return (
+        "unlimited"
+        if soft == resource.RLIM_INFINITY
+        else f"{soft / scale:g}{unit}"
+    )
+
+
+def check_memory(req: StreamRequirements) -> list[Check]:
+    """Check the available, lockable and huge page memory."""
+    info = _meminfo()
+    needed = int(req.capture_gb * 1e9)
+    checks = []
+    if "MemAvailable" in info:
+        available = info["MemAvailable"]
+        checks.append(
+            Check(
+                "memory",
+                "ok" if available >= needed else "fail",
+                f"{available / 1e9:.1f} GB available",
+                f">= {needed / 1e9:.1f} GB",
+                ""
+                if available >= needed
+                else "capture less with --size or free memory",
+            )
+        )
+
+    if req.lock_buffers:
+        soft, _ = resource.getrlimit(resource.RLIMIT_MEMLOCK)
+        if (
+            soft != resource.RLIM_INFINITY
+            and soft < needed
+            and os.geteuid() != 0
+        ):
+            checks.append(
+                Check(
+                    "memlock limit",
+                    "fail",
+                    f"{soft / 1e9:.3f} GB",
+                    f">= {needed / 1e9:.1f} GB",
+                    f"add '{os.environ.get('USER', '<user>')} - memlock "
+                    "unlimited' to /etc/security/limits.d/ares-iq.conf and log "
+                    "in again",
+                )
+            )
+        else:
+            checks.append(
+                Check(
+                    "memlock limit",
+                    "ok",
+                    _limit(soft, 1e9, " GB"),
+                    f">= {needed / 1e9:.1f} GB",
+                )
+            )
+
+    if req.huge_pages == "explicit" and "Hugepagesize" in info:
+        size = info["Hugepagesize"]
+        pages = -(-needed // size)
+        free = info.get("HugePages_Free", 0)
+        checks.append(
+            Check(
+                "huge pages",
+                "ok" if free >= pages else "warn",
+                f"{free} free",
+                f">= {pages}",
+                ""
+                if free >= pages
+                else f"sudo sysctl -w vm.nr_hugepages="
+                f"{info.get('HugePages_Total', 0) + pages - free}",
+            )
+        )
+    return checks
+
+
+def run_checks(
+    req: StreamRequirements, addr: str, interface: str | None = None
+) -> list[Check]:
+    """Check the host settings that limit sustained streaming.
+
+    Each setting is checked against what the stream needs.
+    :param addr: Address of a network device
+    :param interface: Interface of a network device. Found from the routing
+    table by default
+    """
+    checks = []
+    if req.network:
+        checks += check_socket_buffers(req)
+        checks += check_interface(req, addr, interface)
+    return checks + check_cpus(req) + check_memory(req)
+
+
+def checks_table(checks: list[Check], title: str) -> Table:
+    """The checks with the fixes numbered.
+
+    Print the fixes themselves with `fixes` so they can be copied.
+    """
+    table = Table(title=title)
+    for column in ("check", "status", "found", "needed", "fix"):
+        table.add_column(column)
+    fixes = 0
+    for check in checks:
+        style = STATUS_STYLES[check.status]
+        fixes += bool(check.fix)
+        table.add_row(
+            check.name,
+            f"[{style}]{check.status}[/{style}]",
+            check.found,
+            check.needed,
+            f"{fixes}" if check.fix else "",
+        )
+    return table
+
+
+def fixes(checks: list[Check]) -> list[str]:
+    """Numbered fixes of the checks that have one."""
+    return [
+        f"{number}. {check.name}: {check.fix}"
+        for number, check in enumerate(
+            (check for check in checks if check.fix), start=1
+        )
+    ]
@@ -0,0 +1,115 @@
+"""Benchmark of network streaming over loopback or a real link."""
+
+import threading
+import time
+
+import numpy as np
+from rich.table import Table
+
+from .net_stream import NetworkReceiver, NetworkSender, sendmmsg_available
+
+
+def _run(
+    url: str,
+    captures: int,
+    samples_per_capture: int,
+    payload: int,
+    batch: int,
+    rate: float,
+) -> list[str]:
+    receiver = NetworkReceiver(url, keep=False)
+    thread = threading.Thread(
+        target=receiver.run, kwargs={"idle": 1.0}, name="net-benchmark-receiver"
+    )
+    thread.start()
+    sender = NetworkSender(receiver.url, payload, batch)
+    rng = np.random.default_rng(0)
+    iq = (
+        rng.standard_normal(samples_per_capture)
+        + 1j * rng.standard_normal(samples_per_capture)
+    ).astype(np.complex64)
+
+    wall, cpu = time.perf_counter(), time.thread_time()
+    for sequence in range(captures):
+        if rate:
+            # Paced to the sample rate a device would deliver
+            ahead = sequence * samples_per_capture / rate - (
+                time.perf_counter() - wall
+            )
+            if ahead > 0:
+                time.sleep(ahead)
+        sender.send("bench", iq, time.time_ns())
+    send_seconds = time.perf_counter() - wall
+    send_cpu = time.thread_time() - cpu
+    sender.close()
+    thread.join()
+
+    gb = captures * iq.nbytes / 1e9
+    stats = receiver.stats().get("bench")
+    received = stats.captures if stats else 0
+    received_gb = received * iq.nbytes / 1e9
+    return [
+        receiver.protocol,
+        sender.batching,
+        f"{gb * 1e3 / send_seconds:.0f}",
+        f"{received_gb * 1e3 / receiver.seconds:.0f}"
+        if receiver.seconds
+        else "-",
+        f"{100 * (captures - received) / captures:.2f}",
+        f"{send_cpu / gb:.2f}",
+        f"{receiver.cpu_seconds / received_gb:.2f}" if received else "-",
+    ]
+
+
+def run_net_benchmark(
+    size: float,
+    samples_per_capture: int,
+    payload: int,
+    batch: int,
+    rate: float = 0,
+    host: str = "127.0.0.1",
+    protocols: tuple[str, ...] = ("udp", "tcp"),
+) -> Table:
+    """Benchmark network streaming between a sender and a receiver.
+
+    `size` GB of simulated captures are streamed over `host` and the sustained
+    throughput, the captures lost and the CPU seconds each side spent per GB
+    are reported. UDP runs with one packet per call and
+    with `sendmmsg` batches. `rate` in samples per second paces the sender like
+    a device, 0 sends as fast as it can.
+    """
+    table = Table(
+        title=f"Network streaming over {host}, {samples_per_capture} samples "
+        f"per capture, {payload} byte payloads",
+        caption="Receive MB/s is measured from the start of the receiver",
+    )
+    for column in (
+        "protocol",
+        "batching",
+        "send MB/s",
+        "receive MB/s",
+        "lost %",
+        "send CPU s/GB",
+        "receive CPU s/GB",
+    ):
+        table.add_column(
+            column,
+            justify="left" if column in ("protocol", "batching") else "right",
+        )
+    captures = max(1, round(size * 1e9 / (samples_per_capture * 8)))
+    for protocol in protocols:
+        batches = [1]
+        if protocol == "udp" and batch > 1 and sendmmsg_available():
+            batches.append(batch)
+        for protocol_batch in batches:
+            table.add_row(
+                *_run(
+                    f"{protocol}://{host}:0",
+                    captures,
+                    samples_per_capture,
+                    payload,
+                    protocol_batch,
+                    rate,
+                )
+            )
+    return table
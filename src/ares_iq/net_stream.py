@@ -0,0 +1,841 @@
+"""Streaming of captures over UDP or TCP to a receiver on another host."""
+
+import ctypes
+import errno
+import json
+import os
+import queue
+import socket
+import struct
+import threading
+import time
+from pathlib import Path
+from typing import Callable, NamedTuple
+from urllib.parse import urlsplit
+
+import numpy as np
+import numpy.typing as npt
+
+from .affinity import placed_thread
+from .iq_data import IQData
+from .print_utils import print_warning
+from .save_iq_data import _save_file
+
+PROTOCOLS = ("udp", "tcp")
+MAGIC = int.from_bytes(b"AIQN", "little")
+# Packet kinds, numbered like the VITA-49 packet types they stand in for
+DATA, CONTEXT, END = 1, 4, 15
+HEADER = np.dtype(
+    [
+        ("magic", "<u4"),
+        ("kind", "<u2"),
+        ("stream", "<u2"),
+        ("sequence", "<u8"),
+        ("timestamp", "<i8"),
+        ("samples", "<u4"),
+        ("offset", "<u4"),
+        ("count", "<u4"),
+        ("packet", "<u4"),
+    ]
+)
+"""Header of every packet, in the spirit of VITA-49: stream id, capture
+sequence, integer ns timestamp and a packet count. Data packets carry samples
+`offset` to `offset + count` of the `samples` of a capture. Context and end
+packets carry `count` bytes of JSON, the stream name and the stream metadata.
+Context packets carry the metadata known when they are sent, end packets the
+final metadata.
+"""
+# Parsing one header with struct is several times faster than with numpy
+_HEADER_STRUCT = struct.Struct("<IHHQqIIII")
+SAMPLE_BYTES = np.dtype(np.complex64).itemsize
+# Fits a 9000 byte MTU with the IP and UDP headers
+DEFAULT_PAYLOAD = 8192
+DEFAULT_BATCH = 32
+# Captures between repeats of the context packet, so UDP receivers that start
+# late learn the stream names
+CONTEXT_INTERVAL = 64
+RECEIVE_BUFFER = 64 * 1024 * 1024
+_MAX_DATAGRAM = 65507
+_POLL = 0.2
+
+
+def _plain(metadata: dict) -> dict:
+    return {
+        key: value.item() if isinstance(value, np.generic) else value
+        for key, value in metadata.items()
+    }
+
+
+class _IOVec(ctypes.Structure):
+    _fields_ = [("iov_base", ctypes.c_void_p), ("iov_len", ctypes.c_size_t)]
+
+
+class _MsgHdr(ctypes.Structure):
+    _fields_ = [
+        ("msg_name", ctypes.c_void_p),
+        ("msg_namelen", ctypes.c_uint32),
+        ("msg_iov", ctypes.c_void_p),
+        ("msg_iovlen", ctypes.c_size_t),
+        ("msg_control", ctypes.c_void_p),
+        ("msg_controllen", ctypes.c_size_t),
+        ("msg_flags", ctypes.c_int),
+    ]
+
+
+class _MMsgHdr(ctypes.Structure):
+    _fields_ = [("msg_hdr", _MsgHdr), ("msg_len", ctypes.c_uint)]
+
+
+_sendmmsg: Callable[..., int] | None
+try:
+    _libc = ctypes.CDLL(None, use_errno=True)
+    _libc.sendmmsg.argtypes = [
+        ctypes.c_int,
+        ctypes.c_void_p,
+        ctypes.c_uint,
+        ctypes.c_int,
+    ]
+    _libc.sendmmsg.restype = ctypes.c_int
+    _sendmmsg = _libc.sendmmsg
+except (AttributeError, OSError):
+    _sendmmsg = None
+
+
+def sendmmsg_available() -> bool:
+    """Whether UDP captures can be sent in `sendmmsg` batches."""
+    return _sendmmsg is not None
+
+
+def parse_url(url: str) -> tuple[str, str, int]:
+    """Protocol, host and port of `udp://host:port` or `tcp://host:port`."""
+    parts = urlsplit(url)
+    if (
+        parts.scheme not in PROTOCOLS
+        or not parts.hostname
+        or parts.port is None
+    ):
+        raise ValueError(f"{url} is not udp://host:port or tcp://host:port")
+    return parts.scheme, parts.hostname, parts.port
+
+
+def _recv_exact(sock: socket.socket, view: memoryview) -> bool:
+    """Fill `view`. False if the connection closed first."""
+    while view.nbytes:
+        received = sock.recv_into(view)
+        if not received:
+            return False
+        view = view[received:]
+    return True
+
+
+class _MessageBatch:
+    """`sendmmsg` of up to `size` messages.
+
+    Each message is a header and a payload, filled in place with numpy.
+    """
+
+    def __init__(self, size: int):
+        if _sendmmsg is None:
+            raise OSError(errno.ENOSYS, "sendmmsg is not available")
+        self._sendmmsg = _sendmmsg
+        self.iov: npt.NDArray[np.void] = np.zeros(
+            (size, 2), dtype=np.dtype(_IOVec)
+        )
+        self.msgs: npt.NDArray[np.void] = np.zeros(
+            size, dtype=np.dtype(_MMsgHdr)
+        )
+        self.msgs["msg_hdr"]["msg_iov"] = (
+            self.iov.ctypes.data + np.arange(size) * 2 * self.iov.itemsize
+        )
+        self.msgs["msg_hdr"]["msg_iovlen"] = 2
+
+    def send(
+        self,
+        fd: int,
+        headers: npt.NDArray,
+        payloads: npt.NDArray[np.integer],
+        lengths: npt.NDArray[np.integer],
+    ) -> int:
+        """Send the messages and return how many the receiver refused."""
+        size, refused, sent = len(self.msgs), 0, 0
+        while sent < len(headers):
+            count = min(size, len(headers) - sent)
+            self.iov["iov_base"][:count, 0] = (
+                headers.ctypes.data
+                + np.arange(sent, sent + count) * HEADER.itemsize
+            )
+            self.iov["iov_len"][:count, 0] = HEADER.itemsize
+            self.iov["iov_base"][:count, 1] = payloads[sent : sent + count]
+            self.iov["iov_len"][:count, 1] = lengths[sent : sent + count]
+            result = self._sendmmsg(fd, self.msgs.ctypes.data, count, 0)
+            if result < 0:
+                error = ctypes.get_errno()
+                if error == errno.ECONNREFUSED:
+                    # ECONNREFUSED from an earlier datagram while nothing
+                    # listens. The batch is lost
+                    refused += count
+                    result = count
+                elif error == errno.EINTR:
+                    continue
+                else:
+                    raise OSError(error, os.strerror(error))
+            sent += result
+        return refused
+
+
+class NetworkSender:
+    """Sends captures to a `NetworkReceiver`.
+
+    Over UDP each capture is split into packets of `payload` bytes of samples,
+    sent `batch` at a time with `sendmmsg` where the C library has it (`batch` 1
+    sends one packet per call). Over TCP each capture is one packet. Samples are
+    sent straight from the capture array.
+    :param metadata: Returns the stream metadata sent in the context packets,
+    e.g. `lambda: platform.stream_metadata`.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        payload: int = DEFAULT_PAYLOAD,
+        batch: int = DEFAULT_BATCH,
+        metadata: Callable[[], dict[str, dict]] | None = None,
+    ):
+        self.protocol, host, port = parse_url(url)
+        if payload < SAMPLE_BYTES or payload + HEADER.itemsize > _MAX_DATAGRAM:
+            raise ValueError(
+                f"payload must be between {SAMPLE_BYTES} and "
+                f"{_MAX_DATAGRAM - HEADER.itemsize} bytes"
+            )
+        self._fragment = payload // SAMPLE_BYTES
+        self._batch = (
+            _MessageBatch(batch)
+            if self.protocol == "udp" and batch > 1 and _sendmmsg
+            else None
+        )
+        kind = (
+            socket.SOCK_DGRAM if self.protocol == "udp" else socket.SOCK_STREAM
+        )
+        self._sock = socket.socket(
+            socket.AF_INET6 if ":" in host else socket.AF_INET, kind
+        )
+        self._sock.connect((host, port))
+        self._metadata = metadata
+        self._streams: dict[str, int] = {}
+        self._sequence: dict[str, int] = {}
+        self._packet = 0
+        self.packets = 0
+        self.bytes = 0
+        self.refused = 0
+        """UDP packets sent while nothing listened"""
+
+    @property
+    def batching(self) -> str:
+        if self.protocol == "tcp":
+            return "stream"
+        return (
+            f"sendmmsg x{len(self._batch.msgs)}"
+            if self._batch is not None
+            else "sendmsg"
+        )
+
+    def _headers(
+        self,
+        count: int,
+        kind: int,
+        stream: int,
+        sequence: int = 0,
+        timestamp: int = 0,
+    ) -> npt.NDArray:
+        headers = np.zeros(count, dtype=HEADER)
+        headers["magic"], headers["kind"], headers["stream"] = (
+            MAGIC,
+            kind,
+            stream,
+        )
+        headers["sequence"], headers["timestamp"] = sequence, timestamp
+        headers["packet"] = (self._packet + np.arange(count)) & 0xFFFFFFFF
+        self._packet += count
+        self.packets += count
+        return headers
+
+    def _send(self, buffers: list):
+        try:
+            if self.protocol == "udp":
+                self._sock.sendmsg(buffers)
+                return
+            sent = self._sock.sendmsg(buffers)
+            # Partial sends on a full socket buffer
+            for buffer in buffers:
+                buffer = memoryview(buffer).cast("B")
+                if sent >= buffer.nbytes:
+                    sent -= buffer.nbytes
+                    continue
+                self._sock.sendall(buffer[sent:])
+                sent = 0
+        except ConnectionRefusedError:
+            self.refused += 1
+
+    def _send_json(self, kind: int, stream: str, content: dict):
+        payload = json.dumps(
+            {"stream": stream, **content}, default=str
+        ).encode()
+        header = self._headers(1, kind, self._streams[stream])
+        header["count"] = len(payload)
+        self._send([header, payload])
+
+    def send(
+        self,
+        stream: str,
+        iq: npt.NDArray[np.complex64],
+        timestamp: int,
+        sequence: int | None = None,
+    ):
+        """Send a capture.
+
+        `sequence` numbers the captures of the stream. Left out, captures are
+        numbered as they are sent. Skipped sequence numbers are reported as lost
+        by the receiver.
+        """
+        new = stream not in self._streams
+        if new:
+            self._streams[stream] = len(self._streams)
+        if sequence is None:
+            sequence = self._sequence.get(stream, 0)
+        self._sequence[stream] = sequence + 1
+        if new or sequence % CONTEXT_INTERVAL == 0:
+            context = (
+                {"metadata": _plain(self._metadata().get(stream, {}))}
+                if self._metadata is not None
+                else {}
+            )
+            self._send_json(CONTEXT, stream, context)
+        samples = len(iq)
+        step = self._fragment if self.protocol == "udp" else max(samples, 1)
+        offsets = np.arange(0, samples, step, dtype=np.uint64)
+        headers = self._headers(
+            len(offsets), DATA, self._streams[stream], sequence, timestamp
+        )
+        headers["samples"], headers["offset"] = samples, offsets
+        headers["count"] = np.minimum(step, samples - offsets)
+        self.bytes += iq.nbytes
+        if self._batch is not None:
+            iq = np.ascontiguousarray(iq)
+            self.refused += self._batch.send(
+                self._sock.fileno(),
+                headers,
+                iq.ctypes.data + offsets * SAMPLE_BYTES,
+                headers["count"].astype(np.uint64) * SAMPLE_BYTES,
+            )
+            return
+        data = np.ascontiguousarray(iq).data.cast("B")
+        for i, header in enumerate(headers):
+            start = int(header["offset"]) * SAMPLE_BYTES
+            self._send(
+                [
+                    headers[i : i + 1],
+                    data[start : start + int(header["count"]) * SAMPLE_BYTES],
+                ]
+            )
+
+    def close(
+        self,
+        metadata: dict[str, dict] | None = None,
+        sequences: dict[str, int] | None = None,
+    ):
+        """Tell the receiver every stream ended and close the socket.
+
+        The end of each stream carries its metadata and the number of captures
+        sent, so the receiver counts the captures lost at the tail. It's the
+        sequence number after the last capture sent unless `sequences` gives it.
+        """
+        metadata = metadata or {}
+        sequences = {**self._sequence, **(sequences or {})}
+        for stream in self._streams:
+            content = {
+                "metadata": _plain(metadata.get(stream, {})),
+                "sent": sequences[stream],
+            }
+            # Repeated since UDP may lose it. The receiver ignores the copies
+            for _ in range(3 if self.protocol == "udp" else 1):
+                self._send_json(END, stream, content)
+        self._sock.close()
+
+
+class NetworkSink:
+    """Capture listener that sends every stream to a `NetworkReceiver`.
+
+    Captures are copied to a queue of `max_queued` captures and sent by a writer
+    thread during the capture, so the network never stalls the acquisition.
+    Captures that don't fit in the queue are dropped and show up as lost at the
+    receiver.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        payload: int = DEFAULT_PAYLOAD,
+        batch: int = DEFAULT_BATCH,
+        max_queued: int = 64,
+        metadata: Callable[[], dict[str, dict]] | None = None,
+    ):
+        self.sender = NetworkSender(url, payload, batch, metadata)
+        self._queue: queue.Queue = queue.Queue(maxsize=max_queued)
+        self._sequence: dict[str, int] = {}
+        self._dropped: dict[str, int] = {}
+        self._thread: threading.Thread | None = None
+        self._error: BaseException | None = None
+
+    def __enter__(self):
+        """Start sending captures until the block exits."""
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        """Send what is queued and end the streams."""
+        self.stop()
+
+    def start(self):
+        self._thread = threading.Thread(
+            target=self._send, name="net-sender", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+    def __call__(self, stream: str, iq: IQData):
+        # Numbered here so dropped captures leave a gap the receiver counts
+        sequence = self._sequence.get(stream, 0)
+        self._sequence[stream] = sequence + 1
+        try:
+            # Copied since the capture buffer is recycled
+            self._queue.put_nowait(
+                (
+                    stream,
+                    iq.iq.copy(),
+                    iq.ts_sec * 1_000_000_000 + iq.ts_nsec,
+                    sequence,
+                )
+            )
+        except queue.Full:
+            self._dropped[stream] = self._dropped.get(stream, 0) + 1
+
+    def _send(self):
+        with placed_thread("writer"):
+            while (item := self._queue.get()) is not None:
+                if self._error is not None:
+                    continue
+                try:
+                    self.sender.send(*item)
+                except OSError as e:
+                    # Keep draining the queue so the capture isn't blocked
+                    self._error = e
+
+    def close(self, metadata: dict[str, dict]) -> str | None:
+        """End the streams with their metadata.
+
+        Call after `stop`. The error that stopped sending, if any.
+        """
+        if self._error is None:
+            try:
+                # Captures dropped after the last one sent are lost too
+                self.sender.close(metadata, self._sequence)
+            except OSError as e:
+                self._error = e
+        return None if self._error is None else str(self._error)
+
+    @property
+    def dropped(self) -> dict[str, int]:
+        return dict(self._dropped)
+
+
+class _Columns:
+    """Captures of a stream in the layout of the saved files.
+
+    (captures, samples) samples and (captures, 1) ns.
+    """
+
+    def __init__(self, samples_per_capture: int):
+        self.count = 0
+        self.iq = np.empty((16, samples_per_capture), dtype=np.complex64)
+        self.ts = np.empty((16, 1), dtype=np.int64)
+
+    def next_row(self) -> npt.NDArray[np.complex64]:
+        if self.count == len(self.iq):
+            self.iq = np.concatenate([self.iq, np.empty_like(self.iq)])
+            self.ts = np.concatenate([self.ts, np.empty_like(self.ts)])
+        return self.iq[self.count]
+
+    def commit(self, timestamp: int):
+        self.ts[self.count] = timestamp
+        self.count += 1
+
+
+class StreamStats(NamedTuple):
+    """Reception statistics of a stream."""
+
+    captures: int
+    lost: int
+    """Captures never received, sequence gaps including the ones at the end of
+    the stream, plus captures missing packets
+    """
+    incomplete: int
+    late_packets: int
+    """Packets of a capture that was already complete or given up on"""
+
+
+class _Header(NamedTuple):
+    magic: int
+    kind: int
+    stream: int
+    sequence: int
+    timestamp: int
+    samples: int
+    offset: int
+    # `count` of HEADER, which would shadow tuple.count
+    length: int
+    packet: int
+
+
+class _StreamState:
+    def __init__(self, stream_id: int):
+        self.name = f"stream{stream_id}"
+        self.metadata: dict = {}
+        self.ended = False
+        self.columns: _Columns | None = None
+        # Captures received before the capture size changed, with the metadata
+        # of the time
+        self.chunks: list[tuple[_Columns, dict]] = []
+        self.row: npt.NDArray[np.complex64] | None = None
+        self.row_bytes = memoryview(b"")
+        self.sequence = -1
+        self.timestamp = 0
+        self.filled = 0
+        self.expected = 0
+        self.captures = 0
+        self.lost = 0
+        self.incomplete = 0
+        self.late = 0
+
+
+class NetworkReceiver:
+    """Receiver of the captures of a `NetworkSender`.
+
+    The captures are reassembled per stream into (captures, samples) complex64
+    samples and (captures, 1) int64 ns timestamps, the layout of the saved
+    files, with the captures lost on the way. When the capture size of a stream
+    changes, the captures before the change are kept as a chunk of their own.
+    The socket is bound on construction, port 0 picks a free port (`url`). With
+    `keep` False captures only go to `listeners`, which take `(stream, IQData)`
+    like capture listeners, with views that are reused once they return.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        keep: bool = True,
+        listeners: list[Callable[[str, IQData], None]] | None = None,
+    ):
+        self.protocol, host, port = parse_url(url)
+        kind = (
+            socket.SOCK_DGRAM if self.protocol == "udp" else socket.SOCK_STREAM
+        )
+        self._sock = socket.socket(
+            socket.AF_INET6 if ":" in host else socket.AF_INET, kind
+        )
+        self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._sock.setsockopt(
+            socket.SOL_SOCKET, socket.SO_RCVBUF, RECEIVE_BUFFER
+        )
+        self.receive_buffer = self._sock.getsockopt(
+            socket.SOL_SOCKET, socket.SO_RCVBUF
+        )
+        self._sock.bind((host, port))
+        if self.protocol == "tcp":
+            self._sock.listen(1)
+        self._sock.settimeout(_POLL)
+        self.url = f"{self.protocol}://{host}:{self._sock.getsockname()[1]}"
+        self._keep = keep
+        self._listeners = listeners or []
+        self._streams: dict[int, _StreamState] = {}
+        self._scratch = memoryview(bytearray(_MAX_DATAGRAM))
+        self._stop = threading.Event()
+        self.packets = 0
+        self.bytes = 0
+        self.seconds = 0.0
+        self.cpu_seconds = 0.0
+
+    def stop(self):
+        """End `run` from another thread."""
+        self._stop.set()
+
+    def _state(self, stream_id: int) -> _StreamState:
+        if stream_id not in self._streams:
+            self._streams[stream_id] = _StreamState(stream_id)
+        return self._streams[stream_id]
+
+    def _control(self, header: _Header, payload: bytes):
+        state = self._state(header.stream)
+        content = json.loads(payload)
+        state.name = content["stream"]
+        if "metadata" in content:
+            state.metadata = content["metadata"]
+        if header.kind == END:
+            if not state.ended:
+                self._give_up(state)
+                sent = content.get("sent", state.expected)
+                state.lost += max(sent - state.expected, 0)
+                state.expected = max(sent, state.expected)
+            state.ended = True
+
+    def _give_up(self, state: _StreamState):
+        if state.row is not None:
+            state.incomplete += 1
+            state.lost += 1
+            state.row = None
+
+    def _row(
+        self, state: _StreamState, samples: int
+    ) -> npt.NDArray[np.complex64]:
+        if state.columns is None or state.columns.iq.shape[1] != samples:
+            if self._keep and state.columns is not None and state.columns.count:
+                state.chunks.append((state.columns, state.metadata))
+            state.columns = _Columns(samples)
+        if not self._keep:
+            # Captures aren't kept, so every capture reuses the first row
+            state.columns.count = 0
+        return state.columns.next_row()
+
+    def _start_capture(self, state: _StreamState, header: _Header) -> bool:
+        """Start the capture of `header`. False if it's a late packet."""
+        sequence = header.sequence
+        if sequence == state.sequence:
+            return state.row is not None or self._late(state)
+        if sequence < state.expected:
+            return self._late(state)
+        self._give_up(state)
+        state.lost += sequence - state.expected
+        state.expected = sequence + 1
+        state.sequence, state.timestamp, state.filled = (
+            sequence,
+            header.timestamp,
+            0,
+        )
+        state.row = self._row(state, header.samples)
+        state.row_bytes = state.row.view(np.uint8).data
+        return True
+
+    def _late(self, state: _StreamState) -> bool:
+        state.late += 1
+        return False
+
+    def _filled(self, state: _StreamState, count: int):
+        state.filled += count
+        row, columns = state.row, state.columns
+        if row is None or columns is None or state.filled < len(row):
+            return
+        state.row = None
+        state.captures += 1
+        columns.commit(state.timestamp)
+        if self._listeners:
+            iq = IQData()
+            iq.iq = row
+            iq.ts_sec, iq.ts_nsec = divmod(state.timestamp, 1_000_000_000)
+            for listener in self._listeners:
+                listener(state.name, iq)
+
+    def _receive_udp(self, deadline: float, idle: float) -> bool:
+        buffer = bytearray(_MAX_DATAGRAM)
+        view = memoryview(buffer)
+        last = None
+        while not self._stop.is_set() and time.monotonic() < deadline:
+            try:
+                size = self._sock.recv_into(buffer)
+            except socket.timeout:
+                if last is not None and time.monotonic() - last > idle:
+                    return False
+                continue
+            last = time.monotonic()
+            if size < HEADER.itemsize:
+                continue
+            header = _Header._make(_HEADER_STRUCT.unpack_from(buffer))
+            if header.magic != MAGIC:
+                continue
+            self.packets += 1
+            self.bytes += size
+            if header.kind != DATA:
+                self._control(header, bytes(view[HEADER.itemsize : size]))
+                if self._streams and all(
+                    state.ended for state in self._streams.values()
+                ):
+                    return True
+                continue
+            state = self._state(header.stream)
+            if not self._start_capture(state, header):
+                continue
+            start = header.offset * SAMPLE_BYTES
+            state.row_bytes[start : start + header.length * SAMPLE_BYTES] = (
+                view[
+                    HEADER.itemsize : HEADER.itemsize
+                    + header.length * SAMPLE_BYTES
+                ]
+            )
+            self._filled(state, header.length)
+        return False
+
+    def _receive_tcp(self, deadline: float, idle: float) -> bool:
+        while True:
+            if self._stop.is_set() or time.monotonic() > deadline:
+                return False
+            try:
+                connection, _ = self._sock.accept()
+                break
+            except socket.timeout:
+                continue
+        with connection:
+            connection.settimeout(idle)
+            header_buffer = bytearray(HEADER.itemsize)
+            header_view = memoryview(header_buffer)
+            try:
+                while not self._stop.is_set() and time.monotonic() < deadline:
+                    if not _recv_exact(connection, header_view):
+                        return False
+                    header = _Header._make(
+                        _HEADER_STRUCT.unpack_from(header_buffer)
+                    )
+                    if header.magic != MAGIC:
+                        raise ValueError(
+                            "lost the packet framing of the TCP stream"
+                        )
+                    self.packets += 1
+                    self.bytes += HEADER.itemsize + header.length * (
+                        SAMPLE_BYTES if header.kind == DATA else 1
+                    )
+                    if header.kind != DATA:
+                        payload = bytearray(header.length)
+                        if not _recv_exact(connection, memoryview(payload)):
+                            return False
+                        self._control(header, bytes(payload))
+                        if all(state.ended for state in self._streams.values()):
+                            return True
+                        continue
+                    state = self._state(header.stream)
+                    start, size = (
+                        header.offset * SAMPLE_BYTES,
+                        header.length * SAMPLE_BYTES,
+                    )
+                    if not self._start_capture(state, header):
+                        # Skipped through scratch space
+                        for skip in range(0, size, self._scratch.nbytes):
+                            if not _recv_exact(
+                                connection,
+                                self._scratch[
+                                    : min(self._scratch.nbytes, size - skip)
+                                ],
+                            ):
+                                return False
+                        continue
+                    # Received straight into the capture
+                    if not _recv_exact(
+                        connection, state.row_bytes[start : start + size]
+                    ):
+                        return False
+                    self._filled(state, header.length)
+            except socket.timeout:
+                return False
+        return False
+
+    def run(self, duration: float | None = None, idle: float = 5.0) -> bool:
+        """Receive until the sender ends every stream.
+
+        Receiving also ends when `duration` seconds pass, `stop` is called, or
+        no packet came for `idle` seconds after the first one. True if the
+        sender ended every stream.
+        """
+        if self.protocol == "udp" and self.receive_buffer < RECEIVE_BUFFER:
+            print_warning(
+                f"UDP receive buffer is {self.receive_buffer / 2**20:.1f} "
+                "MiB, packets may be lost at high rates. Raise "
+                "net.core.rmem_max, see `ares-iq doctor`"
+            )
+        deadline = time.monotonic() + duration if duration else float("inf")
+        wall, cpu = time.perf_counter(), time.thread_time()
+        try:
+            receive = (
+                self._receive_udp
+                if self.protocol == "udp"
+                else self._receive_tcp
+            )
+            with placed_thread("writer"):
+                ended = receive(deadline, idle)
+        finally:
+            self.seconds += time.perf_counter() - wall
+            self.cpu_seconds += time.thread_time() - cpu
+            self._sock.close()
+        for state in self._streams.values():
+            self._give_up(state)
+        return ended
+
+    def stats(self) -> dict[str, StreamStats]:
+        return {
+            state.name: StreamStats(
+                state.captures, state.lost, state.incomplete, state.late
+            )
+            for state in self._streams.values()
+        }
+
+    def _chunks(self) -> dict[str, tuple[_Columns, dict]]:
+        chunks: dict[str, tuple[_Columns, dict]] = {}
+        if not self._keep:
+            return chunks
+        for state in self._streams.values():
+            parts = list(state.chunks)
+            if state.columns is not None and state.columns.count:
+                parts.append((state.columns, state.metadata))
+            if len(parts) == 1:
+                chunks[state.name] = parts[0]
+                continue
+            for i, part in enumerate(parts):
+                chunks[f"{state.name}-{i}"] = part
+        return chunks
+
+    @property
+    def streams(
+        self,
+    ) -> dict[str, tuple[npt.NDArray[np.complex64], npt.NDArray[np.int64]]]:
+        """Samples and timestamps of the complete captures of each stream.
+
+        Empty unless `keep`. A stream whose capture size changed is split into
+        `<stream>-0`, `<stream>-1`, ... one per size, in the order received.
+        """
+        return {
+            name: (columns.iq[: columns.count], columns.ts[: columns.count])
+            for name, (columns, _) in self._chunks().items()
+        }
+
+    @property
+    def metadata(self) -> dict[str, dict]:
+        """Stream metadata sent by the sender.
+
+        Final once the sender ended the streams.
+        """
+        return {state.name: state.metadata for state in self._streams.values()}
+
+
+def save_received(
+    receiver: NetworkReceiver, tag: str | None = None
+) -> list[Path]:
+    """Save each received stream to its own file like `capture --save`."""
+    return [
+        _save_file(
+            columns.iq[: columns.count],
+            columns.ts[: columns.count],
+            tag=f"{tag}-{name}" if tag else name,
+            metadata=metadata,
+        )
+        for name, (columns, metadata) in receiver._chunks().items()
+    ]
@@ -1,2 +1,9 @@
 from .console_print import print_error, print_warning
-from .progress_bars import CaptureProgress
+from .progress_bars import CaptureProgress, MultiCaptureProgress
+
+__all__ = [
+    "print_error",
+    "print_warning",
+    "CaptureProgress",
+    "MultiCaptureProgress",
+]
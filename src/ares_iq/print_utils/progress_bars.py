@@ -1,20 +1,43 @@
 from rich.progress import Progress, TextColumn, TaskProgressColumn, TimeElapsedColumn, BarColumn
+from rich.console import RenderableType
 import datetime as dt
 
 
+class _ProgressWithExtras(Progress):
+    """Progress bars with live renderables, like a spectrum monitor, below."""
+
+    def __init__(self, *columns, extra: list[RenderableType] | None = None):
+        # Set before the base class starts rendering
+        self._extra = extra or []
+        super().__init__(*columns)
+
+    def get_renderables(self):
+        yield self.make_tasks_table(self.tasks)
+        yield from self._extra
+
+
 class CaptureProgress:
-    def __init__(self, captures: int, samples_per_capture: int, hide: bool = False):
+    def __init__(
+        self,
+        captures: int,
+        samples_per_capture: int,
+        hide: bool = False,
+        extra: list[RenderableType] | None = None,
+    ):
         if hide:
             self._hide = True
             return
         self._hide = False
         self._samples_captured = 0
         self._samples_per_capture = samples_per_capture
-        self._progress = Progress(TextColumn("Capturing..."),
-                                  BarColumn(),
-                                  TaskProgressColumn(),
-                                  TextColumn("[magenta]([progress.description]{task.description})"),
-                                  TimeElapsedColumn())
+        self._progress = _ProgressWithExtras(
+            TextColumn("Capturing..."),
+            BarColumn(),
+            TaskProgressColumn(),
+            TextColumn("[magenta]([progress.description]{task.description})"),
+            TimeElapsedColumn(),
+            extra=extra,
+        )
         self._task = self._progress.add_task("[magenta]0.0 megasamples/second", total=captures * samples_per_capture)
         self._start = None
 
@@ -28,10 +51,76 @@ class CaptureProgress:
         if not self._hide:
             self._progress.stop()
 
-    def update(self):
+    def update(self, captures: int = 1):
         if self._hide:
             return
-        self._samples_captured += self._samples_per_capture
+        self._samples_captured += captures * self._samples_per_capture
         time_diff = (dt.datetime.now() - self._start).total_seconds()
         rate = f"{self._samples_captured / time_diff / 1e6:.2f} megasamples/second"
         self._progress.update(self._task, completed=self._samples_captured, description=rate)
+
+
+class MultiCaptureProgress:
+    """Progress of the captures of several streams, one bar per stream."""
+
+    def __init__(
+        self,
+        streams: dict[str, int],
+        samples_per_capture: int,
+        hide: bool = False,
+        extra: list[RenderableType] | None = None,
+    ):
+        if hide:
+            self._hide = True
+            return
+        self._hide = False
+        self._samples_per_capture = samples_per_capture
+        self._samples_captured = {stream: 0 for stream in streams}
+        self._lost = {stream: 0 for stream in streams}
+        self._progress = _ProgressWithExtras(
+            TextColumn("{task.fields[stream]}"),
+            BarColumn(),
+            TaskProgressColumn(),
+            TextColumn("[magenta]([progress.description]{task.description})"),
+            TextColumn("[red]{task.fields[lost]}"),
+            TimeElapsedColumn(),
+            extra=extra,
+        )
+        self._tasks = {
+            stream: self._progress.add_task(
+                "[magenta]0.0 megasamples/second",
+                total=captures * samples_per_capture,
+                stream=stream,
+                lost="",
+            )
+            for stream, captures in streams.items()
+        }
+        self._start = dt.datetime.now()
+
+    def __enter__(self):
+        """Draw the progress until the block exits."""
+        if not self._hide:
+            self._progress.start()
+            self._start = dt.datetime.now()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        """Stop drawing the progress."""
+        if not self._hide:
+            self._progress.stop()
+
+    def update(self, stream: str, lost: bool = False):
+        if self._hide:
+            return
+        self._samples_captured[stream] += self._samples_per_capture
+        self._lost[stream] += lost
+        samples = self._samples_captured[stream]
+        time_diff = (dt.datetime.now() - self._start).total_seconds()
+        rate = f"{samples / time_diff / 1e6:.2f} megasamples/second"
+        lost_desc = f"{self._lost[stream]} lossy" if self._lost[stream] else ""
+        self._progress.update(
+            self._tasks[stream],
+            completed=samples,
+            description=rate,
+            lost=lost_desc,
+        )
@@ -0,0 +1,281 @@
+"""Rational resampling and frequency shifting of saved captures."""
+
+import math
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from typing import NamedTuple
+
+import h5py
+import numpy as np
+import numpy.typing as npt
+from rich.progress import Progress
+
+from .affinity import get_placement, pin_cpus
+from .catalog import register_files
+from .print_utils import print_error
+
+# Input samples read per chunk and outputs computed per matrix product. These
+# bound the memory of each worker.
+CHUNK_SAMPLES = 1 << 22
+OUTPUT_BATCH = 8192
+
+
+class ResampleSettings(NamedTuple):
+    """Rational resampling by `up / down`."""
+
+    up: int = 1
+    down: int = 1
+    shift: float = 0.0
+    """Frequency moved to DC in Hz"""
+    half_length: int = 10
+    """Half length of the anti-aliasing filter in multiples of max(up, down)"""
+
+
+class PolyphaseResampler:
+    """Streaming rational resampler by `up / down`.
+
+    The signal can be shifted in frequency first. The Kaiser windowed sinc
+    filter is split into `up` phases and each output is the dot product of one
+    phase with the last input samples, computed for all outputs of a chunk
+    sharing a phase at once. The filter history and
+    the shift phase carry over between calls to `process`, so a signal can be
+    processed in chunks of any size.
+    """
+
+    def __init__(
+        self, up: int, down: int, shift: float = 0.0, half_length: int = 10
+    ):
+        """Design the filter.
+
+        :param up: Upsampling factor.
+        :param down: Downsampling factor.
+        :param shift: Frequency moved to DC in cycles per input sample.
+        :param half_length: Half length of the filter in multiples of max(up,
+        down).
+        """
+        gcd = math.gcd(up, down)
+        self.up, self.down = up // gcd, down // gcd
+        self.shift = shift
+        half = half_length * max(self.up, self.down)
+        self.taps = math.ceil((2 * half + 1) / self.up)
+        self.delay = half / self.up
+        """Group delay of the filter in input samples"""
+
+        # Padded with zeros to a whole number of taps per phase
+        cutoff = 0.5 / max(self.up, self.down)
+        h = np.zeros(self.taps * self.up)
+        n = np.arange(2 * half + 1)
+        h[: len(n)] = (
+            2
+            * cutoff
+            * self.up
+            * np.sinc(2 * cutoff * (n - half))
+            * np.kaiser(len(n), 5.0)
+        )
+        # bank[p] holds phase p reversed so it lines up with an ascending window
+        # of input samples
+        self._bank = np.ascontiguousarray(
+            h.reshape(self.taps, self.up)[::-1].T, dtype=np.float32
+        )
+
+        self._history = np.zeros(self.taps - 1, dtype=np.complex64)
+        self._consumed = 0
+        self._next_output = 0
+        self._shift_phase = 0.0
+
+    def process(
+        self, x: npt.NDArray[np.complex64]
+    ) -> npt.NDArray[np.complex64]:
+        if self.shift:
+            rotation = np.exp(
+                -2j
+                * np.pi
+                * (self._shift_phase + self.shift * np.arange(len(x)))
+            )
+            x = (x * rotation).astype(np.complex64)
+            self._shift_phase = (self._shift_phase + self.shift * len(x)) % 1
+        buffer = np.concatenate(
+            (self._history, x.astype(np.complex64, copy=False))
+        )
+        consumed_before = self._consumed
+        self._consumed += len(x)
+        self._history = buffer[len(buffer) - (self.taps - 1) :]
+
+        # Outputs n whose newest input sample floor(n * down / up) has been
+        # received
+        last_output = (self._consumed * self.up - 1) // self.down
+        count = max(0, last_output - self._next_output + 1)
+        out = np.empty(count, dtype=np.complex64)
+        windows = np.lib.stride_tricks.sliding_window_view(buffer, self.taps)
+        for residue in range(min(self.up, count)):
+            # Every up-th output uses the same phase and windows down samples
+            # apart
+            n = self._next_output + residue
+            phase = (n * self.down) % self.up
+            first_window = (n * self.down) // self.up - consumed_before
+            outputs = out[residue :: self.up]
+            for start in range(0, len(outputs), OUTPUT_BATCH):
+                stop = min(start + OUTPUT_BATCH, len(outputs))
+                batch = windows[
+                    first_window + start * self.down : first_window
+                    + stop * self.down : self.down
+                ]
+                outputs[start:stop] = batch @ self._bank[phase]
+        self._next_output += count
+        return out
+
+    def flush(self) -> npt.NDArray[np.complex64]:
+        """Push the samples still in the filter out with zeros."""
+        return self.process(np.zeros(math.ceil(self.delay), dtype=np.complex64))
+
+
+def _input_rate(f: h5py.File) -> float:
+    if "rate" in f.attrs:
+        return float(f.attrs["rate"])
+    ts = f["iq_ts"][:].reshape(-1)
+    if len(ts) < 2:
+        raise ValueError(
+            f"{f.filename} has no rate attribute and too few captures to "
+            "estimate it"
+        )
+    return f["iq_data"].shape[1] * 1e9 / float(np.median(np.diff(ts)))
+
+
+def _output_timestamps(
+    rows: npt.NDArray[np.int64],
+    row_samples: int,
+    in_ts: npt.NDArray[np.int64],
+    spc: int,
+    rate: float,
+    resampler: PolyphaseResampler,
+) -> npt.NDArray[np.int64]:
+    """Time of the first sample of each output row.
+
+    Taken from the input capture the row originates from.
+    """
+    origin = (
+        rows * row_samples * resampler.down / resampler.up - resampler.delay
+    )
+    capture = np.clip(
+        np.floor(origin / spc).astype(np.int64), 0, len(in_ts) - 1
+    )
+    return in_ts[capture] + np.round(
+        (origin - capture * spc) * 1e9 / rate
+    ).astype(np.int64)
+
+
+def resample_file(
+    path: Path, out_path: Path, settings: ResampleSettings
+) -> Path:
+    """Resample a capture file into `out_path` chunk by chunk.
+
+    Each output row holds a whole number of captures.
+    """
+    with h5py.File(path, "r") as f, h5py.File(out_path, "w") as out:
+        iq_data = f["iq_data"]
+        in_ts = f["iq_ts"][:].reshape(-1)
+        captures, spc = iq_data.shape
+        rate = _input_rate(f)
+        resampler = PolyphaseResampler(
+            settings.up,
+            settings.down,
+            settings.shift / rate,
+            settings.half_length,
+        )
+
+        # Smallest number of captures that resamples to a whole number of
+        # samples
+        group = resampler.down // math.gcd(spc * resampler.up, resampler.down)
+        row_samples = group * spc * resampler.up // resampler.down
+        out_data = out.create_dataset(
+            "iq_data",
+            shape=(0, row_samples),
+            maxshape=(None, row_samples),
+            chunks=(1, row_samples),
+            dtype=np.complex64,
+        )
+
+        attrs = dict(f.attrs)
+        attrs["rate"] = rate * resampler.up / resampler.down
+        if "center" in attrs:
+            attrs["center"] = float(attrs["center"]) + settings.shift
+        if "bandwidth" in attrs:
+            attrs["bandwidth"] = min(float(attrs["bandwidth"]), attrs["rate"])
+        attrs.update(
+            {
+                "resample_up": resampler.up,
+                "resample_down": resampler.down,
+                "resample_shift": settings.shift,
+                "resample_delay": resampler.delay / rate,
+            }
+        )
+        out.attrs.update(attrs)
+
+        pending = np.empty(0, dtype=np.complex64)
+        chunk_rows = max(1, CHUNK_SAMPLES // spc)
+        for start in range(0, captures + chunk_rows, chunk_rows):
+            if start < captures:
+                samples = resampler.process(
+                    iq_data[start : start + chunk_rows].reshape(-1)
+                )
+            else:
+                samples = resampler.flush()
+            pending = np.concatenate((pending, samples))
+            rows = len(pending) // row_samples
+            if rows:
+                out_data.resize(len(out_data) + rows, axis=0)
+                out_data[-rows:] = pending[: rows * row_samples].reshape(
+                    rows, row_samples
+                )
+                pending = pending[rows * row_samples :]
+
+        rows = np.arange(len(out_data), dtype=np.int64)
+        out.create_dataset(
+            "iq_ts",
+            data=_output_timestamps(
+                rows, row_samples, in_ts, spc, rate, resampler
+            ).reshape(-1, 1),
+        )
+    return out_path
+
+
+def resample_files(
+    paths: list[Path],
+    out_paths: list[Path],
+    settings: ResampleSettings,
+    jobs: int | None = None,
+    hide: bool = False,
+) -> list[Path]:
+    """Resample each file on a pool of `jobs` processes.
+
+    Each file is processed by one worker.
+    """
+    for path in paths:
+        with h5py.File(path, "r") as f:
+            if "iq_data" not in f or "iq_ts" not in f:
+                print_error(f"{path} is not an ares-iq capture file")
+    done = []
+    # Spawned rather than forked since HDF5 isn't fork safe
+    with (
+        ProcessPoolExecutor(
+            jobs,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=pin_cpus,
+            initargs=(get_placement().worker_cpus,),
+        ) as pool,
+        Progress(transient=hide, disable=hide) as progress,
+    ):
+        bar = progress.add_task("resample", total=len(paths))
+        futures = [
+            pool.submit(resample_file, path, out_path, settings)
+            for path, out_path in zip(paths, out_paths)
+        ]
+        for future in as_completed(futures):
+            try:
+                done.append(future.result())
+            except ValueError as e:
+                print_error(str(e))
+            progress.advance(bar)
+    register_files(done)
+    return done
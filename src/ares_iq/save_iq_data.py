@@ -1,27 +1,260 @@
-from .print_utils import print_warning
-from .iq_data import IQData
-import numpy as np
-import h5py
 import datetime as dt
+import itertools
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
 from pathlib import Path
 
+import h5py
+import numpy as np
+
+from .affinity import place_current_thread
+from .capture_stats import CaptureStats, write_stats
+from .catalog import register_files
+from .codec import IQCodec, from_int16, int16_scale, to_int16
+from .iq_data import IQData
+from .print_utils import print_warning
+from .typing import SoftwareDefinedRadio
 
 SAVE_DIR = Path.cwd() / "ares-iq-data"
+# Captures converted to int16 and compressed at once
+COMPRESS_BATCH = 64
 
 
-def _save_file(iq, ts):
-    fname = f"capture-{dt.datetime.now().strftime('%Y%m%d-%H%M%S')}.h5"
+def _new_file_path(tag: str | None = None, prefix: str = "capture") -> Path:
+    fname = f"{prefix}-{dt.datetime.now().strftime('%Y%m%d-%H%M%S')}"
+    if tag is not None:
+        fname += f"-{tag}"
     SAVE_DIR.mkdir(exist_ok=True)
-    with h5py.File(SAVE_DIR / fname, "w") as f:
+    # Back to back captures (sweeps, daemon jobs) can finish within the same
+    # second
+    suffix = ""
+    for i in itertools.count(1):
+        if not (SAVE_DIR / f"{fname}{suffix}.h5").exists():
+            break
+        suffix = f"-{i}"
+    return SAVE_DIR / f"{fname}{suffix}.h5"
+
+
+def _save_file(
+    iq,
+    ts,
+    tag: str | None = None,
+    metadata: dict | None = None,
+    stats: dict | None = None,
+) -> Path:
+    path = _new_file_path(tag)
+    with h5py.File(path, "w") as f:
         f.create_dataset("iq_data", data=iq)
         f.create_dataset("iq_ts", data=ts)
+        if metadata:
+            f.attrs.update(metadata)
+        if stats:
+            write_stats(f, stats)
+    register_files([path])
+    return path
+
+
+def _save_compressed_file(
+    iq,
+    ts,
+    codec: IQCodec,
+    tag: str | None = None,
+    metadata: dict | None = None,
+    stats: dict | None = None,
+) -> Path:
+    """Save the captures as int16 compressed by `codec`.
+
+    Each capture is an independently decodable block of the `iq_blocks`
+    dataset. `load_iq_data` reads both layouts.
+    """
+    path = _new_file_path(tag)
+    scale, exact = int16_scale(iq)
+    with h5py.File(path, "w") as f:
+        blocks = f.create_dataset(
+            "iq_blocks", shape=(len(iq),), dtype=h5py.vlen_dtype(np.uint8)
+        )
+        for start in range(0, len(iq), COMPRESS_BATCH):
+            for i, block in enumerate(
+                codec.encode(
+                    to_int16(iq[start : start + COMPRESS_BATCH], scale)
+                ),
+                start,
+            ):
+                blocks[i] = np.frombuffer(block, dtype=np.uint8)
+        f.create_dataset("iq_ts", data=ts)
+        if metadata:
+            f.attrs.update(metadata)
+        f.attrs.update(
+            {
+                "iq_codec": "int16-blocks",
+                "iq_scale": scale,
+                "iq_exact": exact,
+                "samples_per_capture": iq.shape[1],
+            }
+        )
+        if stats:
+            write_stats(f, stats)
+    register_files([path])
+    return path
 
 
-def save_iq_data(data: list[IQData]):
+def save_iq_data(
+    data: list[IQData],
+    tag: str | None = None,
+    metadata: dict | None = None,
+    codec: IQCodec | None = None,
+    stats: dict | None = None,
+) -> Path | None:
+    """Save the captures to a new file, compressed by `codec` if given."""
     if not data:
-        return
+        return None
     print_warning("TODO: I'm not sure if this is a good way to store data. Will likely factor data saving into a separate repo maintained by Tianshu...")
     ts = np.vstack([np.int64(iq.ts_sec * int(1e9)) + np.int64(iq.ts_nsec) for iq in data])
     iq = np.vstack([iq_.iq for iq_ in data])
 
-    _save_file(iq, ts)
+    if codec is not None:
+        return _save_compressed_file(iq, ts, codec, tag, metadata, stats)
+    return _save_file(iq, ts, tag, metadata, stats)
+
+
+def load_iq_data(
+    path: Path,
+    start: int = 0,
+    stop: int | None = None,
+    codec: IQCodec | None = None,
+) -> tuple[np.ndarray, np.ndarray]:
+    """Read captures `start` to `stop` of a saved file, raw or compressed.
+
+    :return: The IQ with shape (captures, samples per capture) and the
+    timestamps in ns.
+    """
+    with h5py.File(path, "r") as f:
+        ts = f["iq_ts"][start:stop].reshape(-1)
+        if "iq_blocks" not in f:
+            return f["iq_data"][start:stop], ts
+        blocks = f["iq_blocks"][start:stop]
+        scale = float(f.attrs["iq_scale"])
+    if not len(blocks):
+        return np.empty((0, 0), dtype=np.complex64), ts
+    if codec is None:
+        with IQCodec() as codec:
+            return from_int16(codec.decode(blocks), scale), ts
+    return from_int16(codec.decode(blocks), scale), ts
+
+
+def save_streams(
+    platform: SoftwareDefinedRadio,
+    tag: str | None = None,
+    codec: IQCodec | None = None,
+    stats: CaptureStats | None = None,
+) -> list[Path]:
+    """Save each stream of the last capture to its own file.
+
+    Streams are only tagged if there is more than one. The statistics `stats`
+    computed of the captures are saved with them.
+    """
+    return _save_streams(
+        platform.iq_streams, platform.stream_metadata, tag, codec, stats
+    )
+
+
+def _save_streams(
+    streams: dict[str, list[IQData]],
+    metadata: dict[str, dict],
+    tag: str | None,
+    codec: IQCodec | None = None,
+    stats: CaptureStats | None = None,
+) -> list[Path]:
+    paths = []
+    for stream, data in streams.items():
+        tags = [
+            t
+            for t in (tag, stream if len(streams) > 1 else None)
+            if t is not None
+        ]
+        stream_stats = None
+        if stats is not None:
+            ts = np.array(
+                [iq.ts_sec * 1_000_000_000 + iq.ts_nsec for iq in data],
+                dtype=np.int64,
+            )
+            stream_stats = stats.for_timestamps(stream, ts)
+        path = save_iq_data(
+            data,
+            "-".join(tags) if tags else None,
+            metadata.get(stream),
+            codec,
+            stream_stats,
+        )
+        if path is not None:
+            paths.append(path)
+    return paths
+
+
+class PipelinedWriter:
+    """Saves captures on a background thread.
+
+    The next capture can run while the previous one is flushed. `depth` must not
+    exceed the number of buffers reserved on the platform, since a capture's
+    buffer is reused `depth` captures later. The statistics `stats` of the
+    captures are saved with them, so they must be computed (`CaptureStats.wait`)
+    before a capture is submitted.
+    """
+
+    def __init__(
+        self,
+        depth: int = 2,
+        codec: IQCodec | None = None,
+        stats: CaptureStats | None = None,
+    ):
+        self._depth = depth
+        self._codec = codec
+        self._stats = stats
+        self._executor = ThreadPoolExecutor(
+            max_workers=1,
+            thread_name_prefix="writer",
+            initializer=place_current_thread,
+            initargs=("writer",),
+        )
+        self._pending: deque[Future] = deque()
+
+    def __enter__(self):
+        """Save captures until the block exits."""
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        """Wait for the pending saves."""
+        self.close()
+
+    def wait_for_buffer(self) -> list[Path]:
+        """Block until the buffer of the next capture is no longer written.
+
+        :return: The saved files.
+        """
+        paths = []
+        while self._pending and (
+            self._pending[0].done() or len(self._pending) >= self._depth
+        ):
+            paths += self._pending.popleft().result()
+        return paths
+
+    def submit(
+        self, platform: SoftwareDefinedRadio, tag: str | None = None
+    ) -> Future:
+        future = self._executor.submit(
+            _save_streams,
+            dict(platform.iq_streams),
+            dict(platform.stream_metadata),
+            tag,
+            self._codec,
+            self._stats,
+        )
+        self._pending.append(future)
+        return future
+
+    def close(self) -> list[Path]:
+        paths = []
+        while self._pending:
+            paths += self._pending.popleft().result()
+        self._executor.shutdown()
+        return paths
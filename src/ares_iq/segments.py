@@ -0,0 +1,276 @@
+"""Recordings written as rotating segment files with an index."""
+
+import json
+import os
+import queue
+import threading
+from pathlib import Path
+from typing import Callable
+
+import h5py
+import numpy as np
+
+from .affinity import placed_thread
+from .capture_stats import CaptureStats, write_stats_sidecar
+from .catalog import register_files
+from .iq_data import IQData
+from .save_iq_data import _new_file_path
+
+INDEX_FILE = "index.json"
+
+
+def _plain(metadata: dict) -> dict:
+    return {
+        key: value.item() if isinstance(value, np.generic) else value
+        for key, value in metadata.items()
+    }
+
+
+class _Segment:
+    def __init__(
+        self,
+        path: Path,
+        number: int,
+        first_sample: int,
+        first_ts: int,
+        samples_per_capture: int,
+        metadata: dict,
+    ):
+        self.path = path
+        self.number = number
+        self.first_sample = first_sample
+        self.first_ts = first_ts
+        self.last_capture_ts = first_ts
+        self.captures = 0
+        self.samples_per_capture = samples_per_capture
+        self.timestamps: list[int] = []
+        self.file = h5py.File(path, "w")
+        self.file.create_dataset(
+            "iq_data",
+            shape=(0, samples_per_capture),
+            maxshape=(None, samples_per_capture),
+            chunks=(1, samples_per_capture),
+            dtype=np.complex64,
+        )
+        self.file.create_dataset(
+            "iq_ts", shape=(0, 1), maxshape=(None, 1), dtype=np.int64
+        )
+        # Written up front so a closed segment is complete on its own
+        self.file.attrs.update(metadata)
+        self.file.attrs.update(
+            {"segment": number, "first_sample": first_sample}
+        )
+
+    @property
+    def nbytes(self) -> int:
+        return (
+            self.captures
+            * self.samples_per_capture
+            * np.dtype(np.complex64).itemsize
+        )
+
+    def append(self, iq: np.ndarray, ts: int):
+        self.file["iq_data"].resize(self.captures + 1, axis=0)
+        self.file["iq_data"][-1] = iq
+        self.file["iq_ts"].resize(self.captures + 1, axis=0)
+        self.file["iq_ts"][-1] = ts
+        self.captures += 1
+        self.last_capture_ts = ts
+        self.timestamps.append(ts)
+
+    def close(self) -> dict:
+        self.file.close()
+        return {
+            "file": self.path.name,
+            "first_sample": self.first_sample,
+            "samples": self.captures * self.samples_per_capture,
+            "captures": self.captures,
+            "first_ts": self.first_ts,
+            "last_capture_ts": self.last_capture_ts,
+        }
+
+
+class SegmentedWriter:
+    """Capture listener that writes each stream to rotating segment files.
+
+    The segments of a recording are in a directory and are written while the
+    capture runs. A segment is closed once it holds `segment_gb` GB or spans
+    `segment_seconds` seconds, and `index.json` is rewritten with the sample and
+    timestamp range of every closed segment, so other jobs can pick up closed
+    segments before the recording ends. Samples are numbered per stream from the
+    start of the recording. Closed segments are never reopened, so readers can
+    keep them open.
+    :param metadata: Returns the stream metadata, e.g. `lambda:
+    platform.stream_metadata`. It is looked up when the first segment of a
+    stream is created and written to the index and to every segment of the
+    stream.
+    """
+
+    def __init__(
+        self,
+        segment_gb: float | None = None,
+        segment_seconds: float | None = None,
+        tag: str | None = None,
+        max_queued: int = 64,
+        metadata: Callable[[], dict[str, dict]] | None = None,
+    ):
+        self._segment_bytes = segment_gb * 1e9 if segment_gb else np.inf
+        self._segment_ns = segment_seconds * 1e9 if segment_seconds else np.inf
+        self.directory = _new_file_path(tag, prefix="recording").with_suffix("")
+        self._max_queued = max_queued
+        self._metadata = metadata
+        self._queue: queue.Queue = queue.Queue(maxsize=max_queued)
+        self._segments: dict[str, _Segment] = {}
+        self._next_sample: dict[str, int] = {}
+        self._index: dict = {"complete": False, "streams": {}}
+        self._timestamps: dict[str, list[int]] = {}
+        self._dropped: dict[str, int] = {}
+        self._thread: threading.Thread | None = None
+
+    def __enter__(self):
+        """Start writing segments until the block exits."""
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        """Write what is queued and close the last segments."""
+        self.stop()
+
+    def start(self):
+        self.directory.mkdir(parents=True)
+        self._write_index()
+        self._thread = threading.Thread(
+            target=self._write, name="segment-writer", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+    def __call__(self, stream: str, iq: IQData):
+        try:
+            # Copied since the capture buffer is recycled
+            self._queue.put_nowait(
+                (stream, iq.iq.copy(), iq.ts_sec * 1_000_000_000 + iq.ts_nsec)
+            )
+        except queue.Full:
+            self._dropped[stream] = self._dropped.get(stream, 0) + 1
+
+    def _write_index(self):
+        # Replaced atomically so readers never see a partial index
+        tmp = self.directory / f".{INDEX_FILE}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(self._index, f, indent=1)
+        os.replace(tmp, self.directory / INDEX_FILE)
+
+    def _stream_entry(self, stream: str) -> dict:
+        if stream not in self._index["streams"]:
+            metadata = (
+                self._metadata().get(stream, {})
+                if self._metadata is not None
+                else {}
+            )
+            self._index["streams"][stream] = {
+                "segments": [],
+                "metadata": _plain(metadata),
+            }
+            self._write_index()
+        return self._index["streams"][stream]
+
+    def _close_segment(self, stream: str):
+        segment = self._segments.pop(stream)
+        self._stream_entry(stream)["segments"].append(segment.close())
+        self._timestamps[segment.path.name] = segment.timestamps
+        self._write_index()
+        register_files([segment.path])
+
+    def _segment_for(self, stream: str, samples: int, ts: int) -> _Segment:
+        segment = self._segments.get(stream)
+        if (
+            segment is not None
+            and segment.captures
+            and (
+                segment.nbytes + samples * np.dtype(np.complex64).itemsize
+                > self._segment_bytes
+                or ts - segment.first_ts >= self._segment_ns
+            )
+        ):
+            self._close_segment(stream)
+            segment = None
+        if segment is None:
+            entry = self._stream_entry(stream)
+            number = len(entry["segments"])
+            segment = _Segment(
+                self.directory / f"{stream}-{number:05d}.h5",
+                number,
+                self._next_sample.get(stream, 0),
+                ts,
+                samples,
+                entry["metadata"],
+            )
+            self._segments[stream] = segment
+        return segment
+
+    def _write(self):
+        with placed_thread("writer"):
+            try:
+                while (item := self._queue.get()) is not None:
+                    stream, iq, ts = item
+                    self._segment_for(stream, len(iq), ts).append(iq, ts)
+                    self._next_sample[stream] = self._next_sample.get(
+                        stream, 0
+                    ) + len(iq)
+            finally:
+                for stream in list(self._segments):
+                    self._close_segment(stream)
+
+    def finalize(
+        self, metadata: dict[str, dict], stats: CaptureStats | None = None
+    ):
+        """Update the index with the final stream metadata.
+
+        The recording is marked complete. The capture statistics `stats` of each
+        segment go to a `.stats.npz` sidecar, since closed segments aren't
+        rewritten. Call after `stop`.
+        """
+        for stream, entry in self._index["streams"].items():
+            entry["metadata"] = (
+                _plain(metadata.get(stream, {})) or entry["metadata"]
+            )
+            if stats is not None:
+                for segment in entry["segments"]:
+                    timestamps = np.array(
+                        self._timestamps.get(segment["file"], []),
+                        dtype=np.int64,
+                    )
+                    write_stats_sidecar(
+                        self.directory / segment["file"],
+                        stats.for_timestamps(stream, timestamps),
+                    )
+        self._index["complete"] = True
+        self._write_index()
+        if stats is not None:
+            # Again, now with the statistics
+            register_files(
+                self.directory / segment["file"]
+                for entry in self._index["streams"].values()
+                for segment in entry["segments"]
+            )
+
+    @property
+    def dropped(self) -> dict[str, int]:
+        return dict(self._dropped)
+
+
+def read_segment_index(directory: Path) -> dict:
+    """The index of a segmented recording.
+
+    `streams` maps each stream to its closed `segments`, each with `file`,
+    `first_sample`, `samples`, `captures`, `first_ts` and `last_capture_ts`
+    (ns). `complete` is set once the recording has ended.
+    """
+    with open(directory / INDEX_FILE) as f:
+        return json.load(f)
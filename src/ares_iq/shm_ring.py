@@ -0,0 +1,292 @@
+"""Shared memory rings handing captures to other processes."""
+
+import mmap
+import sys
+import time
+from multiprocessing import resource_tracker, shared_memory
+from typing import Iterator, NamedTuple
+
+import numpy as np
+import numpy.typing as npt
+
+from .iq_data import IQData
+
+MAGIC = int.from_bytes(b"ARESRING", "little")
+VERSION = 1
+# Header words
+_MAGIC, _VERSION, _SLOTS, _SAMPLES, _WRITE_SEQ, _CLOSED, _DATA_OFFSET = range(7)
+HEADER_WORDS = 8
+# Slot words
+_SEQ, _TS = range(2)
+SLOT_WORDS = 2
+_EMPTY = -1
+
+
+def ring_name(name: str, stream: str) -> str:
+    """Shared memory name of the ring of `stream`."""
+    return f"{name}-{stream}"
+
+
+class SharedRing:
+    """Ring of captures of one stream in a shared memory segment.
+
+    The segment holds:
+    - header: magic, version, slots, samples per slot, sequence of the next
+    write, closed flag, data offset
+    - slots: sequence and timestamp in ns of each slot. The sequence is -1 while
+    the slot is written
+    - data: page aligned complex64 samples of each slot
+    Capture `n` is in slot `n % slots` until it is overwritten by capture `n +
+    slots`.
+    """
+
+    def __init__(self, shm: shared_memory.SharedMemory):
+        self.shm = shm
+        self.header: npt.NDArray[np.int64] = np.ndarray(
+            HEADER_WORDS, dtype=np.int64, buffer=shm.buf
+        )
+        if self.header[_MAGIC] != MAGIC or self.header[_VERSION] != VERSION:
+            raise ValueError(f"{shm.name} is not an ares-iq ring")
+        self.slots = int(self.header[_SLOTS])
+        self.samples_per_slot = int(self.header[_SAMPLES])
+        self.meta: npt.NDArray[np.int64] = np.ndarray(
+            (self.slots, SLOT_WORDS),
+            dtype=np.int64,
+            buffer=shm.buf,
+            offset=HEADER_WORDS * 8,
+        )
+        self.data: npt.NDArray[np.complex64] = np.ndarray(
+            (self.slots, self.samples_per_slot),
+            dtype=np.complex64,
+            buffer=shm.buf,
+            offset=int(self.header[_DATA_OFFSET]),
+        )
+
+    @classmethod
+    def create(
+        cls, name: str, slots: int, samples_per_slot: int
+    ) -> "SharedRing":
+        offset = (
+            -(-(HEADER_WORDS + slots * SLOT_WORDS) * 8 // mmap.PAGESIZE)
+            * mmap.PAGESIZE
+        )
+        shm = shared_memory.SharedMemory(
+            name, create=True, size=offset + slots * samples_per_slot * 8
+        )
+        header: npt.NDArray[np.int64] = np.ndarray(
+            HEADER_WORDS, dtype=np.int64, buffer=shm.buf
+        )
+        header[:] = 0
+        header[[_SLOTS, _SAMPLES, _DATA_OFFSET]] = (
+            slots,
+            samples_per_slot,
+            offset,
+        )
+        np.ndarray(
+            (slots, SLOT_WORDS),
+            dtype=np.int64,
+            buffer=shm.buf,
+            offset=HEADER_WORDS * 8,
+        )[:, _SEQ] = _EMPTY
+        header[[_MAGIC, _VERSION]] = MAGIC, VERSION
+        return cls(shm)
+
+    @classmethod
+    def attach(cls, name: str) -> "SharedRing":
+        if sys.version_info >= (3, 13):
+            shm = shared_memory.SharedMemory(name, track=False)
+        else:
+            shm = shared_memory.SharedMemory(name)
+            # Before Python 3.13 attaching registers the segment to be unlinked
+            # when this process exits
+            resource_tracker.unregister(getattr(shm, "_name"), "shared_memory")
+        return cls(shm)
+
+    @property
+    def written(self) -> int:
+        """Sequence of the next capture written."""
+        return int(self.header[_WRITE_SEQ])
+
+    @property
+    def closed(self) -> bool:
+        return bool(self.header[_CLOSED])
+
+    def write(self, samples: npt.NDArray[np.complex64], timestamp: int):
+        sequence = self.written
+        slot = sequence % self.slots
+        self.meta[slot, _SEQ] = _EMPTY
+        self.data[slot] = samples
+        self.meta[slot, _TS] = timestamp
+        self.meta[slot, _SEQ] = sequence
+        self.header[_WRITE_SEQ] = sequence + 1
+
+    def close(self):
+        # The arrays must go before the segment can be unmapped
+        del self.header, self.meta, self.data
+        try:
+            self.shm.close()
+        except BufferError:
+            # Slots still referenced by the caller keep the segment mapped until
+            # they are freed
+            pass
+
+
+class SharedRingWriter:
+    """Capture listener that writes each stream to a shared memory ring.
+
+    A ring of `slots` captures, named `<name>-<stream>`, can be read by any
+    number of `SharedRingReader` processes. Rings are created on the first
+    capture of each stream and removed on `close`. Readers attached by then keep
+    their mapping.
+    """
+
+    def __init__(self, name: str, slots: int = 64):
+        self._name = name
+        self._slots = slots
+        self._rings: dict[str, SharedRing] = {}
+
+    def __enter__(self):
+        """Write captures until the block exits."""
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        """Close and remove the rings."""
+        self.close()
+
+    @property
+    def names(self) -> list[str]:
+        return [ring.shm.name for ring in self._rings.values()]
+
+    def __call__(self, stream: str, iq: IQData):
+        ring = self._rings.get(stream)
+        if ring is None:
+            ring = self._rings[stream] = SharedRing.create(
+                ring_name(self._name, stream), self._slots, len(iq.iq)
+            )
+        ring.write(iq.iq, iq.ts_sec * 1_000_000_000 + iq.ts_nsec)
+
+    def close(self):
+        for ring in self._rings.values():
+            ring.header[_CLOSED] = 1
+            shm = ring.shm
+            ring.close()
+            shm.unlink()
+        self._rings = {}
+
+
+class RingSlot(NamedTuple):
+    """A capture read from a ring."""
+
+    samples: npt.NDArray[np.complex64]
+    """View into the ring. Check `SharedRingReader.valid` after using it"""
+    timestamp: int
+    """Nanoseconds since the epoch"""
+    sequence: int
+    lapped: int
+    """Captures the reader missed right before this one because the writer
+    overwrote them
+    """
+
+
+class SharedRingReader:
+    """Reader of the ring of a stream written by `SharedRingWriter`.
+
+    The writer is usually another process and nothing is copied. Slots are views
+    into the ring, so a slow reader can have a slot overwritten while it uses it
+    (`valid`) and can be lapped, which is reported in `RingSlot.lapped` and
+    counted in `lapped`.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        oldest: bool = False,
+        poll: float = 0.001,
+        wait: float = 0,
+    ):
+        """Attach to the ring of a writer.
+
+        :param name: The ring name, `<name>-<stream>` of the writer.
+        :param oldest: Start from the oldest capture in the ring instead of the
+        next one written.
+        :param poll: Seconds between checks for new captures.
+        :param wait: Seconds to wait for the writer to create the ring, which
+        happens on the first capture.
+        """
+        deadline = time.monotonic() + wait
+        while True:
+            try:
+                self.ring = SharedRing.attach(name)
+                break
+            except (FileNotFoundError, ValueError):
+                # ValueError while the writer is still filling in the header
+                if time.monotonic() > deadline:
+                    raise
+                time.sleep(poll)
+        self._poll = poll
+        written = self.ring.written
+        self._next = (
+            max(0, written - self.ring.slots + 1) if oldest else written
+        )
+        self.lapped = 0
+
+    def __enter__(self):
+        """Read the ring until the block exits."""
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        """Detach from the ring."""
+        self.close()
+
+    def close(self):
+        self.ring.close()
+
+    def valid(self, slot: RingSlot) -> bool:
+        """Whether the samples of `slot` are still the capture read."""
+        return (
+            int(self.ring.meta[slot.sequence % self.ring.slots, _SEQ])
+            == slot.sequence
+        )
+
+    def read(self, timeout: float | None = None) -> RingSlot | None:
+        """Wait for the next capture.
+
+        None once the writer closed the ring and every capture was read.
+        :raises TimeoutError: If no capture was written within `timeout`
+        seconds.
+        """
+        ring = self.ring
+        deadline = None if timeout is None else time.monotonic() + timeout
+        missed = 0
+        while True:
+            written = ring.written
+            if self._next < written:
+                # The slot after the newest may be being overwritten
+                oldest = written - ring.slots + 1
+                if self._next < oldest:
+                    missed += oldest - self._next
+                    self._next = oldest
+                slot = self._next % ring.slots
+                timestamp = int(ring.meta[slot, _TS])
+                if int(ring.meta[slot, _SEQ]) != self._next:
+                    # Overwritten while reading
+                    missed += 1
+                    self._next += 1
+                    continue
+                self._next += 1
+                self.lapped += missed
+                return RingSlot(
+                    ring.data[slot], timestamp, self._next - 1, missed
+                )
+            if ring.closed:
+                return None
+            if deadline is not None and time.monotonic() > deadline:
+                raise TimeoutError(
+                    f"No capture written to {ring.shm.name} within {timeout} s"
+                )
+            time.sleep(self._poll)
+
+    def __iter__(self) -> Iterator[RingSlot]:
+        """Captures until the writer closes the ring."""
+        while (slot := self.read()) is not None:
+            yield slot
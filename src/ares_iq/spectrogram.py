@@ -0,0 +1,228 @@
+"""Spectrograms of saved captures computed on a process pool."""
+
+import multiprocessing
+import os
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from pathlib import Path
+from typing import Iterator, NamedTuple
+
+import h5py
+import numpy as np
+import numpy.typing as npt
+from rich.progress import Progress
+
+from .affinity import get_placement, pin_cpus
+from .print_utils import print_error
+
+# Input samples per pool task and per FFT batch inside a task. Together with the
+# number of tasks in flight these bound the memory use independently of the size
+# of the capture.
+TASK_SAMPLES = 1 << 23
+BLOCK_FRAMES = 2048
+FORMATS = ("float16", "uint8")
+
+
+class SpectrogramSettings(NamedTuple):
+    """Frames of `nfft` samples every `hop`, `average` frames per row."""
+
+    nfft: int = 1024
+    hop: int = 512
+    average: int = 1
+    fmt: str = "float16"
+    db_min: float = -140.0
+    db_max: float = 0.0
+
+
+class _Task(NamedTuple):
+    path: Path
+    frame_start: int
+    frame_stop: int
+
+
+def _frame_count(samples: int, settings: SpectrogramSettings) -> int:
+    if samples < settings.nfft:
+        return 0
+    frames = (samples - settings.nfft) // settings.hop + 1
+    return frames - frames % settings.average
+
+
+def _read_samples(
+    dset: h5py.Dataset, start: int, stop: int
+) -> npt.NDArray[np.complex64]:
+    spc = dset.shape[1]
+    first_row = start // spc
+    rows = dset[first_row : -(-stop // spc)].reshape(-1)
+    return rows[start - first_row * spc : stop - first_row * spc]
+
+
+def _quantize(
+    power: npt.NDArray[np.float32], settings: SpectrogramSettings
+) -> npt.NDArray:
+    db = 10 * np.log10(power + np.finfo(np.float32).tiny)
+    if settings.fmt == "float16":
+        return db.astype(np.float16)
+    scale = 255 / (settings.db_max - settings.db_min)
+    return np.clip(np.round((db - settings.db_min) * scale), 0, 255).astype(
+        np.uint8
+    )
+
+
+def _spectrogram_task(
+    task: _Task, settings: SpectrogramSettings
+) -> tuple[_Task, npt.NDArray, npt.NDArray[np.int64]]:
+    """Compute the output rows of a range of frames. Runs in a pool process."""
+    nfft, hop, average = settings.nfft, settings.hop, settings.average
+    window = np.hanning(nfft).astype(np.float32)
+    power = np.zeros(
+        ((task.frame_stop - task.frame_start) // average, nfft),
+        dtype=np.float32,
+    )
+
+    with h5py.File(task.path, "r") as f:
+        dset = f["iq_data"]
+        # The samples shared with the previous block are carried over instead of
+        # read again
+        carry = np.empty(0, dtype=np.complex64)
+        for block_start in range(
+            task.frame_start, task.frame_stop, BLOCK_FRAMES
+        ):
+            frames = min(BLOCK_FRAMES, task.frame_stop - block_start)
+            read_start = block_start * hop + len(carry)
+            samples = np.concatenate(
+                (
+                    carry,
+                    _read_samples(
+                        dset,
+                        read_start,
+                        (block_start + frames - 1) * hop + nfft,
+                    ),
+                )
+            )
+            segments = np.lib.stride_tricks.sliding_window_view(samples, nfft)[
+                ::hop
+            ][:frames]
+            spectra = np.fft.fft(segments * window, axis=-1)
+            block_power = (spectra.real**2 + spectra.imag**2).astype(np.float32)
+            carry = samples[frames * hop :]
+
+            rows = (
+                block_start - task.frame_start + np.arange(frames)
+            ) // average
+            first = np.flatnonzero(np.diff(rows, prepend=-1))
+            power[rows[first]] += np.add.reduceat(block_power, first, axis=0)
+
+        spc = dset.shape[1]
+        starts = (task.frame_start + np.arange(len(power)) * average) * hop
+        ts = f["iq_ts"][starts[0] // spc : starts[-1] // spc + 1].reshape(-1)
+        ts = ts[starts // spc - starts[0] // spc]
+        if "rate" in f.attrs:
+            ts = ts + np.round(
+                (starts % spc) * 1e9 / float(f.attrs["rate"])
+            ).astype(np.int64)
+
+    power /= average * np.sum(window**2)
+    return task, _quantize(np.fft.fftshift(power, axes=-1), settings), ts
+
+
+def _create_output(
+    path: Path, out_path: Path, settings: SpectrogramSettings
+) -> tuple[h5py.File, int]:
+    with h5py.File(path, "r") as f:
+        if "iq_data" not in f:
+            print_error(f"{path} has no iq_data dataset")
+        samples = f["iq_data"].shape[0] * f["iq_data"].shape[1]
+        attrs = dict(f.attrs)
+
+    frames = _frame_count(samples, settings)
+    out = h5py.File(out_path, "w")
+    rows = frames // settings.average
+    out.create_dataset(
+        "spectrogram",
+        shape=(rows, settings.nfft),
+        dtype=settings.fmt,
+        chunks=(max(1, min(rows, 256)), settings.nfft),
+    )
+    out.create_dataset("ts", shape=(rows,), dtype=np.int64)
+    freqs = np.fft.fftshift(np.fft.fftfreq(settings.nfft))
+    if "rate" in attrs:
+        freqs = freqs * float(attrs["rate"]) + float(attrs.get("center", 0))
+    out.create_dataset("freqs", data=freqs)
+    out.attrs.update(attrs)
+    out.attrs.update(
+        {
+            "nfft": settings.nfft,
+            "hop": settings.hop,
+            "average": settings.average,
+            "format": settings.fmt,
+        }
+    )
+    if settings.fmt == "uint8":
+        out.attrs.update({"db_min": settings.db_min, "db_max": settings.db_max})
+    return out, frames
+
+
+def _tasks(
+    path: Path, frames: int, settings: SpectrogramSettings
+) -> Iterator[_Task]:
+    # Multiples of the averaging length so no output row is split between tasks
+    task_frames = (
+        max(1, TASK_SAMPLES // settings.hop // settings.average)
+        * settings.average
+    )
+    for start in range(0, frames, task_frames):
+        yield _Task(path, start, min(start + task_frames, frames))
+
+
+def compute_spectrograms(
+    paths: list[Path],
+    out_paths: list[Path],
+    settings: SpectrogramSettings,
+    jobs: int | None = None,
+    hide: bool = False,
+):
+    """Write the spectrogram of each capture file to the matching output file.
+
+    Chunks of every file are spread over a pool of `jobs` processes, with at
+    most two chunks per process in flight.
+    """
+    jobs = jobs or os.cpu_count() or 1
+    outputs = {}
+    tasks: list[_Task] = []
+    try:
+        for path, out_path in zip(paths, out_paths):
+            outputs[path], frames = _create_output(path, out_path, settings)
+            tasks += _tasks(path, frames, settings)
+
+        # Spawned rather than forked since HDF5 isn't fork safe with files open
+        # in the parent
+        with (
+            ProcessPoolExecutor(
+                jobs,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=pin_cpus,
+                initargs=(get_placement().worker_cpus,),
+            ) as pool,
+            Progress(transient=hide, disable=hide) as progress,
+        ):
+            bar = progress.add_task("spectrogram", total=len(tasks))
+            max_pending = 2 * jobs
+            pending = set()
+            remaining = iter(tasks)
+            while True:
+                for task in remaining:
+                    pending.add(pool.submit(_spectrogram_task, task, settings))
+                    if len(pending) >= max_pending:
+                        break
+                if not pending:
+                    break
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    task, rows, ts = future.result()
+                    out = outputs[task.path]
+                    first_row = task.frame_start // settings.average
+                    out["spectrogram"][first_row : first_row + len(rows)] = rows
+                    out["ts"][first_row : first_row + len(ts)] = ts
+                    progress.advance(bar)
+    finally:
+        for out in outputs.values():
+            out.close()
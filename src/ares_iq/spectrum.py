@@ -0,0 +1,205 @@
+"""Live spectrum of each stream during a capture."""
+
+import queue
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+import numpy.typing as npt
+from rich.table import Table
+
+from .affinity import placed_thread
+from .iq_data import IQData
+
+SPARK_CHARS = " ▁▂▃▄▅▆▇█"
+WELCH_BATCH = 256
+
+
+def welch_psd(
+    iq: npt.NDArray[np.complex64], nfft: int = 1024, overlap: float = 0.5
+) -> npt.NDArray[np.float32]:
+    """Welch averaged power spectral density with a Hann window.
+
+    :param iq: The samples.
+    :param nfft: The FFT size of each segment.
+    :param overlap: Fraction of each segment overlapping the next.
+    :return: The PSD in linear power per bin, DC centered.
+    """
+    if len(iq) < nfft:
+        iq = np.pad(iq, (0, nfft - len(iq)))
+    step = max(1, int(nfft * (1 - overlap)))
+    segments = np.lib.stride_tricks.sliding_window_view(iq, nfft)[::step]
+    window = np.hanning(nfft).astype(np.float32)
+
+    # Batched so the windowed copy stays small for long captures
+    psd = np.zeros(nfft, dtype=np.float64)
+    for start in range(0, len(segments), WELCH_BATCH):
+        spectra = np.fft.fft(
+            segments[start : start + WELCH_BATCH] * window, axis=-1
+        )
+        psd += np.sum(spectra.real**2 + spectra.imag**2, axis=0)
+    psd /= len(segments) * np.sum(window**2)
+    return np.fft.fftshift(psd).astype(np.float32)
+
+
+def _sparkline(psd_db: npt.NDArray[np.float32], width: int) -> str:
+    bins = (
+        psd_db[: len(psd_db) - len(psd_db) % width]
+        .reshape(width, -1)
+        .max(axis=1)
+    )
+    low, high = bins.min(), bins.max()
+    levels = (
+        np.zeros(width, dtype=int)
+        if high <= low
+        else np.round(
+            (bins - low) / (high - low) * (len(SPARK_CHARS) - 1)
+        ).astype(int)
+    )
+    return "".join(SPARK_CHARS[level] for level in levels)
+
+
+class SpectrumMonitor:
+    """Live spectrum of the captures being recorded.
+
+    Register it as a capture listener. Completed captures are handed to a
+    consumer thread that computes a Welch PSD of each, so the acquisition thread
+    never waits on it. Captures are decimated to at most one every `interval`
+    seconds per stream, and frames arriving while the consumer is still busy are
+    dropped and counted.
+    """
+
+    def __init__(
+        self,
+        nfft: int = 1024,
+        interval: float = 0.25,
+        averaging: float = 0.3,
+        width: int = 64,
+        record: bool = False,
+    ):
+        self._nfft = nfft
+        self._interval = interval
+        self._averaging = averaging
+        self._width = min(width, nfft)
+        self._record = record
+        self._queue: queue.Queue = queue.Queue(maxsize=2)
+        self._lock = threading.Lock()
+        self._last_accepted: dict[str, float] = {}
+        self._psd: dict[str, npt.NDArray[np.float32]] = {}
+        self._frames: dict[str, list[tuple[int, npt.NDArray[np.float32]]]] = {}
+        self._processed: dict[str, int] = {}
+        self._dropped: dict[str, int] = {}
+        self._thread: threading.Thread | None = None
+
+    def __enter__(self):
+        """Start computing spectra until the block exits."""
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        """Stop the worker."""
+        self.stop()
+
+    def start(self):
+        self._thread = threading.Thread(
+            target=self._run, name="spectrum-monitor", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+    def __call__(self, stream: str, iq: IQData):
+        now = time.monotonic()
+        if now - self._last_accepted.get(stream, -np.inf) < self._interval:
+            return
+        self._last_accepted[stream] = now
+        try:
+            # Copied since the capture buffer is recycled once the capture
+            # finishes
+            self._queue.put_nowait(
+                (stream, iq.iq.copy(), iq.ts_sec * 1_000_000_000 + iq.ts_nsec)
+            )
+        except queue.Full:
+            with self._lock:
+                self._dropped[stream] = self._dropped.get(stream, 0) + 1
+
+    def _run(self):
+        with placed_thread("worker"):
+            while (frame := self._queue.get()) is not None:
+                stream, iq, ts = frame
+                psd = welch_psd(iq, self._nfft)
+                with self._lock:
+                    average = self._psd.get(stream)
+                    self._psd[stream] = (
+                        psd
+                        if average is None
+                        else (1 - self._averaging) * average
+                        + self._averaging * psd
+                    )
+                    self._processed[stream] = self._processed.get(stream, 0) + 1
+                    if self._record:
+                        self._frames.setdefault(stream, []).append((ts, psd))
+
+    @property
+    def dropped(self) -> dict[str, int]:
+        with self._lock:
+            return dict(self._dropped)
+
+    @property
+    def psd(self) -> dict[str, npt.NDArray[np.float32]]:
+        with self._lock:
+            return dict(self._psd)
+
+    def __rich__(self) -> Table:
+        """Table of the latest spectrum of every stream."""
+        table = Table(
+            box=None, show_header=True, header_style="bold", padding=(0, 1)
+        )
+        table.add_column("stream")
+        table.add_column("spectrum (DC centered)", no_wrap=True)
+        table.add_column("dB", justify="right")
+        table.add_column("frames", justify="right")
+        table.add_column("dropped", justify="right", style="red")
+        with self._lock:
+            for stream, psd in self._psd.items():
+                psd_db = 10 * np.log10(psd + np.finfo(np.float32).tiny)
+                table.add_row(
+                    stream,
+                    f"[cyan]{_sparkline(psd_db, self._width)}",
+                    f"{psd_db.min():.0f}..{psd_db.max():.0f}",
+                    str(self._processed[stream]),
+                    str(self._dropped.get(stream, 0)),
+                )
+        return table
+
+    def save(self, path: Path, metadata: dict[str, dict] | None = None):
+        """Dump the recorded PSD frames to a `.npz`.
+
+        Each stream has `<stream>_psd` (frames x nfft, linear power) and
+        `<stream>_ts` (ns) arrays. `freqs` holds the bin frequencies in cycles
+        per sample. If the stream metadata is given, `<stream>_center` and
+        `<stream>_rate` are stored as well to map the bins to absolute
+        frequencies.
+        """
+        arrays: dict[str, np.ndarray | np.generic] = {
+            "freqs": np.fft.fftshift(np.fft.fftfreq(self._nfft)).astype(
+                np.float32
+            )
+        }
+        with self._lock:
+            for stream, frames in self._frames.items():
+                arrays[f"{stream}_ts"] = np.array(
+                    [ts for ts, _ in frames], dtype=np.int64
+                )
+                arrays[f"{stream}_psd"] = np.vstack([psd for _, psd in frames])
+                for key in ("center", "rate"):
+                    if metadata is not None and key in metadata.get(stream, {}):
+                        arrays[f"{stream}_{key}"] = np.float64(
+                            metadata[stream][key]
+                        )
+        np.savez(path, **arrays)
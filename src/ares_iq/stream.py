@@ -0,0 +1,328 @@
+"""Streaming of captures to Python consumers in bounded batches."""
+
+import asyncio
+import queue
+import threading
+from typing import TYPE_CHECKING, AsyncIterator, Iterator, NamedTuple
+
+import numpy as np
+import numpy.typing as npt
+
+from .capture_budget import CaptureBudget
+from .iq_data import IQData
+
+if TYPE_CHECKING:
+    from .typing import SoftwareDefinedRadio
+
+
+BACKPRESSURE = ("block", "drop")
+"""What the acquisition thread does when every batch buffer is held by the
+consumer. block: wait for the consumer, which can make the device overflow,
+drop: drop the capture and count it.
+"""
+
+# Seconds of streaming per capture pass. Passes run back to back, but the device
+# restarts between them, so samples are missed at every pass boundary
+DEFAULT_PASS = CaptureBudget(seconds=1.0)
+_WAIT = 0.1
+
+
+class IQBatch(NamedTuple):
+    """Consecutive captures of a stream."""
+
+    stream: str
+    samples: npt.NDArray[np.complex64]
+    """(captures, samples per capture). A view into a pooled buffer that is
+    reused once the next batch is taken
+    """
+    timestamps: npt.NDArray[np.int64]
+    """Nanoseconds since the epoch of each capture"""
+    sequence: int
+    """Batch number of the stream"""
+    dropped: int
+    """Captures of the stream dropped so far"""
+    discontinuity: bool = False
+    """The batch starts a new capture pass. Samples were missed between the
+    previous batch and this one while the device restarted
+    """
+
+
+class _End(NamedTuple):
+    error: BaseException | None
+
+
+class IQStreamer:
+    """Capture listener that hands batches of captures to a consumer.
+
+    The captures of each stream are grouped into batches of `batch` captures.
+    Batches are filled in a pool of at most `depth` buffers shared by the
+    streams, so memory stays bounded however long it runs. A buffer goes back to
+    the pool when the consumer takes the next batch. When the pool is empty the
+    acquisition thread follows `backpressure`. Each stream fills a buffer of its
+    own while the consumer holds another, so `depth` must be above the number of
+    streams.
+
+    Streaming is split into capture passes and the device restarts between
+    them, so the stream is not gap-free. A batch never spans two passes: the
+    last batch of a pass may hold fewer than `batch` captures and the first
+    batch of the next pass has `discontinuity` set.
+    """
+
+    def __init__(
+        self, batch: int = 64, depth: int = 4, backpressure: str = "block"
+    ):
+        if backpressure not in BACKPRESSURE:
+            raise ValueError(
+                f"backpressure must be one of {', '.join(BACKPRESSURE)}"
+            )
+        if batch < 1 or depth < 1:
+            raise ValueError("batch and depth must be above 0")
+        self._batch = batch
+        self._depth = depth
+        self._block = backpressure == "block"
+        self._free: queue.Queue = queue.Queue()
+        self._ready: queue.Queue = queue.Queue()
+        self._allocated = 0
+        self._held: (
+            tuple[npt.NDArray[np.complex64], npt.NDArray[np.int64]] | None
+        ) = None
+        self._lock = threading.Lock()
+        self._filling: dict[
+            str, tuple[npt.NDArray[np.complex64], npt.NDArray[np.int64], int]
+        ] = {}
+        self._sequence: dict[str, int] = {}
+        # Streams whose next batch starts a new capture pass
+        self._new_pass: set[str] = set()
+        self.dropped: dict[str, int] = {}
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def _take(
+        self, samples_per_capture: int
+    ) -> tuple[npt.NDArray[np.complex64], npt.NDArray[np.int64]] | None:
+        with self._lock:
+            # Allocated on demand since the capture size is only known once the
+            # first capture arrives
+            if self._free.empty() and self._allocated < self._depth:
+                self._allocated += 1
+                return (
+                    np.empty(
+                        (self._batch, samples_per_capture), dtype=np.complex64
+                    ),
+                    np.empty(self._batch, dtype=np.int64),
+                )
+        while not self._stop.is_set():
+            try:
+                buffer = (
+                    self._free.get(timeout=_WAIT)
+                    if self._block
+                    else self._free.get_nowait()
+                )
+            except queue.Empty:
+                if not self._block:
+                    return None
+                continue
+            if buffer[0].shape[1] == samples_per_capture:
+                return buffer
+            return np.empty(
+                (self._batch, samples_per_capture), dtype=np.complex64
+            ), buffer[1]
+        return None
+
+    def __call__(self, stream: str, iq: IQData):
+        if stream in self._filling:
+            samples, timestamps, filled = self._filling[stream]
+        else:
+            buffer = self._take(len(iq.iq))
+            if buffer is None:
+                self.dropped[stream] = self.dropped.get(stream, 0) + 1
+                return
+            (samples, timestamps), filled = buffer, 0
+        samples[filled] = iq.iq
+        timestamps[filled] = iq.ts_sec * 1_000_000_000 + iq.ts_nsec
+        filled += 1
+        if filled < self._batch:
+            self._filling[stream] = samples, timestamps, filled
+            return
+        self._filling.pop(stream, None)
+        self._publish(stream, samples, timestamps, filled)
+
+    def _publish(
+        self,
+        stream: str,
+        samples: npt.NDArray[np.complex64],
+        timestamps: npt.NDArray[np.int64],
+        filled: int,
+    ):
+        sequence = self._sequence.get(stream, 0)
+        self._sequence[stream] = sequence + 1
+        discontinuity = stream in self._new_pass
+        self._new_pass.discard(stream)
+        self._ready.put(
+            (
+                IQBatch(
+                    stream,
+                    samples[:filled],
+                    timestamps[:filled],
+                    sequence,
+                    self.dropped.get(stream, 0),
+                    discontinuity,
+                ),
+                (samples, timestamps),
+            )
+        )
+
+    def _flush(self):
+        for stream, (samples, timestamps, filled) in list(
+            self._filling.items()
+        ):
+            self._publish(stream, samples, timestamps, filled)
+        self._filling.clear()
+
+    def _capture(
+        self,
+        platform: "SoftwareDefinedRadio",
+        center: float,
+        bw: float,
+        pass_size: float | CaptureBudget,
+    ):
+        error = None
+        try:
+            platform.reserve(pass_size)
+            platform.add_capture_listener(self)
+            try:
+                while not self._stop.is_set():
+                    platform.capture_iq(center, bw, pass_size, False, False)
+                    # Partial batches, so no batch spans the gap to the next
+                    # pass
+                    self._flush()
+                    self._new_pass = set(self._sequence)
+            finally:
+                platform.remove_capture_listener(self)
+        except BaseException as e:
+            error = e
+        self._ready.put(_End(error))
+
+    def start(
+        self,
+        platform: "SoftwareDefinedRadio",
+        center: float,
+        bw: float,
+        pass_size: float | CaptureBudget = DEFAULT_PASS,
+    ):
+        """Capture back to back passes of `pass_size` until `stop`.
+
+        Passes are captured on a producer thread. Samples are missed between
+        passes, see `IQBatch.discontinuity`. Raises ValueError if `depth`
+        isn't above the number of streams of `platform`, since the aligned USRP
+        channels are all delivered on one thread and would wait on each other
+        for buffers.
+        """
+        platform.configure(center, bw)
+        streams = len(platform.stream_metadata)
+        if self._depth <= streams:
+            raise ValueError(
+                f"depth must be above the {streams} streams of the platform, "
+                "one buffer per stream being filled and one for the consumer"
+            )
+        self._thread = threading.Thread(
+            target=self._capture,
+            args=(platform, center, bw, pass_size),
+            name="iq-stream",
+            daemon=True,
+        )
+        self._thread.start()
+
+    def stop(self):
+        """Stop after the current capture pass."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def next_batch(self) -> IQBatch | None:
+        """Block for the next batch.
+
+        The buffer of the previous batch goes back to the pool. None once the
+        streamer stopped. Raises what stopped the producer.
+        """
+        if self._held is not None:
+            self._free.put(self._held)
+            self._held = None
+        item = self._ready.get()
+        if isinstance(item, _End):
+            # Later calls end too
+            self._ready.put(item)
+            if item.error is not None:
+                raise item.error
+            return None
+        batch, self._held = item
+        return batch
+
+    def __iter__(self) -> Iterator[IQBatch]:
+        """Batches until the streamer stops."""
+        while (batch := self.next_batch()) is not None:
+            yield batch
+
+    async def __aiter__(self) -> AsyncIterator[IQBatch]:
+        """Batches until the streamer stops, waited for on an executor."""
+        loop = asyncio.get_running_loop()
+        while (
+            batch := await loop.run_in_executor(None, self.next_batch)
+        ) is not None:
+            yield batch
+
+
+def stream_iq(
+    platform: "SoftwareDefinedRadio",
+    center: float,
+    bw: float,
+    batch: int = 64,
+    depth: int = 4,
+    backpressure: str = "block",
+    pass_size: float | CaptureBudget = DEFAULT_PASS,
+) -> Iterator[IQBatch]:
+    """Generator of the batches of every stream of `platform`.
+
+    Streaming stops when the generator is closed. `depth` must be above the
+    number of streams, each of which fills its own buffer while the consumer
+    holds another.
+
+    The stream is not gap-free. It is captured in back to back passes of
+    `pass_size` and the device restarts between them, losing the samples in
+    between. The first batch of every pass after the first has
+    `IQBatch.discontinuity` set. Captures dropped by `backpressure="drop"` are
+    counted in `IQBatch.dropped` instead.
+    """
+    streamer = IQStreamer(batch, depth, backpressure)
+    streamer.start(platform, center, bw, pass_size)
+    try:
+        yield from streamer
+    finally:
+        streamer.stop()
+
+
+async def astream_iq(
+    platform: "SoftwareDefinedRadio",
+    center: float,
+    bw: float,
+    batch: int = 64,
+    depth: int = 4,
+    backpressure: str = "block",
+    pass_size: float | CaptureBudget = DEFAULT_PASS,
+) -> AsyncIterator[IQBatch]:
+    """`stream_iq` for `async for`.
+
+    Opening and tuning the device, waiting for batches and stopping run on an
+    executor, so they don't block the event loop.
+    """
+    loop = asyncio.get_running_loop()
+    streamer = IQStreamer(batch, depth, backpressure)
+    await loop.run_in_executor(
+        None, streamer.start, platform, center, bw, pass_size
+    )
+    try:
+        async for iq_batch in streamer:
+            yield iq_batch
+    finally:
+        await loop.run_in_executor(None, streamer.stop)
@@ -0,0 +1,304 @@
+"""Reads of the samples of a time range from saved captures."""
+
+import bisect
+import json
+import math
+from pathlib import Path
+from typing import Any, NamedTuple
+
+import h5py
+import numpy as np
+import numpy.typing as npt
+
+from .catalog import register_files
+from .codec import decode_block, from_int16
+from .save_iq_data import _new_file_path
+from .segments import INDEX_FILE, read_segment_index
+
+# Absorbs the rounding of the sample times so a sample exactly at a bound counts
+# as inside
+_SAMPLE_TOLERANCE = 1e-6
+# Attributes that describe the layout of a file rather than the stream
+_LAYOUT_ATTRS = (
+    "iq_codec",
+    "iq_scale",
+    "iq_exact",
+    "samples_per_capture",
+    "segment",
+    "first_sample",
+)
+
+
+class TimeSlice(NamedTuple):
+    """Samples of a time range, in pieces of the captures they come from."""
+
+    samples: npt.NDArray[np.complex64]
+    """The samples of the range in time order"""
+    timestamps: npt.NDArray[np.int64]
+    """ns of the first sample of each piece. A piece is the part of one capture
+    in the range
+    """
+    offsets: npt.NDArray[np.int64]
+    """Index in `samples` where each piece starts. Pieces of back to back
+    captures are contiguous in time
+    """
+    rate: float
+
+    def sample_times(self) -> npt.NDArray[np.int64]:
+        """Ns of every sample.
+
+        Reconstructed from the piece timestamps and the sample rate.
+        """
+        lengths = np.diff(np.append(self.offsets, len(self.samples)))
+        within = np.arange(len(self.samples)) - np.repeat(self.offsets, lengths)
+        return np.repeat(self.timestamps, lengths) + np.round(
+            within * 1e9 / self.rate
+        ).astype(np.int64)
+
+
+class _Captures:
+    """The captures of one saved file.
+
+    Timestamps and samples are read on demand, so only the pages needed are
+    read.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._file = self._blocks = None
+        # numpy arrays, or h5py datasets read on demand
+        self._iq: Any = None
+        self._ts: Any = None
+        if path.suffix == ".cf32":
+            with open(path.with_suffix(".json")) as f:
+                sidecar = json.load(f)
+            self.attrs = sidecar["metadata"]
+            self._ts = np.asarray(sidecar["timestamps"], dtype=np.int64)
+            self.samples_per_capture = int(sidecar["samples_per_capture"])
+            self._iq = np.memmap(path, dtype=np.complex64, mode="r").reshape(
+                -1, self.samples_per_capture
+            )
+        else:
+            self._file = h5py.File(path, "r")
+            self.attrs = dict(self._file.attrs)
+            self._ts = self._file["iq_ts"]
+            if "iq_blocks" in self._file:
+                self._blocks = self._file["iq_blocks"]
+                self._scale = float(self.attrs["iq_scale"])
+                self.samples_per_capture = int(
+                    self.attrs["samples_per_capture"]
+                )
+            else:
+                self._iq = self._file["iq_data"]
+                self.samples_per_capture = self._iq.shape[1]
+        if "rate" not in self.attrs:
+            self.close()
+            raise ValueError(f"{path} has no sample rate")
+        self.rate = float(self.attrs["rate"])
+        self.count = len(self._ts)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def ts(self, start: int, stop: int | None = None) -> npt.NDArray[np.int64]:
+        return np.asarray(
+            self._ts[start : stop if stop is not None else start + 1],
+            dtype=np.int64,
+        ).reshape(-1)
+
+    def captures_before(self, ns: int) -> int:
+        """Number of captures starting at or before `ns`.
+
+        Found by binary search over single timestamp reads.
+        """
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if self.ts(middle)[0] <= ns:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def read(
+        self, start: int, stop: int, first: int, last: int
+    ) -> npt.NDArray[np.complex64]:
+        """Samples `first` to `last` of captures `start` to `stop`."""
+        if self._blocks is None:
+            return np.asarray(self._iq[start:stop, first:last])
+        # Blocks decode one whole capture each
+        return np.stack(
+            [
+                from_int16(decode_block(block)[None], self._scale)[
+                    0, first:last
+                ]
+                for block in self._blocks[start:stop]
+            ]
+        )
+
+
+def _pieces(
+    captures: _Captures, start_ns: int, end_ns: int
+) -> list[tuple[int, npt.NDArray[np.complex64]]]:
+    """Captures of `captures` with samples in [start_ns, end_ns).
+
+    :return: The first sample ns and the samples of each capture.
+    """
+    # The capture holding start_ns starts at or before it, the last capture in
+    # range starts before end_ns
+    first = max(0, captures.captures_before(start_ns) - 1)
+    stop = captures.captures_before(end_ns - 1)
+    if stop <= first:
+        return []
+    ts = captures.ts(first, stop)
+    spc, period = captures.samples_per_capture, 1e9 / captures.rate
+    bounds = []
+    for t in ts:
+        begin = max(0, math.ceil((start_ns - t) / period - _SAMPLE_TOLERANCE))
+        end = min(spc, math.ceil((end_ns - t) / period - _SAMPLE_TOLERANCE))
+        bounds.append((begin, end))
+
+    pieces = []
+    # Captures entirely in range are read at once, the partial first and last on
+    # their own
+    capture = first
+    while capture < stop:
+        begin, end = bounds[capture - first]
+        run = capture + 1
+        if begin == 0 and end == spc:
+            while run < stop and bounds[run - first] == (0, spc):
+                run += 1
+        if end > begin:
+            rows = captures.read(capture, run, begin, end)
+            for i, row in enumerate(rows):
+                pieces.append(
+                    (int(ts[capture - first + i]) + round(begin * period), row)
+                )
+        capture = run
+    return pieces
+
+
+def _segment_files(
+    directory: Path, stream: str | None, start_ns: int, end_ns: int
+) -> list[Path]:
+    index = read_segment_index(directory)
+    streams = index["streams"]
+    if stream is None:
+        if len(streams) != 1:
+            raise ValueError(
+                f"{directory} has streams {', '.join(streams)}, pick one"
+            )
+        stream = next(iter(streams))
+    if stream not in streams:
+        raise ValueError(f"{directory} has no stream {stream}")
+    segments = streams[stream]["segments"]
+    # Segments are in time order, so the first one that can hold start_ns is
+    # found by bisection
+    first = max(
+        0,
+        bisect.bisect_right(
+            [segment["first_ts"] for segment in segments], start_ns
+        )
+        - 1,
+    )
+    return [
+        directory / segment["file"]
+        for segment in segments[first:]
+        if segment["first_ts"] < end_ns
+    ]
+
+
+def read_time_range(
+    path: Path, start_ns: int, end_ns: int, stream: str | None = None
+) -> TimeSlice:
+    """Read the samples with times in [start_ns, end_ns).
+
+    The samples come from a saved capture, raw, compressed or `.cf32`, or from a
+    stream of a segmented recording directory. Only the timestamps visited by
+    the binary search and the samples in range are read.
+    :param stream: The stream of a recording. Recordings of a single stream
+    don't need it.
+    """
+    path = Path(path)
+    if path.is_dir() and (path / INDEX_FILE).exists():
+        files = _segment_files(path, stream, start_ns, end_ns)
+    else:
+        files = [path]
+    pieces, rate = [], None
+    for file in files:
+        with _Captures(file) as captures:
+            rate = captures.rate
+            pieces += _pieces(captures, start_ns, end_ns)
+    if rate is None:
+        # No segment starts before the end of the range
+        rate = float(time_range_metadata(path, stream).get("rate", 0))
+    lengths = np.array([len(samples) for _, samples in pieces], dtype=np.int64)
+    return TimeSlice(
+        np.concatenate([samples for _, samples in pieces])
+        if pieces
+        else np.empty(0, np.complex64),
+        np.array([ts for ts, _ in pieces], dtype=np.int64),
+        np.concatenate([[0], np.cumsum(lengths)[:-1]]).astype(np.int64)
+        if pieces
+        else np.empty(0, np.int64),
+        rate,
+    )
+
+
+def time_range_metadata(path: Path, stream: str | None = None) -> dict:
+    """Stream metadata of a saved capture or of a recording stream."""
+    path = Path(path)
+    if path.is_dir():
+        streams = read_segment_index(path)["streams"]
+        entry = (
+            streams.get(stream, {})
+            if stream is not None
+            else next(iter(streams.values()), {})
+        )
+        return dict(entry.get("metadata", {}))
+    with _Captures(path) as captures:
+        return {
+            key: value.item() if isinstance(value, np.generic) else value
+            for key, value in captures.attrs.items()
+            if key not in _LAYOUT_ATTRS
+        }
+
+
+def save_time_slice(
+    time_slice: TimeSlice,
+    start_ns: int,
+    end_ns: int,
+    metadata: dict,
+    tag: str | None = None,
+    path: Path | None = None,
+) -> Path:
+    """Save a time range as a capture file of one capture.
+
+    The capture holds every sample. The timestamp and offset of each piece are
+    in `piece_ts` and `piece_offsets` to tell where captures were not back to
+    back.
+    """
+    path = path or _new_file_path(tag, prefix="extract")
+    with h5py.File(path, "w") as f:
+        f.create_dataset("iq_data", data=time_slice.samples[None])
+        f.create_dataset("iq_ts", data=time_slice.timestamps[:1].reshape(-1, 1))
+        f.create_dataset("piece_ts", data=time_slice.timestamps)
+        f.create_dataset("piece_offsets", data=time_slice.offsets)
+        f.attrs.update(metadata)
+        f.attrs.update(
+            {
+                "rate": time_slice.rate,
+                "range_start_ns": start_ns,
+                "range_end_ns": end_ns,
+            }
+        )
+    register_files([path])
+    return path
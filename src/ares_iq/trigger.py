@@ -0,0 +1,251 @@
+"""Energy triggered recording of the captures around detections."""
+
+import queue
+import threading
+from pathlib import Path
+
+import h5py
+import numpy as np
+import numpy.typing as npt
+from rich.table import Table
+
+from .affinity import placed_thread
+from .catalog import register_files
+from .iq_data import IQData
+from .save_iq_data import _new_file_path
+
+
+class _StreamTrigger:
+    def __init__(self, pre_blocks: int):
+        self.ring: npt.NDArray[np.complex64] | None = None
+        self.ring_ts = np.zeros(pre_blocks, dtype=np.int64)
+        self.ring_len = 0
+        self.ring_next = 0
+        self.recording = False
+        self.post_remaining = 0
+        self.power_db = -np.inf
+        self.events = 0
+        self.dropped = 0
+
+    def push(self, iq: npt.NDArray[np.complex64], ts: int):
+        if not len(self.ring_ts):
+            return
+        if self.ring is None or self.ring.shape[1] != len(iq):
+            self.ring = np.empty(
+                (len(self.ring_ts), len(iq)), dtype=np.complex64
+            )
+            self.ring_len = 0
+        self.ring[self.ring_next] = iq
+        self.ring_ts[self.ring_next] = ts
+        self.ring_next = (self.ring_next + 1) % len(self.ring_ts)
+        self.ring_len = min(self.ring_len + 1, len(self.ring_ts))
+
+    def drain(self) -> list[tuple[npt.NDArray[np.complex64], int]]:
+        """Remove the buffered blocks, oldest first."""
+        if self.ring is None:
+            return []
+        slots = [
+            (self.ring_next - self.ring_len + i) % len(self.ring_ts)
+            for i in range(self.ring_len)
+        ]
+        self.ring_len = 0
+        return [
+            (self.ring[slot].copy(), int(self.ring_ts[slot])) for slot in slots
+        ]
+
+
+class TriggeredRecorder:
+    """Capture listener that only persists the captures around detections.
+
+    The mean power of each capture is compared to `threshold_db`
+    (dBFS for the USRP, dBm for the BB60). The last `pre_blocks` captures are
+    kept in a ring buffer per stream and written with the capture that
+    triggered. Recording stops `post_blocks` captures after the power falls
+    `hysteresis_db` below the threshold. Each event is written to its own file
+    on a writer thread. If the writer falls more than `max_queued` captures
+    behind, captures are dropped and counted.
+    """
+
+    def __init__(
+        self,
+        threshold_db: float,
+        hysteresis_db: float = 3.0,
+        pre_blocks: int = 2,
+        post_blocks: int = 2,
+        metadata: dict[str, dict] | None = None,
+        tag: str | None = None,
+        max_queued: int = 256,
+    ):
+        self._threshold_db = threshold_db
+        self._release_db = threshold_db - hysteresis_db
+        self._pre_blocks = pre_blocks
+        self._post_blocks = post_blocks
+        self._metadata = metadata or {}
+        self._tag = tag
+        self._max_queued = max_queued
+        self._streams: dict[str, _StreamTrigger] = {}
+        self._queue: queue.SimpleQueue = queue.SimpleQueue()
+        self._queued = 0
+        self._lock = threading.Lock()
+        self._events: list[Path] = []
+        self._thread: threading.Thread | None = None
+
+    def __enter__(self):
+        """Start watching captures until the block exits."""
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        """Close the open events and stop the writer."""
+        self.stop()
+
+    def start(self):
+        self._thread = threading.Thread(
+            target=self._write, name="trigger-writer", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+    def __call__(self, stream: str, iq: IQData):
+        samples = iq.iq
+        power = np.vdot(samples, samples).real / max(1, len(samples))
+        state = self._streams.setdefault(
+            stream, _StreamTrigger(self._pre_blocks)
+        )
+        state.power_db = 10 * np.log10(power + np.finfo(np.float32).tiny)
+        ts = iq.ts_sec * 1_000_000_000 + iq.ts_nsec
+
+        if not state.recording:
+            if state.power_db < self._threshold_db:
+                state.push(samples, ts)
+                return
+            state.recording = True
+            state.events += 1
+            self._queue.put(("open", stream, len(samples)))
+            for block, block_ts in state.drain():
+                self._enqueue(state, stream, block, block_ts)
+        elif state.power_db < self._release_db and state.post_remaining == 0:
+            state.recording = False
+            self._queue.put(("close", stream, None))
+            state.push(samples, ts)
+            return
+
+        # Copied since the capture buffer is recycled
+        self._enqueue(state, stream, samples.copy(), ts)
+        state.post_remaining = (
+            self._post_blocks
+            if state.power_db >= self._release_db
+            else state.post_remaining - 1
+        )
+
+    def _enqueue(
+        self,
+        state: _StreamTrigger,
+        stream: str,
+        block: npt.NDArray[np.complex64],
+        ts: int,
+    ):
+        with self._lock:
+            if self._queued >= self._max_queued:
+                state.dropped += 1
+                return
+            self._queued += 1
+        self._queue.put(("block", stream, (block, ts)))
+
+    def _open_event(self, stream: str, samples: int) -> h5py.File:
+        tags = [t for t in (self._tag, stream) if t is not None]
+        path = _new_file_path("-".join(tags), prefix="event")
+        f = h5py.File(path, "w")
+        f.create_dataset(
+            "iq_data",
+            shape=(0, samples),
+            maxshape=(None, samples),
+            chunks=(1, samples),
+            dtype=np.complex64,
+        )
+        f.create_dataset(
+            "iq_ts", shape=(0, 1), maxshape=(None, 1), dtype=np.int64
+        )
+        f.attrs.update(self._metadata.get(stream, {}))
+        f.attrs.update(
+            {
+                "threshold_db": self._threshold_db,
+                "release_db": self._release_db,
+                "pre_blocks": self._pre_blocks,
+                "post_blocks": self._post_blocks,
+            }
+        )
+        with self._lock:
+            self._events.append(path)
+        return f
+
+    def _write(self):
+        with placed_thread("writer"):
+            files: dict[str, h5py.File] = {}
+            try:
+                while (item := self._queue.get()) is not None:
+                    kind, stream, payload = item
+                    if kind == "open":
+                        files[stream] = self._open_event(stream, payload)
+                    elif kind == "close":
+                        f = files.pop(stream)
+                        path = Path(f.filename)
+                        f.close()
+                        register_files([path])
+                    else:
+                        block, ts = payload
+                        iq_data, iq_ts = (
+                            files[stream]["iq_data"],
+                            files[stream]["iq_ts"],
+                        )
+                        iq_data.resize(len(iq_data) + 1, axis=0)
+                        iq_data[-1] = block
+                        iq_ts.resize(len(iq_ts) + 1, axis=0)
+                        iq_ts[-1] = ts
+                        with self._lock:
+                            self._queued -= 1
+            finally:
+                # Events still recording when the recorder stops end with the
+                # last capture
+                for f in files.values():
+                    path = Path(f.filename)
+                    f.close()
+                    register_files([path])
+
+    @property
+    def events(self) -> list[Path]:
+        with self._lock:
+            return list(self._events)
+
+    @property
+    def dropped(self) -> dict[str, int]:
+        return {
+            stream: state.dropped
+            for stream, state in self._streams.items()
+            if state.dropped
+        }
+
+    def __rich__(self) -> Table:
+        """Table of the state and events of every stream."""
+        table = Table(
+            box=None, show_header=True, header_style="bold", padding=(0, 1)
+        )
+        table.add_column("stream")
+        table.add_column("power dB", justify="right")
+        table.add_column("state")
+        table.add_column("events", justify="right")
+        table.add_column("dropped", justify="right", style="red")
+        for stream, state in list(self._streams.items()):
+            table.add_row(
+                stream,
+                f"{state.power_db:.1f}",
+                "[green]recording" if state.recording else "armed",
+                str(state.events),
+                str(state.dropped),
+            )
+        return table
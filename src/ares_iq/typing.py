@@ -1,23 +1,169 @@
-from typing import Protocol
+from typing import AsyncIterator, Callable, Iterator, Protocol
+
+from .autotune import TrialResult
+from .capture_budget import CaptureBudget
+from .doctor import StreamRequirements
 from .iq_data import IQData
+from .stream import DEFAULT_PASS, IQBatch
+
+CaptureListener = Callable[[str, IQData], None]
+"""Called with the stream name and the capture each time a capture completes,
+from the acquisition thread of the BB60 or the thread the USRP receive threads
+hand completed captures to. It must return quickly and must not keep the samples
+past the call without copying them, since capture buffers are recycled.
+Listeners that are also rich renderables (define `__rich__`) are drawn below the
+capture progress bars.
+"""
 
 
 class SoftwareDefinedRadio(Protocol):
-    def capture_iq(self, center: float, bw: float, file_size: float, verbose: bool, extra_verbose: bool) -> None:
-        """
-        Capture IQ data from the SDR.
+    def capture_iq(
+        self,
+        center: float,
+        bw: float,
+        file_size: float | CaptureBudget,
+        verbose: bool,
+        extra_verbose: bool,
+    ) -> None:
+        """Capture IQ data from the SDR.
+
         :param center: The center frequency in Hz
         :param bw: The bandwidth in Hz
-        :param file_size: The maximum amount of IQ data to collect in GB
+        :param file_size: The amount of IQ data to collect in GB, split evenly
+        between the streams, or a budget. It is rounded up to whole captures at
+        the actual sample rate
         :param verbose: Show progress bar.
-        :param extra_verbose: Extra verbose output. Shows the progress bar and logging messages.
+        :param extra_verbose: Extra verbose output. Shows the progress bar and
+        logging messages.
         :return: The captured IQ data and the
         """
 
+    def configure(
+        self, center: float, bw: float, extra_verbose: bool = False
+    ) -> None:
+        """Open the device if it isn't open and tune it without capturing.
+
+        `stream_metadata` then describes the stream before the first capture.
+        :param center: The center frequency in Hz
+        :param bw: The bandwidth in Hz
+        :param extra_verbose: Show logging messages.
+        """
+
+    def close(self) -> None:
+        """Close the device.
+
+        Devices and capture buffers are kept between calls to `capture_iq` so
+        repeated captures only pay for retuning. Buffers are recycled, so the
+        data of a capture is only valid until the next capture unless more
+        buffers are reserved.
+        """
+
+    def add_capture_listener(self, listener: CaptureListener) -> None:
+        """Call `listener` after each completed capture of every stream."""
+
+    def remove_capture_listener(self, listener: CaptureListener) -> None:
+        """Stop calling `listener`."""
+
+    def stream_iq(
+        self,
+        center: float,
+        bw: float,
+        batch: int = 64,
+        depth: int = 4,
+        backpressure: str = "block",
+        pass_size: float | CaptureBudget = DEFAULT_PASS,
+    ) -> Iterator[IQBatch]:
+        """Capture continuously and yield batches of captures of each stream.
+
+        Each batch holds `batch` captures. Streaming ends when the generator is
+        closed. The stream is not gap-free: it is captured in back to back
+        passes of `pass_size`, the device restarts between them and the first
+        batch of each later pass has `IQBatch.discontinuity` set.
+        :param depth: The number of batch buffers, above the number of streams.
+        A batch is valid until the next one is taken.
+        :param backpressure: `block` waits for the consumer when every buffer is
+        taken, which can make the device overflow, `drop` drops captures and
+        counts them in `IQBatch.dropped`.
+        :param pass_size: Size of the back to back captures streaming is split
+        into. The device stops between them and the samples in between are
+        lost.
+        """
+
+    def astream_iq(
+        self,
+        center: float,
+        bw: float,
+        batch: int = 64,
+        depth: int = 4,
+        backpressure: str = "block",
+        pass_size: float | CaptureBudget = DEFAULT_PASS,
+    ) -> AsyncIterator[IQBatch]:
+        """`stream_iq` for `async for`.
+
+        Opening the device and waiting for batches don't block the event loop.
+        """
+
+    def reserve(
+        self, file_size_gb: float | CaptureBudget, buffers: int = 1
+    ) -> None:
+        """Preallocate capture buffers.
+
+        :param file_size_gb: The largest capture the buffers must hold in GB, or
+        its budget.
+        :param buffers: The number of buffers captures rotate between. The data
+        of a capture stays valid for this many captures, so it can be consumed
+        while the next capture runs.
+        """
+
     @property
     def iq_data(self) -> list[IQData]:
         """IQ data from the capture"""
 
+    @property
+    def iq_streams(self) -> dict[str, list[IQData]]:
+        """IQ data from the capture for each independent stream.
+
+        A stream is a device or a channel, keyed by its name.
+        """
+
+    @property
+    def stream_metadata(self) -> dict[str, dict[str, float | int | str]]:
+        """Tune metadata of the last capture for each stream.
+
+        Center, bandwidth, rate, ..., keyed by stream name.
+        """
+
+    @property
+    def full_scale(self) -> float:
+        """I or Q magnitude at which samples clip, in sample units."""
+
+    def stream_requirements(self, file_size_gb: float) -> StreamRequirements:
+        """What the configured stream needs from the host, for `ares-iq doctor`.
+
+        Doesn't open the device.
+        """
+
+    def tuning_grid(self, values: dict[str, list[int]]) -> list[dict[str, int]]:
+        """The stream settings `ares-iq autotune` tries, keyed by config key.
+
+        :param values: Values to try instead of the defaults, keyed by setting.
+        """
+
+    def tune_trial(
+        self,
+        settings: dict[str, int],
+        center: float,
+        bw: float,
+        file_size_gb: float,
+    ) -> TrialResult:
+        """Capture `file_size_gb` with `settings` and measure the stream.
+
+        The settings replace the configured ones for this capture only.
+        """
+
+    def save_tuning(self, settings: dict[str, int]) -> None:
+        """Write tuned settings into the config sections."""
+
     @property
     def quantized_data(self) -> list[None]:
         """Quantized data from the capture"""
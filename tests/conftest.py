@@ -0,0 +1,27 @@
+import numpy as np
+import pytest
+
+from ares_iq import configurations, save_iq_data
+
+
+@pytest.fixture(autouse=True)
+def scratch_dirs(tmp_path, monkeypatch):
+    """Keep the saved files, configs and catalog of each test apart."""
+    config_file = tmp_path / "config.ini"
+    config_file.write_text(f"[catalog]\npath = {tmp_path / 'catalog.sqlite'}\n")
+    monkeypatch.setattr(configurations, "CONFIG_FILE", config_file)
+    monkeypatch.setattr(save_iq_data, "SAVE_DIR", tmp_path / "ares-iq-data")
+    return tmp_path
+
+
+@pytest.fixture
+def noise():
+    """Factory of seeded complex64 Gaussian noise, `noise(count, seed)`."""
+
+    def samples(count: int, seed: int) -> np.ndarray:
+        rng = np.random.default_rng(seed)
+        return (
+            rng.standard_normal(count) + 1j * rng.standard_normal(count)
+        ).astype(np.complex64)
+
+    return samples
@@ -0,0 +1,60 @@
+import pytest
+
+from ares_iq.capture_budget import (
+    INT16_IQ_BYTES,
+    CaptureBudget,
+    budget_summary,
+)
+
+
+@pytest.mark.parametrize(
+    "seconds, captures",
+    [
+        # 1000 samples per capture at 1 MS/s, so 1 ms per capture
+        (0.002, 2),
+        (0.0021, 3),
+        (0.001 / 3, 1),
+        # 0.3 s * 1e6 isn't exactly 300000 in floating point
+        (0.3, 300),
+    ],
+)
+def test_seconds_round_up_to_whole_captures(seconds, captures):
+    budget = CaptureBudget(seconds=seconds)
+    assert budget.captures(1e6, 2, 1000) == captures
+
+
+@pytest.mark.parametrize(
+    "samples, captures", [(1000, 1), (1001, 2), (1, 1), (4000, 4)]
+)
+def test_samples_round_up_to_whole_captures(samples, captures):
+    assert CaptureBudget(samples=samples).captures(1e6, 2, 1000) == captures
+
+
+def test_bytes_are_split_between_the_streams():
+    # 8 bytes per complex64 sample, 2 streams: 16000 bytes a capture
+    assert CaptureBudget(bytes=16000).captures(1e6, 2, 1000) == 1
+    assert CaptureBudget(bytes=16001).captures(1e6, 2, 1000) == 2
+    assert CaptureBudget(bytes=32000).captures(1e6, 1, 1000) == 4
+    # Counted in 4 byte int16 samples instead
+    budget = CaptureBudget(bytes=16000, sample_bytes=INT16_IQ_BYTES)
+    assert budget.captures(1e6, 2, 1000) == 2
+
+
+def test_first_set_field_wins():
+    budget = CaptureBudget(seconds=0.001, samples=5000, bytes=10**9)
+    assert budget.captures(1e6, 1, 1000) == 1
+    assert CaptureBudget(samples=5000, bytes=10**9).captures(1e6, 1, 1000) == 5
+
+
+def test_size_in_gb_is_a_bytes_budget():
+    assert CaptureBudget.from_size(0.5) == CaptureBudget(bytes=500_000_000)
+    budget = CaptureBudget(seconds=1.0)
+    assert CaptureBudget.from_size(budget) is budget
+
+
+def test_summary_reports_the_rounded_plan():
+    summary = budget_summary(3, 1000, 1e6, 2, 8)
+    assert summary == (
+        "Capture plan: 3 x 1000 samples per stream at 1 MS/s = 3000 samples, "
+        "0.003 s, 0.000 GB over 2 streams"
+    )
@@ -0,0 +1,70 @@
+import threading
+
+import numpy as np
+import pytest
+
+from ares_iq.capture_server import CaptureServer, submit_job
+from ares_iq.iq_data import IQData
+from ares_iq.print_utils import print_error
+
+
+class _FakePlatform:
+    """Captures one stream of zeros, failing like a platform above 6 GHz."""
+
+    def __init__(self):
+        self._iq = IQData()
+        self._iq.iq = np.zeros(16, dtype=np.complex64)
+
+    def capture_iq(self, center, bw, file_size, verbose, extra_verbose):
+        if center > 6e9:
+            print_error("Center frequency out of range")
+
+    @property
+    def iq_streams(self):
+        return {"a": [self._iq]}
+
+    @property
+    def stream_metadata(self):
+        return {"a": {"rate": 1e6}}
+
+
+@pytest.fixture
+def socket_file(tmp_path):
+    server = CaptureServer(_FakePlatform(), tmp_path / "capture.sock")
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield tmp_path / "capture.sock"
+    server.shutdown()
+    server.server_close()
+
+
+def test_runs_the_job(socket_file):
+    result = submit_job(
+        socket_file, {"center": 2450, "bw": 20, "size": 0.1, "tag": "x"}
+    )
+
+    assert result["status"] == "ok"
+    assert len(result["files"]) == 1
+
+
+@pytest.mark.parametrize(
+    "job, error",
+    [
+        ({"bw": 20, "size": 0.1}, "Job is missing 'center'"),
+        (
+            {"center": "a", "bw": 20, "size": 0.1},
+            "Job 'center' must be a number",
+        ),
+        ({"center": 2450, "bw": 20, "size": 0}, "Job 'size' must be positive"),
+        (
+            {"center": 2450, "bw": 20, "size": 0.1, "tag": 1},
+            "Job 'tag' must be a string",
+        ),
+        (
+            {"center": 7000, "bw": 20, "size": 0.1},
+            "Capture failed, see the daemon output",
+        ),
+    ],
+)
+def test_reports_job_errors(socket_file, job, error):
+    assert submit_job(socket_file, job) == {"status": "error", "error": error}
@@ -0,0 +1,72 @@
+import numpy as np
+import pytest
+
+from ares_iq.capture_stats import OCCUPANCY_BINS, OCCUPANCY_NFFT, compute_stats
+
+SAMPLES = 4096
+
+
+def _tone(cycles: int, gain: float = 1.0, phase_deg: float = 0.0) -> np.ndarray:
+    """Whole number of cycles, so I and Q average out exactly."""
+    t = 2 * np.pi * cycles * np.arange(SAMPLES) / SAMPLES
+    return (np.cos(t) + 1j * gain * np.sin(t + np.radians(phase_deg))).astype(
+        np.complex64
+    )
+
+
+def test_dc_offset():
+    rng = np.random.default_rng(0)
+    noise = (
+        rng.standard_normal((2, SAMPLES))
+        + 1j * rng.standard_normal((2, SAMPLES))
+    ) * np.sqrt(0.5)
+    iq = (noise + np.array([[0.0], [1 - 1j]])).astype(np.complex64)
+    stats = compute_stats(iq)
+
+    assert abs(stats["dc"][0]) < 0.05
+    assert abs(stats["dc"][1] - (1 - 1j)) < 0.05
+    # 2 of DC power over 3 of total power
+    assert stats["dc_ratio_db"][1] == pytest.approx(
+        10 * np.log10(2 / 3), abs=0.2
+    )
+    assert stats["dc_ratio_db"][0] < -25
+    assert stats["power_mean_db"][1] == pytest.approx(10 * np.log10(3), abs=0.2)
+
+
+def test_clipped_samples_are_counted():
+    full_scale = 0.5
+    iq = np.stack([_tone(8) * 0.4, _tone(8)])
+    clipped = np.clip(iq.real, -full_scale, full_scale) + 1j * np.clip(
+        iq.imag, -full_scale, full_scale
+    )
+    stats = compute_stats(clipped.astype(np.complex64), full_scale)
+
+    assert stats["clipped"][0] == 0
+    # Samples where I or Q is at full scale
+    expected = np.count_nonzero(
+        (np.abs(iq[1].real) >= full_scale) | (np.abs(iq[1].imag) >= full_scale)
+    )
+    assert stats["clipped"][1] == expected > 0
+    assert stats["power_peak_db"][0] < 10 * np.log10(2 * full_scale**2)
+
+
+@pytest.mark.parametrize(
+    "gain, phase_deg", [(1.0, 0.0), (0.5, 0.0), (1.2, 5.0)]
+)
+def test_iq_imbalance(gain, phase_deg):
+    stats = compute_stats(_tone(8, gain, phase_deg)[None])
+
+    assert stats["gain_imbalance_db"][0] == pytest.approx(
+        -20 * np.log10(gain), abs=1e-3
+    )
+    assert stats["phase_imbalance_deg"][0] == pytest.approx(phase_deg, abs=1e-2)
+
+
+def test_tone_lands_in_its_occupancy_bin():
+    # 40 cycles per FFT, so 40 FFT bins above DC
+    cycles = 40
+    iq = _tone(cycles * SAMPLES // OCCUPANCY_NFFT)[None]
+    occupancy = compute_stats(iq)["occupancy_db"][0]
+
+    bin_width = OCCUPANCY_NFFT // OCCUPANCY_BINS
+    assert np.argmax(occupancy) == (cycles + OCCUPANCY_NFFT // 2) // bin_width
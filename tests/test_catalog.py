@@ -0,0 +1,87 @@
+import pytest
+
+from ares_iq.catalog import Catalog
+
+SECOND = 1_000_000_000
+
+
+def _add(
+    catalog: Catalog,
+    name: str,
+    start_s: int,
+    center: float,
+    powers_db: list[float],
+):
+    """Catalog a 20 MHz file of one capture per second and per power."""
+    record = {
+        "path": f"/data/{name}.h5",
+        "kind": "capture",
+        "center": center,
+        "bandwidth": 20e6,
+        "low_hz": center - 10e6,
+        "high_hz": center + 10e6,
+        "start_ns": start_s * SECOND,
+        "end_ns": (start_s + len(powers_db)) * SECOND,
+        "captures": len(powers_db),
+        "samples_per_capture": 1024,
+        "samples": 1024 * len(powers_db),
+        "compressed": 0,
+        "power_max_db": max(powers_db),
+        "clipped_captures": 0,
+        "metadata": "{}",
+        "size": 0,
+        "mtime": 0.0,
+    }
+    captures = [
+        (i, (start_s + i) * SECOND, power, power, None, None, None, 0, None)
+        for i, power in enumerate(powers_db)
+    ]
+    catalog.add(record, captures)
+
+
+@pytest.fixture
+def catalog(tmp_path):
+    with Catalog(tmp_path / "catalog.sqlite") as catalog:
+        # "early" is loud at its start, "late" at its end
+        _add(catalog, "early", 0, 2.45e9, [-10, -10, -50, -50])
+        _add(catalog, "late", 10, 2.45e9, [-50, -50, -50, -10])
+        _add(catalog, "other_band", 2, 5.8e9, [-10, -10])
+        yield catalog
+
+
+def _names(rows) -> list[str]:
+    return [
+        row["path"].removeprefix("/data/").removesuffix(".h5") for row in rows
+    ]
+
+
+def test_time_range_keeps_overlapping_files(catalog):
+    assert _names(catalog.query(start_ns=3 * SECOND)) == [
+        "early",
+        "other_band",
+        "late",
+    ]
+    assert _names(catalog.query(start_ns=5 * SECOND)) == ["late"]
+    assert _names(catalog.query(end_ns=1 * SECOND)) == ["early"]
+    assert _names(catalog.query(start_ns=5 * SECOND, end_ns=9 * SECOND)) == []
+
+
+def test_frequency_keeps_files_covering_it(catalog):
+    assert _names(catalog.query(frequency=2.44e9)) == ["early", "late"]
+    assert _names(catalog.query(frequency=5.81e9)) == ["other_band"]
+    assert _names(catalog.query(frequency=3e9)) == []
+
+
+def test_min_power_counts_active_captures_in_the_time_range(catalog):
+    rows = catalog.query(min_power_db=-20)
+    assert _names(rows) == ["early", "other_band", "late"]
+    assert [row["active"] for row in rows] == [2, 2, 1]
+
+    # Only the quiet captures of "early" are in the range
+    rows = catalog.query(
+        start_ns=2 * SECOND, end_ns=12 * SECOND, min_power_db=-20
+    )
+    assert _names(rows) == ["other_band"]
+
+    rows = catalog.query(frequency=2.45e9, min_power_db=-60)
+    assert [row["active"] for row in rows] == [4, 4]
@@ -0,0 +1,72 @@
+import numpy as np
+import pytest
+
+from ares_iq.catalog import Catalog
+from ares_iq.channelizer import Channelizer, PolyphaseFilterBank
+from ares_iq.iq_data import IQData
+
+
+def _reference(
+    x: np.ndarray, channels: int, subband: int, taps: int
+) -> np.ndarray:
+    """Filter with the prototype moved to the subband, keep every channels-th.
+
+    Outputs are taken at the last sample of each block of `channels` inputs.
+    """
+    n = np.arange(channels * taps)
+    center = (len(n) - 1) / 2
+    h = np.sinc((n - center) / channels) * np.kaiser(len(n), 8.0) / channels
+    bandpass = h * np.exp(2j * np.pi * subband * n / channels)
+    filtered = np.convolve(x, bandpass)[: len(x)]
+    return filtered[channels - 1 :: channels]
+
+
+@pytest.mark.parametrize("channels, taps", [(4, 8), (8, 6), (5, 4)])
+def test_matches_direct_filtering(channels, taps, noise):
+    selected = list(range(-(channels // 2), (channels - 1) // 2 + 1))
+    bank = PolyphaseFilterBank(channels, selected, taps)
+    x = noise(channels * 300, channels)
+    # Pieces carry the filter history over
+    pieces = np.split(x, [channels, channels * 101, channels * 102])
+    y = np.concatenate([bank.process(piece) for piece in pieces], axis=1)
+
+    assert y.shape == (len(selected), 300)
+    for row, subband in zip(y, selected):
+        expected = _reference(x, channels, subband, taps)
+        scale = np.max(np.abs(expected))
+        assert np.max(np.abs(row - expected)) < 1e-4 * scale
+
+
+def test_tone_lands_in_its_subband():
+    channels = 8
+    selected = list(range(-4, 4))
+    bank = PolyphaseFilterBank(channels, selected, 8)
+    # Centered on subband -3
+    x = np.exp(2j * np.pi * -3 / channels * np.arange(channels * 512))
+    y = bank.process(x.astype(np.complex64))[:, 64:]
+
+    power = np.mean(np.abs(y) ** 2, axis=1)
+    assert np.argmax(power) == selected.index(-3)
+    assert np.all(np.delete(power, selected.index(-3)) < 1e-3 * power.max())
+
+
+def test_rejects_partial_blocks():
+    bank = PolyphaseFilterBank(4, [0])
+    with pytest.raises(ValueError, match="multiple of 4 channels"):
+        bank.process(np.zeros(6, dtype=np.complex64))
+
+
+def test_finalized_subbands_are_cataloged(noise):
+    with Channelizer(4, [-1, 1]) as channelizer:
+        for i in range(3):
+            iq = IQData()
+            iq.iq = noise(1024, i)
+            iq.ts_sec, iq.ts_nsec = 1_700_000_000 + i, 0
+            channelizer("a", iq)
+    paths = channelizer.finalize({"a": {"rate": 4e6, "center": 2.4e9}})
+
+    with Catalog() as catalog:
+        rows = catalog.query(kind="subband")
+    assert sorted(row["path"] for row in rows) == sorted(map(str, paths))
+    assert sorted(row["center"] for row in rows) == [2.399e9, 2.401e9]
+    assert all(row["bandwidth"] == 1e6 for row in rows)
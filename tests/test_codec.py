@@ -0,0 +1,109 @@
+import zlib
+
+import numpy as np
+import pytest
+
+from ares_iq.codec import (
+    CODERS,
+    SC16_SCALE,
+    IQCodec,
+    decode_block,
+    encode_block,
+    from_int16,
+    int16_scale,
+    to_int16,
+)
+from ares_iq.iq_data import IQData
+from ares_iq.save_iq_data import load_iq_data, save_iq_data
+
+
+def _sc16(values: np.ndarray) -> np.ndarray:
+    """int16 IQ pairs converted to complex64 like UHD converts sc16."""
+    return (values.astype(np.float32) / np.float32(SC16_SCALE)).view(
+        np.complex64
+    )[..., 0]
+
+
+def _usrp_captures(
+    captures: int = 4, samples: int = 4096, clipped: bool = False
+) -> np.ndarray:
+    rng = np.random.default_rng(1)
+    values = rng.normal(0, 3000, (captures, samples, 2))
+    if clipped:
+        values *= 20
+    return _sc16(np.clip(np.rint(values), -32768, 32767).astype(np.int16))
+
+
+@pytest.mark.parametrize(
+    "values",
+    [
+        np.zeros((64, 2)),
+        np.arange(-64, 64).reshape(64, 2),
+        np.full((64, 2), -32768),
+        np.random.default_rng(0).integers(-32768, 32768, (4096, 2)),
+    ],
+)
+def test_block_round_trip(values):
+    block = values.astype(np.int16)
+    compress = zlib.compress
+    assert np.array_equal(
+        decode_block(encode_block(block, compress, CODERS.index("zlib"))), block
+    )
+
+
+def test_codec_round_trip():
+    rng = np.random.default_rng(2)
+    blocks = rng.integers(-2000, 2000, (8, 1024, 2)).astype(np.int16)
+    with IQCodec("zlib") as codec:
+        assert np.array_equal(
+            np.stack(codec.decode(codec.encode(blocks))), blocks
+        )
+
+
+def test_usrp_samples_are_exact():
+    iq = _usrp_captures()
+    scale, exact = int16_scale(iq)
+    assert exact and scale == SC16_SCALE
+    assert np.array_equal(from_int16(to_int16(iq, scale), scale), iq)
+
+
+def test_clipped_usrp_samples_are_exact():
+    iq = _usrp_captures(clipped=True)
+    assert iq.real.min() == np.float32(-32768 / SC16_SCALE)
+    scale, exact = int16_scale(iq)
+    assert exact and scale == SC16_SCALE
+    values = to_int16(iq, scale)
+    assert values.min() == -32768 and values.max() == 32767
+    assert np.array_equal(from_int16(values, scale), iq)
+
+
+def test_float_samples_use_the_full_range():
+    iq = (
+        np.random.default_rng(3)
+        .normal(0, 1e-3, (2, 1024, 2))
+        .astype(np.float32)
+    ).view(np.complex64)[..., 0]
+    scale, exact = int16_scale(iq)
+    assert not exact
+    values = to_int16(iq, scale)
+    assert np.abs(values).max() == 32767
+    error = from_int16(values, scale).view(np.float32) - iq.view(np.float32)
+    # Half a step, plus the float32 rounding of values that land on a half
+    assert np.abs(error).max() <= 0.501 / scale
+
+
+def test_compressed_file_round_trip():
+    iq = _usrp_captures(clipped=True)
+    data = []
+    for i, capture in enumerate(iq):
+        item = IQData()
+        item.iq = capture
+        item.ts_sec, item.ts_nsec = 1_700_000_000, i * 1000
+        data.append(item)
+    with IQCodec("zlib") as codec:
+        path = save_iq_data(data, metadata={"rate": 25e6}, codec=codec)
+    loaded, ts = load_iq_data(path)
+    assert np.array_equal(loaded, iq)
+    assert np.array_equal(
+        ts, 1_700_000_000_000_000_000 + 1000 * np.arange(len(iq))
+    )
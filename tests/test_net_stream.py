@@ -0,0 +1,103 @@
+import threading
+
+import numpy as np
+import pytest
+
+from ares_iq.net_stream import (
+    DEFAULT_BATCH,
+    SAMPLE_BYTES,
+    NetworkReceiver,
+    NetworkSender,
+)
+
+START_NS = 1_700_000_000_000_000_000
+
+
+def _receive(
+    protocol: str,
+    send,
+    metadata: dict[str, dict] | None = None,
+    batch: int = DEFAULT_BATCH,
+    sequences: dict[str, int] | None = None,
+):
+    receiver = NetworkReceiver(f"{protocol}://127.0.0.1:0")
+    result = {}
+    thread = threading.Thread(
+        target=lambda: result.setdefault("ended", receiver.run(10, idle=2))
+    )
+    thread.start()
+    sender = NetworkSender(receiver.url, payload=4096, batch=batch)
+    send(sender)
+    sender.close(metadata or {"s": {"rate": 1e6}}, sequences)
+    thread.join()
+    assert result["ended"]
+    return receiver
+
+
+@pytest.mark.parametrize("protocol", ["udp", "tcp"])
+def test_captures_before_a_size_change_are_kept(protocol, noise):
+    first = [noise(5000, i) for i in range(5)]
+    last = noise(1234, 5)
+
+    def send(sender):
+        for i, iq in enumerate(first + [last]):
+            sender.send("s", iq, START_NS + i)
+
+    receiver = _receive(protocol, send)
+    assert receiver.stats()["s"].captures == 6
+    assert receiver.stats()["s"].lost == 0
+    streams = receiver.streams
+    assert sorted(streams) == ["s-0", "s-1"]
+    iq, ts = streams["s-0"]
+    assert np.array_equal(iq, np.stack(first))
+    assert np.array_equal(ts[:, 0], START_NS + np.arange(5))
+    iq, ts = streams["s-1"]
+    assert np.array_equal(iq, last[None])
+    assert ts[0, 0] == START_NS + 5
+
+
+@pytest.mark.parametrize(
+    "protocol, batch", [("udp", 1), ("udp", DEFAULT_BATCH), ("tcp", 1)]
+)
+def test_interleaved_streams_are_reassembled(protocol, batch, noise):
+    # 4096 byte payloads split each capture into 10 packets, the last one
+    # partial
+    samples = 10 * 4096 // SAMPLE_BYTES - 100
+    names = ["a", "b", "c"]
+    captures = {
+        name: [noise(samples, 10 * i + j) for j in range(4)]
+        for i, name in enumerate(names)
+    }
+    metadata = {
+        name: {"rate": 1e6 * (i + 1), "center": 2.4e9}
+        for i, name in enumerate(names)
+    }
+
+    def send(sender):
+        for j in range(4):
+            for name in names:
+                sender.send(name, captures[name][j], START_NS + j)
+
+    receiver = _receive(protocol, send, metadata, batch)
+    for name in names:
+        stats = receiver.stats()[name]
+        assert (stats.captures, stats.lost, stats.incomplete) == (4, 0, 0)
+    assert receiver.metadata == metadata
+    streams = receiver.streams
+    assert sorted(streams) == names
+    for name in names:
+        iq, ts = streams[name]
+        assert np.array_equal(iq, np.stack(captures[name]))
+        assert np.array_equal(ts[:, 0], START_NS + np.arange(4))
+
+
+@pytest.mark.parametrize("protocol", ["udp", "tcp"])
+def test_captures_lost_at_the_end_are_counted(protocol, noise):
+    def send(sender):
+        for i in (0, 2, 3):
+            sender.send("s", noise(1000, i), START_NS + i, sequence=i)
+
+    # The end of the stream counts captures 4 and 5 as sent but not received
+    receiver = _receive(protocol, send, sequences={"s": 6})
+    stats = receiver.stats()["s"]
+    assert (stats.captures, stats.lost) == (3, 3)
@@ -0,0 +1,96 @@
+import time
+
+import h5py
+import numpy as np
+
+from ares_iq.capture_stats import CaptureStats, load_stats
+from ares_iq.iq_data import IQData
+from ares_iq.segments import SegmentedWriter, read_segment_index
+from ares_iq.time_range import read_time_range, time_range_metadata
+
+RATE = 1e6
+SAMPLES = 1000
+PERIOD_NS = 1_000_000
+START_NS = 1_700_000_000_000_000_000
+METADATA = {"s0": {"rate": RATE, "center": 2.4e9, "platform": "test"}}
+
+
+def _capture(i: int) -> IQData:
+    capture = IQData()
+    ramp = np.arange(SAMPLES)
+    capture.iq = (ramp + 1j * (ramp[::-1] + i)).astype(np.complex64)
+    ts = START_NS + i * PERIOD_NS
+    capture.ts_sec, capture.ts_nsec = divmod(ts, 1_000_000_000)
+    return capture
+
+
+def _wait_for_segments(writer: SegmentedWriter, count: int):
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        index = read_segment_index(writer.directory)
+        if len(index["streams"].get("s0", {}).get("segments", [])) >= count:
+            return
+        time.sleep(0.01)
+    raise TimeoutError("segments weren't closed")
+
+
+def test_closed_segments_are_readable_during_the_recording():
+    # Five captures per segment
+    writer = SegmentedWriter(segment_seconds=0.005, metadata=lambda: METADATA)
+    stats = CaptureStats()
+    with stats, writer:
+        for i in range(12):
+            writer("s0", _capture(i))
+            stats("s0", _capture(i))
+        _wait_for_segments(writer, 2)
+
+        index = read_segment_index(writer.directory)
+        assert not index["complete"]
+        assert index["streams"]["s0"]["metadata"]["rate"] == RATE
+        first = writer.directory / index["streams"]["s0"]["segments"][0]["file"]
+        with h5py.File(first, "r") as f:
+            assert f.attrs["rate"] == RATE and f.attrs["center"] == 2.4e9
+
+        time_slice = read_time_range(
+            writer.directory, START_NS + 2 * PERIOD_NS, START_NS + 7 * PERIOD_NS
+        )
+        assert len(time_slice.samples) == 5 * SAMPLES
+        assert np.array_equal(
+            time_slice.timestamps, START_NS + PERIOD_NS * np.arange(2, 7)
+        )
+        assert time_range_metadata(writer.directory, "s0")["rate"] == RATE
+
+        # A reader holding a segment open doesn't stop the recording
+        reader = h5py.File(first, "r")
+    try:
+        writer.finalize(METADATA, stats)
+    finally:
+        reader.close()
+
+    index = read_segment_index(writer.directory)
+    assert index["complete"]
+    segments = index["streams"]["s0"]["segments"]
+    assert sum(segment["captures"] for segment in segments) == 12
+    columns = load_stats(writer.directory / segments[0]["file"])
+    assert len(columns["power_mean_db"]) == segments[0]["captures"]
+    assert np.isfinite(columns["power_mean_db"]).all()
+
+
+def test_time_range_across_segments_matches_the_samples():
+    writer = SegmentedWriter(segment_seconds=0.003, metadata=lambda: METADATA)
+    with writer:
+        for i in range(10):
+            writer("s0", _capture(i))
+    writer.finalize(METADATA)
+
+    # From the middle of capture 1 to the middle of capture 8
+    start = START_NS + PERIOD_NS + 250_000
+    end = START_NS + 8 * PERIOD_NS + 500_000
+    time_slice = read_time_range(writer.directory, start, end)
+    expected = np.concatenate([_capture(i).iq for i in range(10)])[
+        SAMPLES + 250 : 8 * SAMPLES + 500
+    ]
+    assert np.array_equal(time_slice.samples, expected)
+    times = time_slice.sample_times()
+    assert times[0] == start and times[-1] == end - 1000
+    assert np.all(np.diff(times) == 1000)
@@ -0,0 +1,80 @@
+import uuid
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from ares_iq import shm_ring
+from ares_iq.iq_data import IQData
+from ares_iq.shm_ring import SharedRingReader, SharedRingWriter
+
+
+def _write(writer: SharedRingWriter, sequence: int):
+    iq = IQData()
+    iq.iq = np.full(16, sequence, dtype=np.complex64)
+    iq.ts_sec, iq.ts_nsec = 0, sequence
+    writer("a", iq)
+
+
+@pytest.fixture
+def writer(monkeypatch):
+    # Readers unregister the segment they attach to from the resource tracker,
+    # which in the writer's process would drop the writer's registration
+    monkeypatch.setattr(
+        shm_ring,
+        "resource_tracker",
+        SimpleNamespace(unregister=lambda *_: None),
+    )
+    with SharedRingWriter(f"ares-test-{uuid.uuid4().hex[:8]}", 4) as writer:
+        yield writer
+
+
+def _reader(writer: SharedRingWriter, oldest: bool = False):
+    return SharedRingReader(writer.names[0], oldest)
+
+
+def test_lapped_reader_skips_to_the_oldest_capture(writer):
+    _write(writer, 0)
+    with _reader(writer) as reader:
+        for sequence in range(1, 10):
+            _write(writer, sequence)
+
+        # Captures 1 to 6 were overwritten in the ring of 4 slots, and the
+        # slot after the newest isn't read since it's written next
+        slots = [reader.read(timeout=0) for _ in range(3)]
+        assert [slot.sequence for slot in slots] == [7, 8, 9]
+        assert [slot.lapped for slot in slots] == [6, 0, 0]
+        assert [slot.timestamp for slot in slots] == [7, 8, 9]
+        assert slots[0].samples[0] == 7
+        assert reader.lapped == 6
+
+
+def test_reader_catches_up_without_being_lapped(writer):
+    _write(writer, 0)
+    with _reader(writer, oldest=True) as reader:
+        for sequence in range(1, 3):
+            _write(writer, sequence)
+        slots = [reader.read(timeout=0) for _ in range(3)]
+        assert [slot.sequence for slot in slots] == [0, 1, 2]
+        assert reader.lapped == 0
+        with pytest.raises(TimeoutError):
+            reader.read(timeout=0)
+
+
+def test_held_slot_is_invalid_once_overwritten(writer):
+    _write(writer, 0)
+    with _reader(writer) as reader:
+        _write(writer, 1)
+        slot = reader.read(timeout=0)
+        assert reader.valid(slot)
+        for sequence in range(2, 6):
+            _write(writer, sequence)
+        assert not reader.valid(slot)
+
+
+def test_closed_ring_ends_the_reader(writer):
+    _write(writer, 0)
+    with _reader(writer) as reader:
+        _write(writer, 1)
+        writer.close()
+        assert [slot.sequence for slot in reader] == [1]
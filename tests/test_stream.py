@@ -0,0 +1,130 @@
+import asyncio
+import threading
+import time
+
+import numpy as np
+
+from ares_iq.iq_data import IQData
+from ares_iq.stream import astream_iq, stream_iq
+
+START_NS = 1_700_000_000_000_000_000
+
+
+class _FakePlatform:
+    """Delivers `captures` numbered captures of each stream per pass."""
+
+    def __init__(self, streams=("a",), captures=8, samples=16):
+        self.streams = streams
+        self.captures = captures
+        self.samples = samples
+        self.passes = 0
+        self.configure_thread: int | None = None
+        self._listeners = []
+        self._count = 0
+
+    @property
+    def stream_metadata(self) -> dict[str, dict]:
+        return {stream: {"rate": 1e6} for stream in self.streams}
+
+    def configure(self, center, bw, extra_verbose=False):
+        self.configure_thread = threading.get_ident()
+
+    def reserve(self, file_size, buffers=1):
+        pass
+
+    def add_capture_listener(self, listener):
+        self._listeners.append(listener)
+
+    def remove_capture_listener(self, listener):
+        self._listeners.remove(listener)
+
+    def capture_iq(self, center, bw, file_size, verbose, extra_verbose):
+        self.passes += 1
+        for _ in range(self.captures):
+            for stream in self.streams:
+                iq = IQData()
+                iq.iq = np.full(self.samples, self._count, dtype=np.complex64)
+                iq.ts_sec, iq.ts_nsec = divmod(
+                    START_NS + self._count, 1_000_000_000
+                )
+                for listener in self._listeners:
+                    listener(stream, iq)
+            self._count += 1
+
+
+def test_astream_opens_the_device_off_the_event_loop():
+    platform = _FakePlatform()
+
+    async def consume():
+        batches = []
+        async for batch in astream_iq(platform, 2.4e9, 20e6, batch=4):
+            batches.append(batch.timestamps.copy())
+            if len(batches) == 2:
+                break
+        return threading.get_ident(), batches
+
+    loop_thread, batches = asyncio.run(consume())
+    assert platform.configure_thread not in (None, loop_thread)
+    assert np.array_equal(np.concatenate(batches), START_NS + np.arange(8))
+
+
+def _take(stream, count, pause=0.0):
+    batches = []
+    for batch in stream:
+        # Buffers go back to the pool when the next batch is taken
+        batches.append(
+            batch._replace(
+                samples=batch.samples.copy(),
+                timestamps=batch.timestamps.copy(),
+            )
+        )
+        if len(batches) == count:
+            break
+        time.sleep(pause)
+    stream.close()
+    return batches
+
+
+def test_batches_end_at_each_pass_gap():
+    platform = _FakePlatform(captures=6)
+    batches = _take(stream_iq(platform, 2.4e9, 20e6, batch=4), 4)
+
+    assert [len(batch.timestamps) for batch in batches] == [4, 2, 4, 2]
+    assert [batch.discontinuity for batch in batches] == [
+        False,
+        False,
+        True,
+        False,
+    ]
+    assert [batch.sequence for batch in batches] == [0, 1, 2, 3]
+
+
+def test_block_waits_for_the_consumer():
+    platform = _FakePlatform(captures=1000)
+    stream = stream_iq(platform, 2.4e9, 20e6, batch=4, depth=2)
+    batches = _take(stream, 10, pause=0.01)
+
+    timestamps = np.concatenate([batch.timestamps for batch in batches])
+    assert np.array_equal(timestamps, START_NS + np.arange(40))
+    assert all(batch.dropped == 0 for batch in batches)
+    for batch in batches:
+        assert np.array_equal(
+            batch.samples[:, 0].real, batch.timestamps - START_NS
+        )
+
+
+def test_drop_counts_captures_while_the_consumer_is_behind():
+    platform = _FakePlatform(captures=1000)
+    stream = stream_iq(
+        platform, 2.4e9, 20e6, batch=4, depth=2, backpressure="drop"
+    )
+    first = next(stream)
+    time.sleep(0.1)
+    batches = _take(stream, 2)
+
+    assert first.dropped == 0
+    assert batches[-1].dropped > 0
+    assert [batch.sequence for batch in batches] == [1, 2]
+    # The batch already queued is intact, captures are missing after it
+    assert np.array_equal(batches[0].timestamps, START_NS + np.arange(4, 8))
+    assert batches[1].timestamps[0] > START_NS + 8
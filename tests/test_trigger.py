@@ -0,0 +1,47 @@
+import h5py
+import numpy as np
+
+from ares_iq.iq_data import IQData
+from ares_iq.trigger import TriggeredRecorder
+
+
+def _record(recorder: TriggeredRecorder, powers_db: list[float]):
+    """Feed one capture per power, the timestamp being its index."""
+    with recorder:
+        for index, power_db in enumerate(powers_db):
+            iq = IQData()
+            iq.iq = np.full(32, 10 ** (power_db / 20), dtype=np.complex64)
+            iq.ts_sec, iq.ts_nsec = 0, index
+            recorder("a", iq)
+
+
+def _event_timestamps(recorder: TriggeredRecorder) -> list[list[int]]:
+    timestamps = []
+    for path in recorder.events:
+        with h5py.File(path, "r") as f:
+            timestamps.append(f["iq_ts"][:, 0].tolist())
+    return timestamps
+
+
+def test_saves_pre_and_post_trigger_captures():
+    recorder = TriggeredRecorder(-10, 3, pre_blocks=2, post_blocks=2)
+    _record(recorder, [-30] * 5 + [-5, -5] + [-30] * 5)
+
+    # Two before the trigger at 5, two after the power fell at 7
+    assert _event_timestamps(recorder) == [[3, 4, 5, 6, 7, 8]]
+
+
+def test_pre_trigger_is_limited_to_the_captures_seen():
+    recorder = TriggeredRecorder(-10, 3, pre_blocks=4, post_blocks=0)
+    _record(recorder, [-30, -5, -30, -30])
+
+    assert _event_timestamps(recorder) == [[0, 1]]
+
+
+def test_hysteresis_holds_the_event_open():
+    recorder = TriggeredRecorder(-10, 3, pre_blocks=0, post_blocks=1)
+    # -12 dB is below the threshold but above the release level of -13 dB:
+    # it doesn't start an event, but doesn't end one either
+    _record(recorder, [-12, -12, -5, -12, -12, -20, -20, -20, -5, -20, -20])
+
+    assert _event_timestamps(recorder) == [[2, 3, 4, 5], [8, 9]]